@@ -4,6 +4,7 @@ from fastapi import FastAPI
 
 from confs import c
 from engine.database.redis.server import redis_client
+from engine.database.redis.async_server import async_redis_client
 from env import IS_DEV_ENV
 from .external import postgres_conn
 
@@ -30,5 +31,7 @@ def create_app():
         app.config = c
     c.init_app(app)
     redis_client.init_app(app)
+    async_redis_client.init_app(app)
+    app.add_event_handler('shutdown', postgres_conn.async_dispose)
 
     return app
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf8 -*-
+"""
+PostgresConn.select 物化查询与流式查询（stream_）的内存对比
+
+    python -m benchmarks.postgres_stream_memory [--uri postgresql+psycopg://...] [--rows 1000000]
+        [--batch-size 5000] [--modes fetchall,orm,stream,stream_batches]
+
+首次运行时创建 bench_stream_rows 表并用 generate_series 填充 --rows 行；每种模式在独立子进程中执行，
+分别统计 tracemalloc 峰值与进程最大 RSS。未指定 --uri 时使用当前环境配置的数据库。
+"""
+import argparse
+import multiprocessing
+import resource
+import time
+import tracemalloc
+
+from sqlalchemy import text
+
+TABLE = 'bench_stream_rows'
+
+CREATE_SQL = f"""
+CREATE TABLE IF NOT EXISTS {TABLE} (
+    id bigint PRIMARY KEY,
+    device_id integer NOT NULL,
+    value double precision NOT NULL,
+    payload text NOT NULL,
+    created_at timestamptz NOT NULL
+)
+"""
+
+FILL_SQL = f"""
+INSERT INTO {TABLE} (id, device_id, value, payload, created_at)
+SELECT i, i % 1000, random() * 100, md5(i::text) || md5((i * 7)::text), now() - (i || ' seconds')::interval
+FROM generate_series(1, :rows) AS i
+"""
+
+
+def prepare(uri, rows):
+    from engine.database.postgres.server import PostgresConn
+    conn = PostgresConn().from_uri(uri)
+    with conn.engine.begin() as connection:
+        connection.execute(text(CREATE_SQL))
+        count = connection.execute(text(f"SELECT count(*) FROM {TABLE}")).scalar()
+        if count != rows:
+            print(f"filling {TABLE} with {rows} rows ...")
+            connection.execute(text(f"TRUNCATE {TABLE}"))
+            connection.execute(text(FILL_SQL), {'rows': rows})
+    conn.engine.dispose()
+
+
+def run(uri, mode, batch_size, queue):
+    from engine.database.postgres.server import PostgresConn
+    conn = PostgresConn().from_uri(uri)
+    model = conn.metadata_table(TABLE)
+    tracemalloc.start()
+    st = time.perf_counter()
+    count = 0
+    if mode == 'fetchall':
+        count = len(conn.select(model.__table__))
+    elif mode == 'orm':
+        count = len(conn.select(model).all())
+    elif mode == 'stream':
+        for _ in conn.select(model.__table__, stream_=True):
+            count += 1
+    elif mode == 'stream_batches':
+        for batch in conn.select(model.__table__, stream_=batch_size):
+            count += len(batch)
+    else:
+        raise ValueError(f"Unknown mode: {mode}")
+    elapsed = time.perf_counter() - st
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    conn.engine.dispose()
+    queue.put({
+        'rows': count,
+        'seconds': elapsed,
+        'peak_mb': peak / 1024 / 1024,
+        'maxrss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--uri', default=None, help='数据库地址，默认使用配置中的 SQLALCHEMY_DATABASE_URI')
+    parser.add_argument('--rows', type=int, default=1000000, help='测试表行数')
+    parser.add_argument('--batch-size', type=int, default=5000, help='stream_batches 模式的批量大小')
+    parser.add_argument('--modes', default='fetchall,orm,stream,stream_batches', help='逗号分隔的模式')
+    args = parser.parse_args()
+
+    uri = args.uri
+    if uri is None:
+        from confs import c
+        uri = c.SQLALCHEMY_DATABASE_URI
+
+    prepare(uri, args.rows)
+    print(f"rows={args.rows} batch_size={args.batch_size}")
+    print(f"{'mode':>16}{'rows':>10}{'seconds':>10}{'rows/s':>12}{'py_peak(MB)':>14}{'maxrss(MB)':>12}")
+    for mode in [mode for mode in args.modes.split(',') if mode]:
+        queue = multiprocessing.Queue()
+        process = multiprocessing.Process(target=run, args=(uri, mode, args.batch_size, queue))
+        process.start()
+        result = queue.get()
+        process.join()
+        print(f"{mode:>16}{result['rows']:>10}{result['seconds']:>10.2f}{result['rows'] / result['seconds']:>12.0f}"
+              f"{result['peak_mb']:>14.1f}{result['maxrss_mb']:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
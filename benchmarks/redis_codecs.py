@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf8 -*-
+"""
+Redis 编解码器基准：对比各编解码器在典型缓存数据上的编码/解码耗时与体积
+
+    python -m benchmarks.redis_codecs [--number 20]
+"""
+import argparse
+import random
+import string
+import time
+from datetime import datetime
+
+from modules.fastapi_redis.codecs import CODECS, decode
+from utils.mapping import MAX_EXPORT_TOTAL
+
+
+def _random_str(length):
+    return ''.join(random.choices(string.ascii_letters + string.digits, k=length))
+
+
+def build_payloads():
+    """构造与线上缓存相近的数据：设备列表、嵌套配置、小字典、字符串列表"""
+    random.seed(2024)
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    device_rows = [{
+        'id': i,
+        'device_id': _random_str(26),
+        'device_name': f'空调-{i}',
+        'room_id': random.randint(1, 5000),
+        'station_name': f'局站{random.randint(1, 300)}',
+        'status': random.choice([0, 1, 2]),
+        'value': round(random.random() * 100, 3),
+        'update_time': now,
+    } for i in range(MAX_EXPORT_TOTAL)]
+    nested = {
+        f'room:{i}': {'points': {f'p{j}': round(random.random(), 4) for j in range(20)},
+                      'alarms': [_random_str(12) for _ in range(5)]}
+        for i in range(200)
+    }
+    small = {'user_id': _random_str(26), 'token': _random_str(64), 'expire': 7200, 'roles': [1, 2, 3]}
+    strings = [_random_str(32) for _ in range(2000)]
+    return {
+        'device_rows(5000)': device_rows,
+        'nested_rooms(200)': nested,
+        'small_dict': small,
+        'string_list(2000)': strings,
+    }
+
+
+def bench(codec, payload, number):
+    encoded = codec.encode(payload)
+    st = time.perf_counter()
+    for _ in range(number):
+        codec.encode(payload)
+    encode_ms = (time.perf_counter() - st) * 1000 / number
+    st = time.perf_counter()
+    for _ in range(number):
+        decode(encoded)
+    decode_ms = (time.perf_counter() - st) * 1000 / number
+    return encode_ms, decode_ms, len(encoded)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--number', type=int, default=20, help='每项重复次数')
+    args = parser.parse_args()
+
+    for payload_name, payload in build_payloads().items():
+        print(f'\n== {payload_name}')
+        print(f"{'codec':<16}{'encode(ms)':>12}{'decode(ms)':>12}{'size(B)':>12}{'ratio':>8}")
+        baseline = None
+        for name, codec in sorted(CODECS.items()):
+            try:
+                encode_ms, decode_ms, size = bench(codec, payload, args.number)
+            except TypeError as e:
+                print(f'{name:<16}  unsupported: {e}')
+                continue
+            baseline = baseline or len(CODECS['pickle'].encode(payload))
+            print(f'{name:<16}{encode_ms:>12.3f}{decode_ms:>12.3f}{size:>12}{size / baseline:>8.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf8 -*-
+"""
+Redis 连接池争用压测：模拟 gunicorn 单进程多线程并发访问，观察连接池大小对吞吐、
+命令耗时与取连接等待的影响
+
+    python -m benchmarks.redis_pool_contention [--url redis://:pwd@host:6379/2]
+        [--threads 50] [--pool-sizes 8,16,32,64] [--seconds 10] [--value-size 1024] [--pipeline 0]
+
+未指定 --url 时使用当前环境 redis 配置的单节点地址
+"""
+import argparse
+import os
+import threading
+import time
+
+from modules.fastapi_redis.pool import Histogram, MetricsBlockingConnectionPool, pool_metrics
+from redis import StrictRedis
+from redis.exceptions import ConnectionError
+
+
+def worker(client, keys, value, deadline, pipeline, latency, errors, lock):
+    local = Histogram()
+    failed = 0
+    index = 0
+    while time.perf_counter() < deadline:
+        key = keys[index % len(keys)]
+        index += 1
+        st = time.perf_counter()
+        try:
+            if pipeline:
+                with client.pipeline(transaction=False) as pipe:
+                    for offset in range(pipeline):
+                        pipe.get(keys[(index + offset) % len(keys)])
+                    pipe.execute()
+            elif index % 10 == 0:
+                client.set(key, value, ex=300)
+            else:
+                client.get(key)
+        except ConnectionError:
+            failed += 1
+            continue
+        local.observe(time.perf_counter() - st)
+    with lock:
+        for position, count in enumerate(local.counts):
+            latency.counts[position] += count
+        latency.count += local.count
+        latency.total += local.total
+        latency.max = max(latency.max, local.max)
+        errors[0] += failed
+
+
+def run(url, threads, pool_size, seconds, value_size, pipeline, timeout):
+    pool = MetricsBlockingConnectionPool.from_url(url, max_connections=pool_size, timeout=timeout)
+    client = StrictRedis(connection_pool=pool)
+    keys = [f"bench:pool:{os.getpid()}:{i}" for i in range(1000)]
+    value = os.urandom(value_size)
+    with client.pipeline(transaction=False) as pipe:
+        for key in keys:
+            pipe.set(key, value, ex=300)
+        pipe.execute()
+
+    pool_metrics.reset()
+    latency, errors, lock = Histogram(), [0], threading.Lock()
+    deadline = time.perf_counter() + seconds
+    workers = [threading.Thread(target=worker, args=(client, keys, value, deadline, pipeline, latency, errors, lock))
+               for _ in range(threads)]
+    st = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - st
+
+    stats = pool_metrics.snapshot()[pool.node_name]
+    client.delete(*keys)
+    pool.disconnect()
+    return {
+        'ops': latency.count,
+        'qps': latency.count / elapsed,
+        'latency': latency.as_dict(),
+        'errors': errors[0],
+        'wait': stats['wait'],
+        'timeouts': stats['timeouts'],
+        'created': stats['created'],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default=None, help='Redis 地址，默认使用配置中的单节点地址')
+    parser.add_argument('--threads', type=int, default=50, help='并发线程数')
+    parser.add_argument('--pool-sizes', default='8,16,32,64', help='逗号分隔的连接池大小')
+    parser.add_argument('--seconds', type=float, default=10, help='每轮持续秒数')
+    parser.add_argument('--value-size', type=int, default=1024, help='值大小（字节）')
+    parser.add_argument('--pipeline', type=int, default=0, help='大于 0 时每次请求为包含该数量 GET 的管道')
+    parser.add_argument('--timeout', type=float, default=5, help='取连接最长等待秒数')
+    args = parser.parse_args()
+
+    url = args.url
+    if url is None:
+        from confs import redis_conf
+        url = redis_conf.REDIS_URI
+
+    print(f"threads={args.threads} seconds={args.seconds} value_size={args.value_size} pipeline={args.pipeline}")
+    print(f"{'pool':>6}{'qps':>12}{'p50(ms)':>10}{'p99(ms)':>10}{'max(ms)':>10}"
+          f"{'wait_p99(ms)':>14}{'wait_max(ms)':>14}{'timeouts':>10}{'conns':>8}")
+    for pool_size in [int(size) for size in args.pool_sizes.split(',') if size]:
+        result = run(url, args.threads, pool_size, args.seconds, args.value_size, args.pipeline, args.timeout)
+        latency, wait = result['latency'], result['wait']
+        print(f"{pool_size:>6}{result['qps']:>12.0f}{latency['p50_ms']:>10.3f}{latency['p99_ms']:>10.3f}"
+              f"{latency['max_ms']:>10.3f}{wait['p99_ms']:>14.3f}{wait['max_ms']:>14.3f}"
+              f"{result['timeouts']:>10}{result['created']:>8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -85,6 +85,21 @@ class Config(BaseConfig):
     SQLALCHEMY_POOL_RECYCLE = int(os.environ.get("SQLALCHEMY_POOL_RECYCLE", 30))
     # 连接池的连接超时时间
     SQLALCHEMY_POOL_TIMEOUT = int(os.environ.get("SQLALCHEMY_POOL_TIMEOUT", 60))
+    # 异步引擎连接池（与同步引擎相互独立），默认与同步引擎一致
+    SQLALCHEMY_ASYNC_POOL_SIZE = int(os.environ.get("SQLALCHEMY_ASYNC_POOL_SIZE", SQLALCHEMY_POOL_SIZE))
+    SQLALCHEMY_ASYNC_MAX_OVERFLOW = int(os.environ.get("SQLALCHEMY_ASYNC_MAX_OVERFLOW", SQLALCHEMY_MAX_OVERFLOW))
+    # 表反射磁盘缓存目录（按库结构哈希失效），为空时只缓存在进程内
+    SQLALCHEMY_REFLECTION_CACHE_DIR = os.environ.get("SQLALCHEMY_REFLECTION_CACHE_DIR")
+    # 流式查询（select stream_）每次从服务端游标读取的行数
+    SQLALCHEMY_STREAM_BATCH_SIZE = int(os.environ.get("SQLALCHEMY_STREAM_BATCH_SIZE", 1000))
+    # SQLAlchemy 编译缓存（每个引擎）可缓存的语句数
+    SQLALCHEMY_QUERY_CACHE_SIZE = int(os.environ.get("SQLALCHEMY_QUERY_CACHE_SIZE", 1200))
+    # select 查询形状缓存可缓存的语句数
+    SQLALCHEMY_SHAPE_CACHE_SIZE = int(os.environ.get("SQLALCHEMY_SHAPE_CACHE_SIZE", 512))
+    # psycopg 同一连接上执行同一语句达到该次数后使用服务端预备语句，0 为首次即预备，none 为关闭；
+    # 默认 5 与 psycopg 自身默认值相同，仅作为调优入口（如经 PgBouncer 事务模式连接时设为 none）
+    SQLALCHEMY_PREPARE_THRESHOLD = None if os.environ.get("SQLALCHEMY_PREPARE_THRESHOLD", "5").lower() == 'none' \
+        else int(os.environ.get("SQLALCHEMY_PREPARE_THRESHOLD", 5))
     SQLALCHEMY_ENGINE_OPTIONS = {'pool_pre_ping': True, 'pool_use_lifo': True, 'echo': False}
 
     def __init__(self, config_path=None):
@@ -160,6 +175,27 @@ class RedisConf(BaseConfig):
         self.startup_nodes = self.redis.get('startup_nodes', [])
         self.use_cluster = True if self.startup_nodes else False
         self.REDIS_URI = self.create_redis_uri()
+        # 近端缓存配置，为空时不启用
+        self.near_cache = self.redis.get('near_cache') or {}
+        # 默认编解码器及按键前缀指定的编解码器
+        self.codec = self.redis.get('codec', 'pickle')
+        self.prefix_codecs = self.redis.get('prefix_codecs') or {}
+        # 序列化结果超过阈值（字节）时压缩，为空不压缩
+        self.compress_threshold = self.redis.get('compress_threshold')
+        self.compressor = self.redis.get('compressor', 'zlib')
+        # 集群多节点并发批量操作的线程数
+        self.fanout_workers = self.redis.get('fanout_workers', 16)
+        # 连接池配置，未配置的项使用 modules.fastapi_redis.pool.DEFAULT_POOL_CONFIG
+        self.pool = self.redis.get('pool') or {}
+        # 读请求默认走副本（集群或 Sentinel 模式），策略 round_robin / least_latency
+        self.read_from_replicas = bool(self.redis.get('read_from_replicas', False))
+        self.replica_strategy = self.redis.get('replica_strategy', 'round_robin')
+        # Sentinel 配置：{sentinels: [{host, port}], service_name, password}，配置后单节点模式改用 Sentinel
+        self.sentinel = self.redis.get('sentinel') or {}
+        # 命令埋点：{enabled, slow_ms, sinks: [prometheus, statsd], statsd: {host, port, prefix}, prometheus_path}
+        self.instrumentation = self.redis.get('instrumentation') or {}
+        # 异步回写：{max_pending, batch_size, flush_interval, overflow, block_timeout}，为空时不启用
+        self.write_behind = self.redis.get('write_behind') or {}
 
 
 class KafkaConf(BaseConfig):
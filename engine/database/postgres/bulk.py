@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+# -*- coding: utf8 -*-
+"""
+基于 psycopg 3 COPY ... FROM STDIN (FORMAT BINARY) 的批量写入
+
+    - bulk_insert：COPY 直接写入目标表
+    - bulk_upsert：COPY 写入事务级临时表（ON COMMIT DROP），再 INSERT ... SELECT ... ON CONFLICT 合并到目标表，
+      同一批次内冲突键重复时保留最后一行
+
+行可以是 dict（键为列名或映射属性名）、与 columns 顺序一致的 tuple/list、或映射类实例；输入可以是生成器，
+按 chunk_size 分批，每批一个事务。未提供的列按列的 Python 端 default（标量或无参函数）填充，与 ORM 插入一致，
+其余缺省列由数据库默认值填充。二进制 COPY 的列类型 OID 取自 pg_attribute 并按表缓存。
+
+写入的列在未指定 columns 时由第一行推断，之后每一行使用同一列集合：映射类实例写入全部列（为 None 的列使用
+Python 端 default），只有数据库端生成的列（server_default / 自增主键）在第一行为 None 时整批省略；
+之后的行为这些列提供了值时抛出 ValueError，各行提供的列不一致时需显式传入 columns。
+dict 行出现写入列集合以外的键时抛出 ValueError；缺少的键使用该列的 Python 端 default，没有 default 时
+抛出 ValueError，显式传入 columns 时缺少的键写入 NULL。
+"""
+import itertools
+import logging
+import threading
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from psycopg import sql
+from sqlalchemy import Table
+
+logger = logging.getLogger('cloud-postgres')
+
+COLUMN_TYPES_SQL = """
+SELECT attname, atttypid FROM pg_attribute
+WHERE attrelid = %s::regclass AND attnum > 0 AND NOT attisdropped
+"""
+
+
+def _python_default(column):
+    """列的 Python 端默认值生成函数，没有或为 SQL 表达式 / 序列时返回 None"""
+    default = column.default
+    if default is None or not (default.is_scalar or default.is_callable):
+        return None
+    if default.is_scalar:
+        return lambda: default.arg
+    return lambda: default.arg(None)
+
+
+def _python_onupdate(column):
+    onupdate = column.onupdate
+    if onupdate is None or not (onupdate.is_scalar or onupdate.is_callable):
+        return None
+    return onupdate.arg if onupdate.is_scalar else onupdate.arg(None)
+
+
+class _Plan(object):
+    """一次批量写入的列与取值方式"""
+
+    def __init__(self, table: Table, mapper, first, columns: Optional[Sequence[str]]):
+        self.table = table
+        self.explicit = columns is not None
+        # {列名: 属性名}
+        attrs = {}
+        if mapper is not None:
+            for prop in mapper.column_attrs:
+                for column in prop.columns:
+                    if column.table is table:
+                        attrs[column.name] = prop.key
+        self.attrs = attrs
+        self.kind = 'dict' if isinstance(first, dict) else 'sequence' if isinstance(first, (tuple, list)) else 'object'
+
+        if columns is not None:
+            provided = list(columns)
+        elif self.kind == 'dict':
+            keys = {column.name: column.name for column in table.columns}
+            keys.update({attr: name for name, attr in attrs.items()})
+            provided = [keys[key] for key in first if key in keys]
+            unknown = [key for key in first if key not in keys]
+            if unknown:
+                raise ValueError(f"Unknown columns for {table.fullname}: {unknown}")
+        elif self.kind == 'sequence':
+            provided = [column.name for column in table.columns]
+        else:
+            provided = [column.name for column in table.columns
+                        if not (getattr(first, attrs.get(column.name, column.name), None) is None
+                                and self._server_generated(column))]
+        # 按第一行推断时省略的数据库端生成列，之后的行不能为其提供值
+        self.omitted = [(column.name, attrs.get(column.name, column.name)) for column in table.columns
+                        if columns is None and self.kind == 'object' and column.name not in provided]
+        missing = [name for name in provided if name not in table.columns]
+        if missing:
+            raise ValueError(f"Unknown columns for {table.fullname}: {missing}")
+        self.provided = provided
+        # 未提供但有 Python 端默认值的列
+        self.defaults = [(column.name, _python_default(column)) for column in table.columns
+                         if column.name not in provided and _python_default(column) is not None]
+        self.columns = provided + [name for name, _ in self.defaults]
+
+    def _server_generated(self, column) -> bool:
+        """取值由数据库生成（server_default、序列或自增），没有 Python 端 default 可以代替"""
+        if _python_default(column) is not None:
+            return False
+        return (column.default is not None or column.server_default is not None
+                or column is self.table.autoincrement_column)
+
+    def rows(self, rows: Iterable) -> Iterable[list]:
+        provided, attrs, defaults = self.provided, self.attrs, self.defaults
+        if self.kind == 'dict':
+            keys = [(name, attrs.get(name, name), _python_default(self.table.columns[name])) for name in provided]
+            accepted = {key for name, attr, _ in keys for key in (name, attr)}
+            explicit, fullname = self.explicit, self.table.fullname
+
+            def extract(row):
+                extra = [key for key in row if key not in accepted]
+                if extra:
+                    raise ValueError(f"Unexpected columns for {fullname}: {extra}, "
+                                     f"pass columns= explicitly for rows with different columns")
+                values = []
+                for name, attr, default in keys:
+                    if name in row:
+                        values.append(row[name])
+                    elif attr in row:
+                        values.append(row[attr])
+                    elif default is not None:
+                        values.append(default())
+                    elif explicit:
+                        values.append(None)
+                    else:
+                        raise ValueError(f"Column {name} is missing and has no Python default, "
+                                         f"pass columns= explicitly for rows with different columns")
+                return values
+        elif self.kind == 'sequence':
+            def extract(row):
+                return list(row)
+        else:
+            keys = [attrs.get(name, name) for name in provided]
+            # 实例上为 None 的列使用默认值
+            fallbacks = [(position, _python_default(self.table.columns[name]))
+                         for position, name in enumerate(provided)]
+            fallbacks = [(position, default) for position, default in fallbacks if default is not None]
+
+            omitted = self.omitted
+
+            def extract(row):
+                for name, attr in omitted:
+                    if getattr(row, attr, None) is not None:
+                        raise ValueError(f"Column {name} was omitted because it is None in the first row, "
+                                         f"pass columns= explicitly for rows with different columns")
+                values = [getattr(row, attr) for attr in keys]
+                for position, default in fallbacks:
+                    if values[position] is None:
+                        values[position] = default()
+                return values
+
+        for row in rows:
+            values = extract(row)
+            for _, default in defaults:
+                values.append(default())
+            yield values
+
+
+class BulkLoader(object):
+    """单个引擎的批量写入"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self._lock = threading.Lock()
+        self._types: Dict[str, Dict[str, int]] = {}
+
+    @staticmethod
+    def resolve(table):
+        """返回 (Table, mapper)，table 可以是 Table、映射类（BaseModel 子类 / automap 类）"""
+        if isinstance(table, Table):
+            return table, None
+        mapped_table = getattr(table, '__table__', None)
+        if mapped_table is None:
+            raise TypeError(f"Unsupported table: {table!r}")
+        return mapped_table, getattr(table, '__mapper__', None)
+
+    @staticmethod
+    def _identifier(table: Table) -> sql.Identifier:
+        return sql.Identifier(table.schema, table.name) if table.schema else sql.Identifier(table.name)
+
+    def column_types(self, cursor, table: Table) -> Dict[str, int]:
+        """{列名: 类型 OID}"""
+        key = table.fullname
+        types = self._types.get(key)
+        if types is None:
+            cursor.execute(COLUMN_TYPES_SQL, (self._identifier(table).as_string(cursor),))
+            types = dict(cursor.fetchall())
+            with self._lock:
+                self._types[key] = types
+        return types
+
+    def oids(self, cursor, table: Table, columns: Sequence[str]) -> List[int]:
+        """列类型 OID，缓存中缺少列（表结构已变化）时重新查询"""
+        types = self.column_types(cursor, table)
+        if any(name not in types for name in columns):
+            with self._lock:
+                self._types.pop(table.fullname, None)
+            types = self.column_types(cursor, table)
+        return [types[name] for name in columns]
+
+    def invalidate(self) -> None:
+        """表结构变化后清空列类型缓存"""
+        with self._lock:
+            self._types.clear()
+
+    @staticmethod
+    def _chunks(rows: Iterable, chunk_size: Optional[int]):
+        if not chunk_size:
+            yield rows
+            return
+        while True:
+            chunk = list(itertools.islice(rows, chunk_size))
+            if not chunk:
+                return
+            yield chunk
+
+    def _copy(self, cursor, target, plan: _Plan, oids: List[int], rows) -> int:
+        statement = sql.SQL("COPY {} ({}) FROM STDIN (FORMAT BINARY)").format(
+            target, sql.SQL(', ').join(map(sql.Identifier, plan.columns)))
+        count = 0
+        with cursor.copy(statement) as copy:
+            copy.set_types(oids)
+            for values in plan.rows(rows):
+                copy.write_row(values)
+                count += 1
+        return count
+
+    def _prepare(self, table, rows, columns):
+        table, mapper = self.resolve(table)
+        rows = iter(rows)
+        first = next(rows, None)
+        if first is None:
+            return table, None, rows
+        return table, _Plan(table, mapper, first, columns), itertools.chain([first], rows)
+
+    def insert(self, table, rows: Iterable, columns: Optional[Sequence[str]] = None,
+               chunk_size: Optional[int] = 50000) -> int:
+        """
+        COPY 批量插入
+        :param table: Table 或映射类
+        :param rows: 行的可迭代对象（可以是生成器）
+        :param columns: 列名，为空时由第一行推断（dict 的键 / 全部列 / 除第一行为 None 的数据库端生成列外的全部列）
+        :param chunk_size: 每个事务的行数，为空时全部在一个 COPY 中写入
+        :return: 写入行数
+        """
+        table, plan, rows = self._prepare(table, rows, columns)
+        if plan is None:
+            return 0
+        target = self._identifier(table)
+        total = 0
+        for chunk in self._chunks(rows, chunk_size):
+            with self.engine.begin() as conn:
+                cursor = conn.connection.driver_connection.cursor()
+                total += self._copy(cursor, target, plan, self.oids(cursor, table, plan.columns), chunk)
+        return total
+
+    def upsert(self, table, rows: Iterable, conflict_cols: Sequence[str], update_cols: Optional[Sequence[str]] = None,
+               columns: Optional[Sequence[str]] = None, chunk_size: Optional[int] = 50000) -> Dict[str, int]:
+        """
+        COPY 到临时表后 INSERT ... ON CONFLICT 合并
+        :param conflict_cols: 冲突判断列（需有唯一约束 / 唯一索引）
+        :param update_cols: 冲突时更新的列，为空时为除冲突列外的全部提供列（以及有 onupdate 的列）；
+                            传入空列表时冲突行跳过（DO NOTHING）
+        :return: {'rows': 写入临时表的行数, 'inserted': 新插入行数, 'updated': 更新行数}
+        """
+        table, plan, rows = self._prepare(table, rows, columns)
+        result = {'rows': 0, 'inserted': 0, 'updated': 0}
+        if plan is None:
+            return result
+        missing = [name for name in conflict_cols if name not in plan.columns]
+        if missing:
+            raise ValueError(f"Conflict columns {missing} are not in the written columns {plan.columns}")
+        onupdate = {}
+        if update_cols is None:
+            update_cols = [name for name in plan.provided if name not in conflict_cols]
+            onupdate = {column.name: value for column in table.columns
+                        if column.name not in plan.provided and column.name not in conflict_cols
+                        for value in [_python_onupdate(column)] if value is not None}
+
+        target = self._identifier(table)
+        stage = sql.Identifier(f"_bulk_stage_{table.name}"[:63])
+        cols = sql.SQL(', ').join(map(sql.Identifier, plan.columns))
+        conflict = sql.SQL(', ').join(map(sql.Identifier, conflict_cols))
+        assignments = [sql.SQL("{} = EXCLUDED.{}").format(sql.Identifier(name), sql.Identifier(name))
+                       for name in update_cols]
+        assignments += [sql.SQL("{} = {}").format(sql.Identifier(name), sql.Literal(value))
+                        for name, value in onupdate.items()]
+        action = sql.SQL("DO UPDATE SET {}").format(sql.SQL(', ').join(assignments)) if assignments \
+            else sql.SQL("DO NOTHING")
+        create_stage = sql.SQL("CREATE TEMP TABLE {} ON COMMIT DROP AS SELECT {} FROM {} WITH NO DATA").format(
+            stage, cols, target)
+        merge = sql.SQL(
+            "WITH merged AS ("
+            "INSERT INTO {target} ({cols}) "
+            "SELECT DISTINCT ON ({conflict}) {cols} FROM {stage} ORDER BY {conflict}, ctid DESC "
+            "ON CONFLICT ({conflict}) {action} RETURNING (xmax = 0) AS inserted) "
+            "SELECT count(*) FILTER (WHERE inserted), count(*) FILTER (WHERE NOT inserted) FROM merged"
+        ).format(target=target, cols=cols, conflict=conflict, stage=stage, action=action)
+
+        for chunk in self._chunks(rows, chunk_size):
+            with self.engine.begin() as conn:
+                cursor = conn.connection.driver_connection.cursor()
+                oids = self.oids(cursor, table, plan.columns)
+                cursor.execute(create_stage)
+                result['rows'] += self._copy(cursor, stage, plan, oids, chunk)
+                inserted, updated = cursor.execute(merge).fetchone()
+                result['inserted'] += inserted
+                result['updated'] += updated
+        return result
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf8 -*-
+"""
+SQLAlchemy 连接池与编译缓存统计，同步引擎与异步引擎（注册其 sync_engine）共用一份
+
+通过连接池事件记录签出次数、新建/失效连接数与连接占用时长，snapshot 时读取连接池当前的
+已签出 / 空闲 / 溢出连接数；通过 after_cursor_execute 事件按 context.cache_hit 统计编译缓存命中率。
+"""
+import logging
+import threading
+import time
+from typing import Dict
+
+from sqlalchemy import event
+from sqlalchemy.engine import default
+
+from modules.fastapi_redis.pool import Histogram
+
+logger = logging.getLogger('cloud-postgres')
+
+
+class _EngineStats(object):
+    __slots__ = ('pool', 'checkouts', 'connects', 'invalidated', 'hold')
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.checkouts = 0
+        self.connects = 0
+        self.invalidated = 0
+        self.hold = Histogram()
+
+
+class PoolMetrics(object):
+    """按引擎名称汇总的连接池统计"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._engines: Dict[str, _EngineStats] = {}
+
+    def register(self, name: str, engine) -> None:
+        """
+        监听引擎连接池事件，同名引擎重复注册时以最新的为准
+        :param name: 统计名称，如 host:port/db sync
+        :param engine: 同步 Engine，异步引擎传入 AsyncEngine.sync_engine
+        """
+        stats = _EngineStats(engine.pool)
+        with self._lock:
+            self._engines[name] = stats
+
+        @event.listens_for(engine, 'connect')
+        def on_connect(dbapi_connection, connection_record):
+            with self._lock:
+                stats.connects += 1
+
+        @event.listens_for(engine, 'checkout')
+        def on_checkout(dbapi_connection, connection_record, connection_proxy):
+            connection_record.info['checkout_at'] = time.perf_counter()
+            with self._lock:
+                stats.checkouts += 1
+
+        @event.listens_for(engine, 'checkin')
+        def on_checkin(dbapi_connection, connection_record):
+            checkout_at = connection_record.info.pop('checkout_at', None)
+            if checkout_at is not None:
+                with self._lock:
+                    stats.hold.observe(time.perf_counter() - checkout_at)
+
+        @event.listens_for(engine, 'invalidate')
+        def on_invalidate(dbapi_connection, connection_record, exception):
+            with self._lock:
+                stats.invalidated += 1
+
+    def snapshot(self) -> dict:
+        """{引擎: {size, checked_out, checked_in, overflow, checkouts, connects, invalidated, hold}}"""
+        with self._lock:
+            engines = list(self._engines.items())
+        result = {}
+        for name, stats in engines:
+            pool = stats.pool
+            item = {
+                'checkouts': stats.checkouts,
+                'connects': stats.connects,
+                'invalidated': stats.invalidated,
+                'hold': stats.hold.as_dict(),
+            }
+            # QueuePool / AsyncAdaptedQueuePool 提供以下计数，NullPool 等没有
+            for field, method in (('size', 'size'), ('checked_out', 'checkedout'),
+                                  ('checked_in', 'checkedin'), ('overflow', 'overflow')):
+                if callable(getattr(pool, method, None)):
+                    item[field] = getattr(pool, method)()
+            result[name] = item
+        return result
+
+
+pool_metrics = PoolMetrics()
+
+_CACHE_STATES = {
+    default.CACHE_HIT: 'hit',
+    default.CACHE_MISS: 'miss',
+    default.CACHING_DISABLED: 'disabled',
+    default.NO_CACHE_KEY: 'no_key',
+    default.NO_DIALECT_SUPPORT: 'no_dialect_support',
+}
+
+
+class CompiledCacheMetrics(object):
+    """按引擎名称统计 SQL 编译缓存命中情况（text() / exec_driver_sql 等无编译的语句不计入）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._engines: Dict[str, dict] = {}
+
+    def register(self, name: str, engine) -> None:
+        """
+        :param name: 统计名称，同 PoolMetrics.register
+        :param engine: 同步 Engine，异步引擎传入 AsyncEngine.sync_engine
+        """
+        counts = dict.fromkeys(_CACHE_STATES.values(), 0)
+        with self._lock:
+            self._engines[name] = counts
+
+        @event.listens_for(engine, 'after_cursor_execute')
+        def on_execute(conn, cursor, statement, parameters, context, executemany):
+            state = _CACHE_STATES.get(getattr(context, 'cache_hit', None))
+            if state is not None and context.compiled is not None:
+                with self._lock:
+                    counts[state] += 1
+
+    def snapshot(self) -> dict:
+        """{引擎: {hit, miss, disabled, no_key, no_dialect_support, hit_rate}}"""
+        with self._lock:
+            result = {name: dict(counts) for name, counts in self._engines.items()}
+        for counts in result.values():
+            lookups = counts['hit'] + counts['miss']
+            counts['hit_rate'] = round(counts['hit'] / lookups, 4) if lookups else 0.0
+        return result
+
+
+compiled_cache_metrics = CompiledCacheMetrics()
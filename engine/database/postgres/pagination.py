@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+# -*- coding: utf8 -*-
+"""
+键集（seek）分页
+
+按一组有序且整体唯一的排序列（通常以主键收尾）分页，下一页条件为 (a, b) > (上一页最后一行的 a, b)，
+查询可以直接沿索引定位，耗时与页码无关；OFFSET 分页需要扫描并丢弃前面所有行。
+
+游标是不透明字符串（base64url JSON），记录边界行的排序列取值、翻页方向和排序签名，排序方式变化后旧游标失效。
+排序列不应包含 NULL。
+
+>>> page = keyset_paginate(session, select(Device).where(Device.is_active), ['-create_time', 'id'], limit=50)
+>>> page = keyset_paginate(session, stmt, ['-create_time', 'id'], cursor=page.next_cursor, limit=50)
+>>> page = keyset_paginate(session, select(Device.id, Device.name), ['id'])  # 列查询，items 为 Row
+"""
+import base64
+import binascii
+import json
+import logging
+import uuid
+import zlib
+from datetime import date, datetime, time
+from decimal import Decimal
+from typing import Any, List, NamedTuple, Optional, Sequence, Tuple
+
+from sqlalchemy import Table, and_, or_, text, tuple_
+from sqlalchemy.sql import operators
+from sqlalchemy.sql.elements import UnaryExpression
+
+logger = logging.getLogger('cloud-postgres')
+
+NEXT, PREV = 'n', 'p'
+
+ESTIMATE_SQL = text("SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(:name)")
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class KeysetPage(NamedTuple):
+    items: list
+    next_cursor: Optional[str]
+    prev_cursor: Optional[str]
+    total: Optional[int] = None
+
+    def response_kwargs(self) -> dict:
+        """service_json_response 的分页参数：total / next_cursor / prev_cursor"""
+        return {'total': self.total, 'next_cursor': self.next_cursor, 'prev_cursor': self.prev_cursor}
+
+
+class SortKey(NamedTuple):
+    column: Any
+    ascending: bool
+    key: str
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {'$dt': value.isoformat()}
+    if isinstance(value, date):
+        return {'$d': value.isoformat()}
+    if isinstance(value, time):
+        return {'$t': value.isoformat()}
+    if isinstance(value, Decimal):
+        return {'$dec': str(value)}
+    if isinstance(value, uuid.UUID):
+        return {'$uuid': str(value)}
+    if isinstance(value, bytes):
+        return {'$b': base64.b64encode(value).decode('ascii')}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict) and len(value) == 1:
+        (tag, raw), = value.items()
+        decoder = {'$dt': datetime.fromisoformat, '$d': date.fromisoformat, '$t': time.fromisoformat,
+                   '$dec': Decimal, '$uuid': uuid.UUID, '$b': base64.b64decode}.get(tag)
+        if decoder is not None:
+            return decoder(raw)
+    return value
+
+
+def _signature(keys: Sequence[SortKey]) -> int:
+    return zlib.crc32(','.join(f"{key.key}:{int(key.ascending)}" for key in keys).encode('utf8'))
+
+
+def encode_cursor(keys: Sequence[SortKey], values: Sequence, direction: str) -> str:
+    payload = {'v': [_encode_value(value) for value in values], 'd': direction, 's': _signature(keys)}
+    data = json.dumps(payload, separators=(',', ':')).encode('utf8')
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def decode_cursor(keys: Sequence[SortKey], cursor: str) -> Tuple[list, str]:
+    """返回 (边界行排序列取值, 方向)，游标无效或与当前排序不匹配时抛出 InvalidCursor"""
+    try:
+        data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        payload = json.loads(data)
+        values = [_decode_value(value) for value in payload['v']]
+        direction = payload['d']
+    except (binascii.Error, ValueError, KeyError, TypeError) as e:
+        raise InvalidCursor(f"Invalid pagination cursor: {e}")
+    if payload.get('s') != _signature(keys) or len(values) != len(keys) or direction not in (NEXT, PREV):
+        raise InvalidCursor('Pagination cursor does not match the sort order')
+    return values, direction
+
+
+def sort_keys(order_by: Sequence, entity=None) -> List[SortKey]:
+    """
+    解析排序列
+    :param order_by: 列表达式（可带 .desc()）或字符串（'-' 前缀表示降序，从 entity 上取列）
+    :param entity: 映射类或 Table，order_by 含字符串时必填
+    """
+    keys = []
+    for item in order_by:
+        ascending = True
+        if isinstance(item, str):
+            name = item.lstrip('-+')
+            ascending = not item.startswith('-')
+            if entity is None:
+                raise ValueError(f"Sort column {item!r} given as string requires an entity")
+            column = entity.c[name] if hasattr(entity, 'c') else getattr(entity, name)
+        elif isinstance(item, UnaryExpression) and item.modifier in (operators.desc_op, operators.asc_op):
+            ascending = item.modifier is operators.asc_op
+            column = item.element
+        else:
+            column = item
+        key = getattr(column, 'key', None) or getattr(column, 'name', None)
+        if not key:
+            raise ValueError(f"Sort column {item!r} has no name, label it first")
+        keys.append(SortKey(column, ascending, key))
+    if not keys:
+        raise ValueError('Keyset pagination requires at least one sort column')
+    return keys
+
+
+def _after(keys: Sequence[SortKey], values: Sequence, forward: bool):
+    """排在边界行之后（forward）或之前的条件"""
+    # 排序方向一致时使用行比较，可直接沿复合索引定位
+    if len({key.ascending for key in keys}) == 1:
+        greater = keys[0].ascending == forward
+        left = tuple_(*[key.column for key in keys])
+        right = tuple_(*values)
+        return left > right if greater else left < right
+    clauses = []
+    for position, key in enumerate(keys):
+        greater = key.ascending == forward
+        head = [keys[i].column == values[i] for i in range(position)]
+        compare = key.column > values[position] if greater else key.column < values[position]
+        clauses.append(and_(*head, compare))
+    return or_(*clauses)
+
+
+def _order(keys: Sequence[SortKey], forward: bool) -> list:
+    return [key.column.asc() if key.ascending == forward else key.column.desc() for key in keys]
+
+
+def _value(item, key: SortKey):
+    mapping = getattr(item, '_mapping', None)
+    if mapping is not None:
+        return mapping[key.key] if key.key in mapping else mapping[key.column]
+    return getattr(item, key.key)
+
+
+def keyset_statement(stmt, keys: Sequence[SortKey], cursor: Optional[str], limit: int):
+    """返回 (分页语句, 是否向前翻页, 是否带游标)，语句多取一行用于判断是否还有下一页"""
+    forward, values = True, None
+    if cursor:
+        values, direction = decode_cursor(keys, cursor)
+        forward = direction == NEXT
+    if values is not None:
+        stmt = stmt.where(_after(keys, values, forward))
+    return stmt.order_by(None).order_by(*_order(keys, forward)).limit(limit + 1), forward, cursor is not None
+
+
+def make_page(rows: list, keys: Sequence[SortKey], limit: int, forward: bool, has_cursor: bool,
+              total: Optional[int] = None) -> KeysetPage:
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if not forward:
+        rows.reverse()
+    if not rows:
+        return KeysetPage([], None, None, total)
+    first = [_value(rows[0], key) for key in keys]
+    last = [_value(rows[-1], key) for key in keys]
+    # 向前翻页：有多余行说明还有下一页，带游标进入说明有上一页；向后翻页反之
+    has_next = more if forward else has_cursor
+    has_prev = has_cursor if forward else more
+    return KeysetPage(
+        rows,
+        encode_cursor(keys, last, NEXT) if has_next else None,
+        encode_cursor(keys, first, PREV) if has_prev else None,
+        total,
+    )
+
+
+def approximate_total(session, stmt) -> Optional[int]:
+    """
+    近似总数（不执行 COUNT(*)）：没有过滤条件的单表查询读取 pg_class.reltuples，
+    否则取 EXPLAIN 估算的行数；表从未 ANALYZE 或无法估算时返回 None
+    """
+    froms = stmt.get_final_froms()
+    if stmt.whereclause is None and len(froms) == 1 and isinstance(froms[0], Table):
+        value = session.execute(ESTIMATE_SQL, {'name': froms[0].fullname}).scalar()
+        return value if value is not None and value >= 0 else None
+    connection = session.connection()
+    compiled = stmt.order_by(None).limit(None).compile(dialect=connection.dialect)
+    try:
+        plan = connection.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {compiled}", compiled.params).scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
+    except Exception as e:
+        logger.warning(f"Approximate total estimate failed: {e}")
+        return None
+
+
+def keyset_paginate(session, stmt, order_by: Sequence, cursor: Optional[str] = None, limit: int = 20,
+                    with_total: bool = False, entity=None) -> KeysetPage:
+    """
+    对任意 select 语句做键集分页
+    :param session: Session
+    :param stmt: select 语句（可带过滤条件，原有排序会被替换）
+    :param order_by: 排序列，整体必须唯一，见 sort_keys
+    :param cursor: 上一次返回的 next_cursor / prev_cursor，为空时取第一页
+    :param limit: 每页行数
+    :param with_total: 是否返回近似总数
+    :param entity: order_by 含字符串时用于取列，为空时取语句的第一个实体
+    :return: KeysetPage
+    """
+    keys = sort_keys(order_by, entity if entity is not None else _entity(stmt))
+    statement, forward, has_cursor = keyset_statement(stmt, keys, cursor, limit)
+    result = session.execute(statement)
+    rows = list(result.scalars() if is_entity_query(stmt) else result)
+    total = approximate_total(session, stmt) if with_total else None
+    return make_page(rows, keys, limit, forward, has_cursor, total)
+
+
+def _entity(stmt):
+    descriptions = stmt.column_descriptions
+    if descriptions and descriptions[0].get('entity') is not None:
+        return descriptions[0]['entity']
+    froms = stmt.get_final_froms()
+    return froms[0] if froms else None
+
+
+def is_entity_query(stmt) -> bool:
+    """
+    是否为单个 ORM 实体的查询（select(Model) / select(aliased(Model))），此时按实体返回，否则按 Row 返回
+    列查询 select(Model.a, Model.b) 的 column_descriptions 中 entity 同样是 Model，需以 expr 是否为实体本身判断
+    """
+    descriptions = stmt.column_descriptions
+    return len(descriptions) == 1 and descriptions[0].get('entity') is not None \
+        and descriptions[0].get('expr') is descriptions[0]['entity']
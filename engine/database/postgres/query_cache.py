@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf8 -*-
+"""
+PostgresConn.select 的查询形状缓存
+
+select 按 config 动态调用 select 的方法构造语句，每次请求都要重新构造语句，执行时 SQLAlchemy 再遍历语句生成
+编译缓存键。形状缓存以 (models, 方法名, 参数结构) 为键缓存构造好的语句，其中 filter_by 的取值与 limit / offset
+替换为命名绑定参数，同一形状的请求直接复用语句、只传入参数，省去的是语句构造与缓存键生成的 Python 开销；
+SQL 编译与服务端预备语句不依赖形状缓存，分别由 SQLAlchemy 编译缓存（query_cache_size）与 psycopg
+prepare_threshold 处理。
+
+含字面值的表达式（如 filter=(Model.id > 5,)）无法参数化，不进入形状缓存，仍按原方式构造。
+"""
+import threading
+from collections import OrderedDict
+from datetime import date, datetime, time
+from decimal import Decimal
+from typing import Optional, Tuple
+from uuid import UUID
+
+from sqlalchemy import bindparam
+from sqlalchemy.sql import ClauseElement
+from sqlalchemy.orm.attributes import QueryableAttribute
+
+SCALAR_TYPES = (str, int, float, bool, Decimal, datetime, date, time, UUID, bytes)
+PARAMETERIZED = ('limit', 'offset')
+
+_UNCACHEABLE = object()
+
+
+def _static_key(value):
+    """不含绑定参数的参数（映射类、列、排序表达式、字符串、数字）的结构键，无法确定时返回 _UNCACHEABLE"""
+    if value is None or isinstance(value, type):
+        # 映射类按自身区分
+        return value
+    if isinstance(value, (str, int, float, bool)):
+        # True == 1 且哈希相同，带上类型区分
+        return type(value).__name__, value
+    if isinstance(value, (tuple, list)):
+        keys = tuple(_static_key(item) for item in value)
+        return _UNCACHEABLE if any(key is _UNCACHEABLE for key in keys) else keys
+    if isinstance(value, (ClauseElement, QueryableAttribute)):
+        cache_key = value._generate_cache_key()
+        if cache_key is None or cache_key.bindparams:
+            return _UNCACHEABLE
+        return cache_key.key
+    return _UNCACHEABLE
+
+
+class QueryShapeCache(object):
+    """LRU 形状缓存，线程安全"""
+
+    def __init__(self, maxsize: int = 512):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._statements = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.uncacheable = 0
+
+    @staticmethod
+    def shape(models, config: dict) -> Optional[Tuple[tuple, dict, dict]]:
+        """返回 (形状键, 参数化后的 config, 参数)，无法参数化时返回 None"""
+        models_key = _static_key(models)
+        if models_key is _UNCACHEABLE:
+            return None
+        parts, template, params = [models_key], {}, {}
+        for method, value in config.items():
+            if method == 'filter_by' and isinstance(value, dict) \
+                    and all(isinstance(item, SCALAR_TYPES) for item in value.values()):
+                names = tuple(value)
+                parts.append((method, names))
+                template[method] = {name: bindparam(f"fb_{name}") for name in names}
+                params.update({f"fb_{name}": item for name, item in value.items()})
+            elif method in PARAMETERIZED and isinstance(value, int) and not isinstance(value, bool):
+                parts.append((method,))
+                template[method] = bindparam(f"p_{method}")
+                params[f"p_{method}"] = value
+            else:
+                key = _static_key(value)
+                if key is _UNCACHEABLE:
+                    return None
+                parts.append((method, key))
+                template[method] = value
+        return tuple(parts), template, params
+
+    def statement(self, models, config: dict, build) -> Tuple[object, Optional[dict]]:
+        """
+        返回 (语句, 参数)，命中时复用已构造的语句；无法参数化时返回 (build(models, config), None)
+        :param build: 语句构造函数 build(models, config)
+        """
+        shape = self.shape(models, config)
+        if shape is None:
+            with self._lock:
+                self.uncacheable += 1
+            return build(models, config), None
+        key, template, params = shape
+        with self._lock:
+            statement = self._statements.get(key)
+            if statement is not None:
+                self._statements.move_to_end(key)
+                self.hits += 1
+                return statement, params
+            self.misses += 1
+        statement = build(models, template)
+        with self._lock:
+            self._statements[key] = statement
+            if len(self._statements) > self.maxsize:
+                self._statements.popitem(last=False)
+        return statement, params
+
+    def clear(self) -> None:
+        with self._lock:
+            self._statements.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._statements),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'uncacheable': self.uncacheable,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# -*- coding: utf8 -*-
+"""
+按表懒加载的反射缓存
+
+    - 只在首次访问某张表时反射该表（及其外键引用的表），不同表的反射互不阻塞，同一张表只反射一次
+    - 反射结果（有主键的表为 automap 映射类，否则为 Table）缓存在进程内
+    - 可选磁盘缓存：以库结构哈希为键持久化 MetaData（pickle），结构未变化时新进程直接从磁盘加载，跳过反射
+    - 迁移后调用 invalidate 清空缓存，之后的访问重新反射
+"""
+import hashlib
+import logging
+import os
+import pickle
+import threading
+from collections import defaultdict
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import MetaData, Table, text
+from sqlalchemy.ext.automap import automap_base
+
+logger = logging.getLogger('cloud-postgres')
+
+# 库结构摘要：列定义与约束定义，任一表结构变化时哈希随之变化
+SCHEMA_HASH_SQL = text("""
+SELECT md5(
+    coalesce((SELECT string_agg(c.relname || '.' || a.attname || ':' || format_type(a.atttypid, a.atttypmod)
+                                || ':' || a.attnotnull, ',' ORDER BY c.relname, a.attnum)
+              FROM pg_attribute a
+              JOIN pg_class c ON c.oid = a.attrelid
+              JOIN pg_namespace n ON n.oid = c.relnamespace
+              WHERE n.nspname = :schema AND a.attnum > 0 AND NOT a.attisdropped
+                AND c.relkind IN ('r', 'p', 'v', 'm', 'f')), '')
+    || coalesce((SELECT string_agg(con.conname || ':' || pg_get_constraintdef(con.oid), ',' ORDER BY con.conname)
+                 FROM pg_constraint con
+                 JOIN pg_namespace n ON n.oid = con.connamespace
+                 WHERE n.nspname = :schema), '')
+)
+""")
+
+
+class ReflectionCache(object):
+    """单个引擎的表反射缓存"""
+
+    def __init__(self, engine, cache_dir: Optional[str] = None):
+        """
+        :param engine: 同步 Engine
+        :param cache_dir: 磁盘缓存目录，为空时不持久化
+        """
+        self.engine = engine
+        self.cache_dir = cache_dir
+        self._lock = threading.Lock()
+        self._table_locks = defaultdict(threading.Lock)
+        self._reset()
+
+    def _reset(self) -> None:
+        self._metadata = MetaData()
+        self._base = automap_base(metadata=self._metadata)
+        self._tables: Dict[Tuple[Optional[str], str], object] = {}
+        # 从磁盘加载或已反射的全部表，持久化时写出
+        self._persisted: Dict[Optional[str], MetaData] = {}
+        self._schema_hash: Dict[Optional[str], Optional[str]] = {}
+
+    @staticmethod
+    def _key(tablename: str, schema: Optional[str]) -> str:
+        return f"{schema}.{tablename}" if schema else tablename
+
+    def get(self, tablename: str, schema: Optional[str] = None):
+        """返回映射类（表有主键时）或 Table"""
+        item = self._tables.get((schema, tablename))
+        if item is not None:
+            return item
+        with self._lock:
+            table_lock = self._table_locks[(schema, tablename)]
+        with table_lock:
+            item = self._tables.get((schema, tablename))
+            if item is None:
+                item = self._tables[(schema, tablename)] = self._load(tablename, schema)
+        return item
+
+    def _load(self, tablename: str, schema: Optional[str]):
+        key = self._key(tablename, schema)
+        disk = self._disk_metadata(schema)
+        if disk is not None and key in disk.tables:
+            source, reflected = disk, False
+        else:
+            # 反射到独立的 MetaData，数据库往返期间不持有全局锁
+            source, reflected = MetaData(), True
+            Table(tablename, source, autoload_with=self.engine, schema=schema)
+        with self._lock:
+            # 连同外键引用的表一起复制到共享 MetaData 并增量映射
+            for table in self._with_referred(source.tables[key]):
+                if table.key not in self._metadata.tables:
+                    table.to_metadata(self._metadata)
+            self._base.prepare()
+            table = self._metadata.tables[key]
+            if reflected and self.cache_dir:
+                self._persist(schema, source)
+        mapped = getattr(self._base.classes, tablename, None)
+        if mapped is not None and mapped.__table__ is table:
+            return mapped
+        return table
+
+    @staticmethod
+    def _with_referred(table: Table) -> list:
+        """表及其（递归）外键引用的表，被引用的表在前"""
+        result, seen, stack = [], set(), [(table, False)]
+        while stack:
+            item, expanded = stack.pop()
+            if expanded:
+                result.append(item)
+                continue
+            if item.key in seen:
+                continue
+            seen.add(item.key)
+            stack.append((item, True))
+            for fk in item.foreign_keys:
+                referred = fk.column.table
+                if referred.key not in seen:
+                    stack.append((referred, False))
+        return result
+
+    def schema_hash(self, schema: Optional[str] = None) -> Optional[str]:
+        """库结构哈希，非 PostgreSQL 或查询失败时返回 None（不使用磁盘缓存）"""
+        if schema not in self._schema_hash:
+            value = None
+            if self.engine.dialect.name == 'postgresql':
+                try:
+                    with self.engine.connect() as conn:
+                        value = conn.execute(SCHEMA_HASH_SQL, {'schema': schema or 'public'}).scalar()
+                except Exception as e:
+                    logger.warning(f"Schema hash query failed, reflection disk cache disabled: {e}")
+            self._schema_hash[schema] = value
+        return self._schema_hash[schema]
+
+    def _cache_path(self, schema: Optional[str]) -> Optional[str]:
+        schema_hash = self.schema_hash(schema)
+        if not self.cache_dir or not schema_hash:
+            return None
+        url = self.engine.url
+        name = hashlib.md5(f"{url.host}:{url.port}/{url.database}".encode('utf8')).hexdigest()[:12]
+        return os.path.join(self.cache_dir, f"reflection-{name}-{schema or 'public'}-{schema_hash}.pickle")
+
+    def _disk_metadata(self, schema: Optional[str]) -> Optional[MetaData]:
+        """结构哈希对应的磁盘缓存，首次访问该 schema 时加载"""
+        if not self.cache_dir:
+            return None
+        if schema not in self._persisted:
+            metadata = MetaData()
+            path = self._cache_path(schema)
+            if path and os.path.exists(path):
+                try:
+                    with open(path, 'rb') as f:
+                        metadata = pickle.load(f)
+                    logger.info(f"Reflection cache loaded {len(metadata.tables)} tables from {path}")
+                except Exception as e:
+                    logger.warning(f"Reflection cache {path} load failed: {e}")
+            with self._lock:
+                self._persisted.setdefault(schema, metadata)
+        return self._persisted[schema]
+
+    def _persist(self, schema: Optional[str], source: MetaData) -> None:
+        """持有 self._lock 时调用，合并新反射的表并原子写入磁盘缓存"""
+        path = self._cache_path(schema)
+        if not path:
+            return
+        metadata = self._persisted.setdefault(schema, MetaData())
+        for table in source.sorted_tables:
+            if table.key not in metadata.tables:
+                table.to_metadata(metadata)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, 'wb') as f:
+                pickle.dump(metadata, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.warning(f"Reflection cache {path} write failed: {e}")
+
+    def invalidate(self, remove_files: bool = True) -> None:
+        """
+        清空反射缓存（数据库迁移后调用），之后的访问重新反射；已取得的映射类 / Table 仍可继续使用
+        :param remove_files: 同时删除该库的磁盘缓存文件
+        """
+        with self._lock:
+            paths = [self._cache_path(schema) for schema in self._persisted] if remove_files else []
+            self._reset()
+        for path in paths:
+            if path and os.path.exists(path):
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    logger.warning(f"Reflection cache {path} remove failed: {e}")
+
+    def tables(self) -> list:
+        """已缓存的表名"""
+        return sorted(self._key(name, schema) for schema, name in self._tables)
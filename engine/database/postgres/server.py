@@ -5,12 +5,11 @@ import logging
 import threading
 # import traceback
 from asyncio import current_task
-from contextlib import contextmanager
+from contextlib import asynccontextmanager, contextmanager
 from importlib.metadata import metadata
 from urllib.parse import quote_plus
 
-from sqlalchemy import create_engine, MetaData, select, Table, text
-from sqlalchemy.ext.automap import automap_base
+from sqlalchemy import create_engine, make_url, select, text
 from sqlalchemy.orm import sessionmaker, scoped_session
 from sqlalchemy.orm.session import Session
 from sqlalchemy.engine.cursor import CursorResult
@@ -18,6 +17,11 @@ from sqlalchemy.ext.asyncio import (create_async_engine, async_sessionmaker,
                                     async_scoped_session, AsyncSession)
 
 from confs import c
+from .metrics import compiled_cache_metrics, pool_metrics
+from .bulk import BulkLoader
+from .pagination import is_entity_query, keyset_paginate
+from .query_cache import QueryShapeCache
+from .reflection import ReflectionCache
 
 logger = logging.getLogger('cloud-postgres')
 
@@ -33,10 +37,15 @@ class PostgresConn(object):
             uri = self.__generate_uri(host, port, user, password, database)
             self.engine, self.session_factory, self.session = \
                 self.create_engine_factory_session(uri, *args, **kwargs)
+            self.async_engine, self.async_session_factory, self.async_session = \
+                self.create_async_engine_factory_session(uri, *args, **kwargs)
 
         self._lock = threading.Lock()
-        self.__map_data = {}
+        # {engine: ReflectionCache}
         self.__metadata = {}
+        # {engine: BulkLoader}
+        self.__bulk = {}
+        self.query_cache = QueryShapeCache(c.SQLALCHEMY_SHAPE_CACHE_SIZE)
 
     def __repr__(self):
         return f"PostgresConn(url={self.engine.url.host}:{self.engine.url.port})"
@@ -46,6 +55,12 @@ class PostgresConn(object):
             self.create_engine_factory_session(
                 app.config.SQLALCHEMY_DATABASE_URI
             )
+        self.async_engine, self.async_session_factory, self.async_session = \
+            self.create_async_engine_factory_session(
+                app.config.SQLALCHEMY_DATABASE_URI
+            )
+        if hasattr(app, 'add_event_handler'):
+            app.add_event_handler('shutdown', self.async_dispose)
 
     def from_uri(self, uri, *args, **kwargs):
         engine, session_factory, session = self.create_engine_factory_session(
@@ -54,6 +69,8 @@ class PostgresConn(object):
         self.engine = engine
         self.session_factory = session_factory
         self.session = session
+        self.async_engine, self.async_session_factory, self.async_session = \
+            self.create_async_engine_factory_session(uri, *args, **kwargs)
         return self
 
     @contextmanager
@@ -68,6 +85,16 @@ class PostgresConn(object):
         finally:
             session.close()
 
+    @asynccontextmanager
+    async def async_context_session(self):
+        """异步事务范围，每次进入创建独立的 AsyncSession"""
+        async with self.async_session_factory() as session:
+            try:
+                yield session
+            except:
+                await session.rollback()
+                raise
+
     def __generate_uri(self, host=None, port=None, user=None, password=None, database=None):
         engine_str_format = 'postgresql+psycopg://{username}:{password}@{host}:{port}/{db}?application_name={app_name}'
         engine_str = engine_str_format.format(
@@ -76,6 +103,16 @@ class PostgresConn(object):
         )
         return engine_str
 
+    @staticmethod
+    def _engine_options(uri, kwargs):
+        """引擎公共参数：编译缓存大小，psycopg 驱动时设置服务端预备语句阈值"""
+        kwargs.update(c.SQLALCHEMY_ENGINE_OPTIONS)
+        kwargs.setdefault('query_cache_size', c.SQLALCHEMY_QUERY_CACHE_SIZE)
+        if make_url(uri).get_driver_name() == 'psycopg':
+            connect_args = kwargs.setdefault('connect_args', {})
+            connect_args.setdefault('prepare_threshold', c.SQLALCHEMY_PREPARE_THRESHOLD)
+        return kwargs
+
     def create_engine_factory_session(self, uri, *args, **kwargs):
         """
         :param uri:
@@ -83,7 +120,7 @@ class PostgresConn(object):
         :param kwargs:
         :return:
         """
-        kwargs.update(c.SQLALCHEMY_ENGINE_OPTIONS)
+        kwargs = self._engine_options(uri, kwargs)
         engine = create_engine(
             uri, future=True,
             max_overflow=c.SQLALCHEMY_MAX_OVERFLOW,
@@ -97,41 +134,120 @@ class PostgresConn(object):
             bind=engine, expire_on_commit=False, class_=Session
         )
         session = scoped_session(session_factory)
+        pool_metrics.register(self._metrics_name(engine, 'sync'), engine)
+        compiled_cache_metrics.register(self._metrics_name(engine, 'sync'), engine)
         return engine, session_factory, session
 
-    def metadata_table(self, tablename, schema=None):
-        if self.engine not in self.__metadata:
+    def create_async_engine_factory_session(self, uri, *args, **kwargs):
+        """
+        创建 psycopg 异步引擎（与同步引擎使用同一个 URI，连接池相互独立），连接在首次使用时建立
+        :param uri:
+        :param args:
+        :param kwargs:
+        :return: (AsyncEngine, async_sessionmaker, async_scoped_session)
+        """
+        kwargs = self._engine_options(uri, kwargs)
+        engine = create_async_engine(
+            uri,
+            max_overflow=c.SQLALCHEMY_ASYNC_MAX_OVERFLOW,
+            pool_size=c.SQLALCHEMY_ASYNC_POOL_SIZE,
+            pool_timeout=c.SQLALCHEMY_POOL_TIMEOUT,
+            pool_recycle=c.SQLALCHEMY_POOL_RECYCLE,
+            *args, **kwargs,
+        )
+
+        session_factory = async_sessionmaker(
+            bind=engine, expire_on_commit=False, class_=AsyncSession
+        )
+        # 按 asyncio 任务隔离，使用后需 await session.remove()
+        session = async_scoped_session(session_factory, scopefunc=current_task)
+        pool_metrics.register(self._metrics_name(engine, 'async'), engine.sync_engine)
+        compiled_cache_metrics.register(self._metrics_name(engine, 'async'), engine.sync_engine)
+        return engine, session_factory, session
+
+    @staticmethod
+    def _metrics_name(engine, kind):
+        return f"{engine.url.host}:{engine.url.port}/{engine.url.database} {kind}"
+
+    @staticmethod
+    def pool_stats():
+        """同步与异步引擎的连接池使用情况"""
+        return pool_metrics.snapshot()
+
+    def query_cache_stats(self):
+        """查询形状缓存与各引擎编译缓存的命中情况"""
+        return {
+            'shape': self.query_cache.stats(),
+            'compiled': compiled_cache_metrics.snapshot(),
+            'prepare_threshold': c.SQLALCHEMY_PREPARE_THRESHOLD,
+        }
+
+    async def async_dispose(self):
+        """关闭异步引擎连接池"""
+        if getattr(self, 'async_engine', None) is not None:
+            await self.async_engine.dispose()
+
+    def reflection_cache(self):
+        """当前引擎的表反射缓存"""
+        cache = self.__metadata.get(self.engine)
+        if cache is None:
             with self._lock:
-                if self.engine not in self.__metadata:
-                    self.__metadata[self.engine] = MetaData()
-                    self.__metadata[self.engine].reflect(
-                        bind=self.engine, schema=schema)
+                cache = self.__metadata.get(self.engine)
+                if cache is None:
+                    cache = self.__metadata[self.engine] = ReflectionCache(
+                        self.engine, cache_dir=c.SQLALCHEMY_REFLECTION_CACHE_DIR)
+        return cache
+
+    def metadata_table(self, tablename, schema=None):
+        """
+        按表懒加载反射，结果缓存
+        :return: 表有主键时为 automap 映射类，否则为 Table
+        """
+        return self.reflection_cache().get(tablename, schema=schema)
 
-                    self.__map_data[self.engine] = automap_base(
-                        metadata=self.__metadata[self.engine])
-                    self.__map_data[self.engine].prepare()
+    def invalidate_metadata(self, remove_files=True):
+        """数据库迁移后清空反射缓存（含磁盘缓存），之后的 metadata_table 重新反射"""
+        self.reflection_cache().invalidate(remove_files=remove_files)
+        self.bulk_loader().invalidate()
 
-        if tablename not in self.__map_data[self.engine].classes.keys():
+    def bulk_loader(self):
+        """当前引擎的 COPY 批量写入器"""
+        loader = self.__bulk.get(self.engine)
+        if loader is None:
             with self._lock:
-                table = Table(tablename, self.__metadata[self.engine],
-                              autoload_with=self.engine, schema=schema)
-                # Table Object
-                return table
+                loader = self.__bulk.setdefault(self.engine, BulkLoader(self.engine))
+        return loader
 
-        return getattr(self.__map_data[self.engine].classes, tablename)
+    def _bulk_table(self, table, schema=None):
+        return self.metadata_table(table, schema=schema) if isinstance(table, str) else table
 
-    def select(self, models, **config):
+    def bulk_insert(self, table, rows, columns=None, chunk_size=50000, schema=None):
+        """
+        COPY（二进制）批量插入
+        :param table: 表名（经 metadata_table 反射）、Table 或映射类（如 BaseModel 子类）
+        :param rows: dict / tuple / 映射类实例的可迭代对象，可以是生成器
+        :param columns: 写入的列，为空时由第一行推断
+        :param chunk_size: 每个事务的行数，为空时全部在一个 COPY 中写入
+        :param schema:
+        :return: 写入行数
         """
+        return self.bulk_loader().insert(self._bulk_table(table, schema), rows, columns=columns,
+                                         chunk_size=chunk_size)
 
-        :param models:
-        :param config:
-        :return:
+    def bulk_upsert(self, table, rows, conflict_cols, update_cols=None, columns=None, chunk_size=50000,
+                    schema=None):
         """
-        # 是否使用默认处理
-        nop_ = None
-        if 'nop_' in config:
-            nop_ = config.pop('nop_')
+        COPY 到临时表后 INSERT ... ON CONFLICT 合并，参数同 bulk_insert
+        :param conflict_cols: 冲突判断列（唯一约束 / 唯一索引）
+        :param update_cols: 冲突时更新的列，为空时更新除冲突列外的全部写入列，空列表时跳过冲突行
+        :return: {'rows': 写入行数, 'inserted': 新插入行数, 'updated': 更新行数}
+        """
+        return self.bulk_loader().upsert(self._bulk_table(table, schema), rows, conflict_cols,
+                                         update_cols=update_cols, columns=columns, chunk_size=chunk_size)
 
+    @staticmethod
+    def _build_select(models, config):
+        """按 config 依次调用 select 的方法（filter_by / order_by / limit ...）构造语句"""
         sql = select(models)
         for key, value in config.items():
             f = getattr(sql, key)
@@ -141,13 +257,72 @@ class PostgresConn(object):
                 sql = f(*value)
             else:
                 sql = f(value)
+        return sql
+
+    @staticmethod
+    def _fetch(result):
+        __func = 'fetchall' if isinstance(result, CursorResult) else 'scalars'
+        return getattr(result, __func)()
 
-        result = self.session.execute(sql)
+    @staticmethod
+    def _stream_batch_size(stream_):
+        """stream_ 为 True 时逐行返回（按默认批量从服务端游标读取），为整数时按该大小分批返回"""
+        if isinstance(stream_, bool):
+            return None, c.SQLALCHEMY_STREAM_BATCH_SIZE
+        return int(stream_), int(stream_)
+
+    def stream(self, sql, stream_=True, params=None):
+        """
+        服务端游标流式读取，内存占用与批量大小相关而与结果总行数无关；会话在生成器耗尽或关闭时释放
+        生成器可能在不同线程中迭代（如 StreamingResponse 在线程池中逐次 next），因此使用独立的会话，
+        不经过线程局部的 scoped_session
+        :param sql: select 语句
+        :param stream_: True 逐行生成，整数 n 时每次生成 n 行的列表
+        :param params: 绑定参数
+        :return: 生成器
+        """
+        batch_size, yield_per = self._stream_batch_size(stream_)
+        session = self.session_factory()
+        try:
+            result = session.execute(sql, params, execution_options={'yield_per': yield_per, 'stream_results': True})
+            # 查询单个 ORM 实体时返回实体，列查询返回 Row
+            if is_entity_query(sql):
+                result = result.scalars()
+            if batch_size:
+                for partition in result.partitions(batch_size):
+                    yield partition
+            else:
+                yield from result
+        except:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def select(self, models, **config):
+        """
+
+        :param models:
+        :param config: select 的方法及参数；nop_ 为真时返回 Result；stream_ 为真时返回流式生成器，见 stream
+        :return:
+        """
+        # 是否使用默认处理
+        nop_ = None
+        if 'nop_' in config:
+            nop_ = config.pop('nop_')
+        # 是否流式读取
+        stream_ = config.pop('stream_', None)
+
+        # 同一形状（models、方法与参数结构）的查询复用语句，取值作为绑定参数传入
+        sql, params = self.query_cache.statement(models, config, self._build_select)
+        if stream_:
+            return self.stream(sql, stream_, params)
+
+        result = self.session.execute(sql, params)
         if nop_:
             return result
 
-        __func = 'fetchall' if isinstance(result, CursorResult) else 'scalars'
-        return getattr(result, __func)()
+        return self._fetch(result)
 
     def select_filter_by(self, models, **kwargs):
         return self.select(models, **{'filter_by': kwargs})
@@ -155,5 +330,65 @@ class PostgresConn(object):
     def select_filter(self, models, *args):
         return self.select(models, **{'filter': args})
 
+    async def async_select(self, models, **config):
+        """
+        select 的异步版本，每次调用使用独立的 AsyncSession，结果在会话关闭前已全部读取
+        :param models:
+        :param config: 同 select，nop_ 为真时返回已缓冲的 Result；stream_ 为真时返回异步生成器，见 async_stream
+        :return:
+        """
+        nop_ = config.pop('nop_', None)
+        stream_ = config.pop('stream_', None)
+        sql, params = self.query_cache.statement(models, config, self._build_select)
+        if stream_:
+            return self.async_stream(sql, stream_, params)
+
+        async with self.async_context_session() as session:
+            result = await session.execute(sql, params)
+            if nop_:
+                return result
+            return self._fetch(result)
+
+    def paginate(self, models, order_by, cursor=None, limit=20, with_total=False, **config):
+        """
+        键集分页，替代深分页下的 offset / limit
+        :param models: 同 select
+        :param order_by: 整体唯一的排序列，如 ['-create_time', 'id'] 或 [Model.create_time.desc(), Model.id]
+        :param cursor: 上一页返回的 next_cursor / prev_cursor，为空时取第一页；无效时抛出 InvalidCursor
+        :param limit: 每页行数
+        :param with_total: 是否返回近似总数（pg_class.reltuples / 执行计划估算，不执行 COUNT(*)）
+        :param config: 同 select 的过滤条件，如 filter_by={'is_active': True}
+        :return: KeysetPage(items, next_cursor, prev_cursor, total)
+        """
+        sql = self._build_select(models, config)
+        return keyset_paginate(self.session, sql, order_by, cursor=cursor, limit=limit, with_total=with_total)
+
+    async def async_paginate(self, models, order_by, cursor=None, limit=20, with_total=False, **config):
+        """paginate 的异步版本"""
+        sql = self._build_select(models, config)
+        async with self.async_context_session() as session:
+            return await session.run_sync(keyset_paginate, sql, order_by, cursor, limit, with_total)
+
+    async def async_stream(self, sql, stream_=True, params=None):
+        """stream 的异步版本（AsyncSession.stream），用法 async for row in conn.async_stream(sql)"""
+        batch_size, yield_per = self._stream_batch_size(stream_)
+        async with self.async_context_session() as session:
+            result = await session.stream(sql, params, execution_options={'yield_per': yield_per})
+            # 与 stream 一致：查询单个 ORM 实体时返回实体，列查询返回 Row
+            if is_entity_query(sql):
+                result = result.scalars()
+            if batch_size:
+                async for partition in result.partitions(batch_size):
+                    yield partition
+            else:
+                async for row in result:
+                    yield row
+
+    async def async_select_filter_by(self, models, **kwargs):
+        return await self.async_select(models, **{'filter_by': kwargs})
+
+    async def async_select_filter(self, models, *args):
+        return await self.async_select(models, **{'filter': args})
+
     def to_dict(self, data):
         return {c.name: getattr(self, c.name) for c in data.columns}
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+# -*- coding: utf8 -*-
+"""基于 redis.asyncio 的缓存实现，供 FastAPI 异步路由使用，接口与 RedisCache 保持一致"""
+import asyncio
+import logging
+import time
+import uuid
+from functools import wraps
+from typing import Optional, Any, Dict
+
+from redis.exceptions import RedisError
+
+from modules.fastapi_redis.async_client import AsyncFastApiRedis
+from modules.fastapi_redis.scripts import scripts
+from .server import CACHE_MISS, lock_metrics
+
+logger = logging.getLogger(__name__)
+
+
+def async_redis_exception_handler(func):
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        try:
+            return await func(*args, **kwargs)
+        except Exception as e:
+            endpoint = '{} {}'.format(func.__module__, func.__name__)
+            logger.warning(f'{endpoint}: {e}')
+            return None
+
+    return wrapper
+
+
+class AsyncRedisCache(AsyncFastApiRedis):
+    """异步 Redis 缓存扩展类，支持集群模式"""
+
+    def __init__(self, app=None, strict=True, **kwargs):
+        super().__init__(app=app, strict=strict, **kwargs)
+
+    @staticmethod
+    def _chunks(items: list, size: int):
+        size = max(int(size or len(items) or 1), 1)
+        for index in range(0, len(items), size):
+            yield items[index:index + size]
+
+    @async_redis_exception_handler
+    async def exists(self, key: str) -> bool:
+        """检查键是否存在"""
+        return await self._redis_client.exists(key) == 1
+
+    @async_redis_exception_handler
+    async def get(self, key: str, default: Any = None) -> Any:
+        """安全获取数据并自动反序列化"""
+        value = await self._redis_client.get(key)
+        return self.safe_loads(value) if value else default
+
+    @async_redis_exception_handler
+    async def set(self, key: str, value: Any, ex: Optional[int] = None) -> None:
+        """序列化存储数据"""
+        return await self._redis_client.set(key, self.safe_dumps(value, key), ex=ex)
+
+    async def _mget_raw(self, keys, batch_size: int = 500) -> list:
+        """批量获取原始值，结果与 keys 顺序一致，各批次并发执行，失败批次按未命中处理"""
+
+        async def fetch(chunk):
+            try:
+                if not self.is_cluster:
+                    return await self._redis_client.mget(chunk)
+                pipe = self._pipeline()
+                for key in chunk:
+                    pipe.get(key)
+                return await pipe.execute()
+            except RedisError as e:
+                logger.error(f"Async redis mget batch failed ({len(chunk)} keys): {e}")
+                return [None] * len(chunk)
+
+        parts = await asyncio.gather(*(fetch(chunk) for chunk in self._chunks(keys, batch_size)))
+        return [value for part in parts for value in part]
+
+    @async_redis_exception_handler
+    async def mget(self, keys, aligned: bool = False, default: Any = CACHE_MISS, batch_size: int = 500):
+        """
+        批量安全获取多个键并自动反序列化
+        :param keys: 键列表
+        :param aligned: 为 True 时返回与 keys 一一对应的列表，未命中位置为 default
+        :param default: aligned 模式下未命中的占位值
+        :param batch_size: 单批次最大键数
+        :return:
+        """
+        keys = list(keys or [])
+        if not self._redis_client or not keys:
+            return [default] * len(keys) if aligned else []
+        values = [self.safe_loads(raw) if raw else default
+                  for raw in await self._mget_raw(keys, batch_size=batch_size)]
+        if aligned:
+            return values
+        return [value for value in values if value is not default]
+
+    @async_redis_exception_handler
+    async def mset(self, mapping: Dict[str, Any], ex: Optional[int] = None, chunk_size: int = 1000) -> Dict[str, bool]:
+        """
+        批量安全存储数据，每批次一个管道（SET key value EX ttl），各批次并发执行
+        :param mapping: 数据字典
+        :param ex: 过期时间
+        :param chunk_size: 单个管道最大命令数
+        :return: {key: 是否写入成功}
+        """
+        processed = {k: self.safe_dumps(v, k) for k, v in mapping.items()}
+
+        async def write(keys):
+            try:
+                pipe = self._pipeline()
+                for key in keys:
+                    pipe.set(key, processed[key], ex=ex)
+                results = await pipe.execute(raise_on_error=False)
+                return {key: res is True for key, res in zip(keys, results)}
+            except RedisError as e:
+                logger.error(f"Async redis mset batch failed ({len(keys)} keys): {e}")
+                return dict.fromkeys(keys, False)
+
+        result = {}
+        for part in await asyncio.gather(*(write(chunk) for chunk in self._chunks(list(processed), chunk_size))):
+            result.update(part)
+        return result
+
+    @async_redis_exception_handler
+    async def delete(self, key: str) -> None:
+        """删除键"""
+        await self._redis_client.delete(key)
+
+    @async_redis_exception_handler
+    async def delete_pattern(self, pattern, count: int = 1000, batch_size: int = 500) -> int:
+        """SCAN 匹配的键并分批 UNLINK，集群模式下遍历所有节点"""
+        deleted, batch = 0, []
+        async for key in self._redis_client.scan_iter(match=pattern, count=count):
+            batch.append(key)
+            if len(batch) >= batch_size:
+                deleted += await self._redis_client.unlink(*batch)
+                batch = []
+        if batch:
+            deleted += await self._redis_client.unlink(*batch)
+        return deleted
+
+    async def redis_incr(self, key, ex_time):
+        """
+        查询key的调用次数以及key的过期时间
+        :param key:
+        :param ex_time:
+        :return:
+        """
+        return await scripts.aexecute(self._redis_client, 'incr_expire', keys=[key], args=[ex_time])
+
+    async def keys(self, pattern):
+        return await self._redis_client.keys(pattern)
+
+    async def hset(self, name, key, value):
+        return await self._redis_client.hset(name, key, value)
+
+    async def hmset(self, name, mapping):
+        return await self._redis_client.hset(name, mapping=mapping)
+
+    async def hget(self, name, key):
+        return await self._redis_client.hget(name, key)
+
+    async def hmget(self, name, keys, *args):
+        return await self._redis_client.hmget(name, keys, *args)
+
+    async def hgetall(self, name):
+        return await self._redis_client.hgetall(name)
+
+    async def hexists(self, name, key):
+        return await self._redis_client.hexists(name, key)
+
+    async def hdel(self, name, *keys):
+        return await self._redis_client.hdel(name, *keys)
+
+
+class AsyncRedisLock(object):
+    """
+    异步 Redis 分布式锁，语义与 RedisLock 一致（Lua 释放、栅栏令牌、BLPOP 唤醒、可选后台续期）
+    >>> async with AsyncRedisLock(async_redis_client, "my_resource") as lock:
+    ...     await write(data, fencing_token=lock.fencing_token)
+    """
+
+    max_block = 1.0
+
+    def __init__(self, redis_cache: AsyncRedisCache = None, key: str = None, timeout: int = 10,
+                 blocking_timeout: Optional[float] = None, renew: bool = False):
+        redis_cache = redis_cache or async_redis_client
+        self._redis_client = getattr(redis_cache, '_redis_client', redis_cache)
+        self.name = key
+        self.key = f"lock:{{{key}}}"
+        self.fence_key = f"{self.key}:fence"
+        self.notify_key = f"{self.key}:notify"
+        self.timeout = timeout
+        self.blocking_timeout = timeout if blocking_timeout is None else blocking_timeout
+        self.renew_enabled = renew
+        self.token = None
+        self.fencing_token = None
+        self._renew_task = None
+
+    @property
+    def _lease_ms(self) -> int:
+        return int(self.timeout * 1000)
+
+    async def acquire(self, blocking: bool = True) -> bool:
+        token = uuid.uuid4().hex
+        st = time.monotonic()
+        deadline = st + (self.blocking_timeout if blocking else 0)
+        while True:
+            ok, value = await scripts.aexecute(self._redis_client, 'lock_acquire',
+                                               keys=[self.key, self.fence_key], args=[token, self._lease_ms])
+            if ok:
+                self.token, self.fencing_token = token, int(value)
+                lock_metrics.observe(time.monotonic() - st, True)
+                if self.renew_enabled:
+                    self._renew_task = asyncio.ensure_future(self._renew_loop())
+                return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                lock_metrics.observe(time.monotonic() - st, False)
+                return False
+            wait = min(remaining, self.max_block, value / 1000 if value and value > 0 else self.max_block)
+            await self._redis_client.blpop([self.notify_key], timeout=max(wait, 0.01))
+
+    async def release(self) -> bool:
+        if self._renew_task is not None:
+            self._renew_task.cancel()
+            self._renew_task = None
+        if not self.token:
+            return False
+        released = await scripts.aexecute(self._redis_client, 'lock_release',
+                                          keys=[self.key, self.notify_key], args=[self.token, self._lease_ms])
+        self.token = None
+        return bool(released)
+
+    async def renew(self) -> bool:
+        if not self.token:
+            return False
+        renewed = bool(await scripts.aexecute(self._redis_client, 'lock_renew',
+                                              keys=[self.key], args=[self.token, self._lease_ms]))
+        lock_metrics.incr('renewals' if renewed else 'lost')
+        return renewed
+
+    async def locked(self) -> bool:
+        return bool(await self._redis_client.exists(self.key))
+
+    async def _renew_loop(self):
+        while True:
+            await asyncio.sleep(max(self.timeout / 3, 0.1))
+            try:
+                if not await self.renew():
+                    logger.warning(f"Redis lock {self.key} lost before release")
+                    return
+            except RedisError as e:
+                logger.warning(f"Redis lock {self.key} renew failed: {e}")
+
+    async def __aenter__(self) -> "AsyncRedisLock":
+        if not await self.acquire():
+            raise TimeoutError(f"Acquire lock timeout for {self.key}")
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        await self.release()
+
+
+async_redis_client = AsyncRedisCache()
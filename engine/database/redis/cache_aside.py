@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+# -*- coding: utf8 -*-
+"""
+旁路缓存装饰器 cached，支持同步/异步函数
+
+    - 单飞：同一进程内同一 key 只有一个调用回源，跨进程通过 RedisLock 互斥（回源期间自动续期），
+      Redis 不可用时不加锁直接回源
+    - 概率提前刷新（XFetch）：临近过期时按回源耗时概率性地后台刷新
+    - stale-while-revalidate：逻辑过期后 stale_ttl 内先返回旧值并后台刷新
+    - 负缓存：回源结果为 None 时按 negative_ttl 缓存
+
+>>> @cached(key='device:{device_id}', ttl=60, stale_ttl=30)
+... def get_device(device_id):
+...     ...
+"""
+import asyncio
+import hashlib
+import inspect
+import logging
+import math
+import random
+import threading
+import time
+from concurrent.futures import Future
+from functools import wraps
+from typing import Callable, Optional, Union
+
+from redis.exceptions import RedisError
+
+from confs import async_manager
+from .server import RedisCache, RedisLock, redis_client
+
+logger = logging.getLogger(__name__)
+
+_FRESH, _EARLY, _STALE, _MISS = 'fresh', 'early', 'stale', 'miss'
+
+_metrics = {}
+_metrics_lock = threading.Lock()
+
+
+class CacheMetrics(object):
+    """单个 cached 函数的命中/回源统计"""
+
+    FIELDS = ('hits', 'misses', 'stale_hits', 'negative_hits', 'early_refreshes',
+              'background_refreshes', 'recomputes', 'lock_timeouts', 'lock_errors', 'errors')
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        for field in self.FIELDS:
+            setattr(self, field, 0)
+
+    def incr(self, field, value=1):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + value)
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            data = {field: getattr(self, field) for field in self.FIELDS}
+        total = data['hits'] + data['misses']
+        data['hit_rate'] = round(data['hits'] / total, 4) if total else 0.0
+        return data
+
+
+def cache_metrics(name: Optional[str] = None) -> dict:
+    """返回所有（或指定）cached 函数的统计"""
+    with _metrics_lock:
+        items = dict(_metrics)
+    if name is not None:
+        return items[name].as_dict() if name in items else {}
+    return {n: m.as_dict() for n, m in items.items()}
+
+
+def _key_builder(func, key):
+    if callable(key):
+        return key
+    signature = inspect.signature(func)
+    params = list(signature.parameters)
+    skip_first = bool(params) and params[0] in ('self', 'cls')
+
+    def build(*args, **kwargs):
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        arguments = dict(bound.arguments)
+        if key is not None:
+            return key.format(**arguments)
+        if skip_first:
+            arguments.pop(params[0], None)
+        digest = hashlib.md5(repr(sorted(arguments.items())).encode('utf8')).hexdigest()
+        return f"cached:{func.__module__}.{func.__qualname__}:{digest}"
+
+    return build
+
+
+class _Policy(object):
+    """缓存信封的读写与新鲜度判定，同步/异步共用"""
+
+    def __init__(self, ttl, stale_ttl, beta, negative_ttl):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.beta = beta
+        self.negative_ttl = negative_ttl
+
+    def state(self, envelope) -> str:
+        if not isinstance(envelope, dict) or 'e' not in envelope:
+            return _MISS
+        now = time.time()
+        expire_at = envelope['e']
+        if now < expire_at:
+            # XFetch: now - delta * beta * ln(rand) >= expiry 时提前刷新
+            if self.beta > 0 and envelope.get('d') and \
+                    now - envelope['d'] * self.beta * math.log(1.0 - random.random()) >= expire_at:
+                return _EARLY
+            return _FRESH
+        if now < expire_at + self.stale_ttl:
+            return _STALE
+        return _MISS
+
+    def pack(self, value, delta):
+        """返回 (信封, 物理过期秒数)，不缓存时返回 (None, None)"""
+        now = time.time()
+        if value is None:
+            if not self.negative_ttl:
+                return None, None
+            return {'n': 1, 'e': now + self.negative_ttl, 'd': delta}, int(math.ceil(self.negative_ttl))
+        return {'v': value, 'e': now + self.ttl, 'd': delta}, int(math.ceil(self.ttl + self.stale_ttl))
+
+    @staticmethod
+    def unpack(envelope):
+        return None if envelope.get('n') else envelope.get('v')
+
+
+def cached(key: Union[str, Callable, None] = None, ttl: float = 60, stale_ttl: float = 0,
+           beta: float = 1.0, negative_ttl: Optional[float] = None, lock_timeout: int = 10,
+           cache: Optional[RedisCache] = None, name: Optional[str] = None):
+    """
+    旁路缓存装饰器
+    :param key: 缓存键，格式化字符串（按参数名填充，如 'device:{device_id}'）或 callable(*args, **kwargs)，
+                为空时按函数名与参数摘要生成
+    :param ttl: 逻辑过期时间（秒）
+    :param stale_ttl: 逻辑过期后仍可返回旧值并后台刷新的时长（秒），0 表示不启用
+    :param beta: XFetch 提前刷新系数，越大越积极，0 表示关闭
+    :param negative_ttl: 回源结果为 None 时的缓存时长（秒），为空不缓存 None
+    :param lock_timeout: 跨进程回源锁的租约与最长等待时间（秒），持有期间按 1/3 租约续期，
+                         回源耗时超过租约也不会丢锁；等待超时或加锁出错时直接回源
+    :param cache: 缓存实例，同步函数默认 redis_client，异步函数默认 async_redis_client
+    :param name: 统计名称，默认为函数全名
+    :return:
+    """
+    policy = _Policy(ttl, stale_ttl, beta, negative_ttl)
+
+    def decorator(func):
+        metrics_name = name or f"{func.__module__}.{func.__qualname__}"
+        metrics = CacheMetrics(metrics_name)
+        with _metrics_lock:
+            _metrics[metrics_name] = metrics
+        build_key = _key_builder(func, key)
+
+        if inspect.iscoroutinefunction(func):
+            wrapper = _async_wrapper(func, build_key, policy, metrics, cache, lock_timeout)
+        else:
+            wrapper = _sync_wrapper(func, build_key, policy, metrics, cache or redis_client, lock_timeout)
+        wrapper.cache_metrics = metrics
+        wrapper.cache_key = build_key
+        return wrapper
+
+    return decorator
+
+
+def _sync_wrapper(func, build_key, policy, metrics, cache, lock_timeout):
+    inflight = {}
+    inflight_lock = threading.Lock()
+
+    def single_flight(cache_key, fn):
+        with inflight_lock:
+            future = inflight.get(cache_key)
+            leader = future is None
+            if leader:
+                future = inflight[cache_key] = Future()
+        if not leader:
+            return future.result()
+        try:
+            result = fn()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with inflight_lock:
+                inflight.pop(cache_key, None)
+
+    def load(cache_key, args, kwargs, refresh_after=None):
+        """
+        回源并写缓存，refresh_after 为后台刷新时旧信封的过期时间，
+        拿到锁后发现缓存已被其他进程刷新则直接返回
+        """
+
+        def compute():
+            st = time.time()
+            value = func(*args, **kwargs)
+            envelope, ex = policy.pack(value, time.time() - st)
+            metrics.incr('recomputes')
+            if envelope is not None:
+                cache.set(cache_key, envelope, ex=ex)
+            return value
+
+        lock = RedisLock(cache, f"cached:{cache_key}", lock_timeout, renew=True)
+        try:
+            acquired = lock.acquire()
+        except RedisError as e:
+            metrics.incr('lock_errors')
+            logger.warning(f"cached lock {cache_key} unavailable, computing without lock: {e}")
+            return compute()
+        if not acquired:
+            metrics.incr('lock_timeouts')
+            return compute()
+        try:
+            envelope = cache.get(cache_key)
+            state = policy.state(envelope)
+            if state in (_FRESH, _EARLY) and (refresh_after is None or envelope['e'] > refresh_after):
+                return policy.unpack(envelope)
+            return compute()
+        finally:
+            try:
+                lock.release()
+            except RedisError as e:
+                logger.warning(f"cached lock {cache_key} release failed: {e}")
+
+    def refresh_in_background(cache_key, envelope, args, kwargs):
+        with inflight_lock:
+            if cache_key in inflight:
+                return
+        metrics.incr('background_refreshes')
+
+        def task():
+            try:
+                single_flight(cache_key, lambda: load(cache_key, args, kwargs, refresh_after=envelope['e']))
+            except Exception as e:
+                metrics.incr('errors')
+                logger.warning(f"cached background refresh {cache_key} failed: {e}")
+
+        async_manager.executor.submit(task)
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        cache_key = build_key(*args, **kwargs)
+        envelope = cache.get(cache_key)
+        state = policy.state(envelope)
+        if state == _MISS:
+            metrics.incr('misses')
+            return single_flight(cache_key, lambda: load(cache_key, args, kwargs))
+        metrics.incr('hits')
+        if envelope.get('n'):
+            metrics.incr('negative_hits')
+        if state == _STALE:
+            metrics.incr('stale_hits')
+            refresh_in_background(cache_key, envelope, args, kwargs)
+        elif state == _EARLY:
+            metrics.incr('early_refreshes')
+            refresh_in_background(cache_key, envelope, args, kwargs)
+        return policy.unpack(envelope)
+
+    def invalidate(*args, **kwargs):
+        cache.delete(build_key(*args, **kwargs))
+
+    wrapper.invalidate = invalidate
+    return wrapper
+
+
+def _async_wrapper(func, build_key, policy, metrics, cache, lock_timeout):
+    from .async_server import AsyncRedisLock, async_redis_client
+
+    cache = cache or async_redis_client
+    inflight = {}
+    background = set()
+
+    async def single_flight(cache_key, fn):
+        future = inflight.get(cache_key)
+        if future is not None:
+            return await asyncio.shield(future)
+        future = inflight[cache_key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await fn()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            # 没有等待者时避免 "exception was never retrieved"
+            future.exception()
+            raise
+        finally:
+            inflight.pop(cache_key, None)
+
+    async def load(cache_key, args, kwargs, refresh_after=None):
+        async def compute():
+            st = time.time()
+            value = await func(*args, **kwargs)
+            envelope, ex = policy.pack(value, time.time() - st)
+            metrics.incr('recomputes')
+            if envelope is not None:
+                await cache.set(cache_key, envelope, ex=ex)
+            return value
+
+        lock = AsyncRedisLock(cache, f"cached:{cache_key}", lock_timeout, renew=True)
+        try:
+            acquired = await lock.acquire()
+        except RedisError as e:
+            metrics.incr('lock_errors')
+            logger.warning(f"cached lock {cache_key} unavailable, computing without lock: {e}")
+            return await compute()
+        if not acquired:
+            metrics.incr('lock_timeouts')
+            return await compute()
+        try:
+            envelope = await cache.get(cache_key)
+            state = policy.state(envelope)
+            if state in (_FRESH, _EARLY) and (refresh_after is None or envelope['e'] > refresh_after):
+                return policy.unpack(envelope)
+            return await compute()
+        finally:
+            try:
+                await lock.release()
+            except RedisError as e:
+                logger.warning(f"cached lock {cache_key} release failed: {e}")
+
+    def refresh_in_background(cache_key, envelope, args, kwargs):
+        if cache_key in inflight:
+            return
+        metrics.incr('background_refreshes')
+
+        async def task():
+            try:
+                await single_flight(cache_key, lambda: load(cache_key, args, kwargs, refresh_after=envelope['e']))
+            except Exception as e:
+                metrics.incr('errors')
+                logger.warning(f"cached background refresh {cache_key} failed: {e}")
+
+        job = asyncio.ensure_future(task())
+        background.add(job)
+        job.add_done_callback(background.discard)
+
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        cache_key = build_key(*args, **kwargs)
+        envelope = await cache.get(cache_key)
+        state = policy.state(envelope)
+        if state == _MISS:
+            metrics.incr('misses')
+            return await single_flight(cache_key, lambda: load(cache_key, args, kwargs))
+        metrics.incr('hits')
+        if envelope.get('n'):
+            metrics.incr('negative_hits')
+        if state == _STALE:
+            metrics.incr('stale_hits')
+            refresh_in_background(cache_key, envelope, args, kwargs)
+        elif state == _EARLY:
+            metrics.incr('early_refreshes')
+            refresh_in_background(cache_key, envelope, args, kwargs)
+        return policy.unpack(envelope)
+
+    async def invalidate(*args, **kwargs):
+        await cache.delete(build_key(*args, **kwargs))
+
+    wrapper.invalidate = invalidate
+    return wrapper
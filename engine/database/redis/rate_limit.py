@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+# -*- coding: utf8 -*-
+"""
+基于 Redis Lua 脚本的限流器，每次检查一次往返且原子执行
+
+    - fixed_window：固定窗口计数
+    - sliding_log：滑动日志（ZSET 记录每次请求，精确但占用随请求数增长）
+    - sliding_window：滑动窗口计数（当前窗口 + 上一窗口按比例加权，单个 HASH）
+    - token_bucket：令牌桶，burst 为桶容量
+
+时间统一取 Redis TIME，避免多实例时钟偏差。被拒绝的标识在本地记录可重试时间，
+在此之前的检查直接本地拒绝，不再访问 Redis。
+
+>>> limiter = RateLimiter(100, 60, algorithm='sliding_window', prefix='api')
+>>> limiter.hit(user_id).allowed
+>>> @router.get('/devices', dependencies=[Depends(limiter.dependency())])
+"""
+import logging
+import threading
+import time
+import uuid
+from typing import Callable, List, NamedTuple, Optional
+
+from fastapi import HTTPException, Request
+from redis.exceptions import RedisError
+
+from modules.fastapi_redis.scripts import scripts
+from .server import RedisCache, redis_client
+
+logger = logging.getLogger(__name__)
+
+# 以下脚本均返回 {是否通过, 剩余额度, 需等待毫秒数}
+_NOW = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+"""
+
+FIXED_WINDOW_SCRIPT = _NOW + """
+local limit, window, cost = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local current = tonumber(redis.call('GET', KEYS[1]) or '0')
+local ttl = redis.call('PTTL', KEYS[1])
+if current + cost > limit then
+    if ttl < 0 then ttl = window end
+    return {0, math.max(limit - current, 0), ttl}
+end
+current = redis.call('INCRBY', KEYS[1], cost)
+if ttl < 0 then
+    redis.call('PEXPIRE', KEYS[1], window)
+end
+return {1, limit - current, 0}
+"""
+
+SLIDING_LOG_SCRIPT = _NOW + """
+local limit, window, cost = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - window)
+local count = redis.call('ZCARD', KEYS[1])
+if count + cost > limit then
+    -- 需要等到足够多的最早记录滑出窗口
+    local oldest = redis.call('ZRANGE', KEYS[1], 0, count + cost - limit - 1, 'WITHSCORES')
+    local retry = window
+    if #oldest > 0 and cost <= limit then
+        retry = tonumber(oldest[#oldest]) + window - now
+    end
+    return {0, math.max(limit - count, 0), math.max(retry, 1)}
+end
+for i = 1, cost do
+    redis.call('ZADD', KEYS[1], now, ARGV[4] .. ':' .. i)
+end
+redis.call('PEXPIRE', KEYS[1], window)
+return {1, limit - count - cost, 0}
+"""
+
+SLIDING_WINDOW_SCRIPT = _NOW + """
+local limit, window, cost = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local index = math.floor(now / window)
+local offset = now % window
+local current = tonumber(redis.call('HGET', KEYS[1], index) or '0')
+local previous = tonumber(redis.call('HGET', KEYS[1], index - 1) or '0')
+local weighted = previous * (1 - offset / window) + current
+if weighted + cost > limit then
+    local retry = window
+    if cost <= limit then
+        if current + cost <= limit and previous > 0 then
+            -- 本窗口内等上一窗口的权重衰减
+            retry = math.ceil((1 - (limit - current - cost) / previous) * window) - offset
+        elseif current > 0 then
+            -- 等到下一窗口，本窗口计数成为上一窗口后衰减
+            retry = window - offset + math.ceil(math.max(1 - (limit - cost) / current, 0) * window)
+        end
+    end
+    return {0, math.max(math.floor(limit - weighted), 0), math.max(retry, 1)}
+end
+redis.call('HINCRBY', KEYS[1], index, cost)
+redis.call('HDEL', KEYS[1], index - 2)
+redis.call('PEXPIRE', KEYS[1], window * 2)
+return {1, math.floor(limit - weighted - cost), 0}
+"""
+
+TOKEN_BUCKET_SCRIPT = _NOW + """
+local capacity, window, cost, limit = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[5])
+local rate = limit / window
+local data = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(data[1]) or capacity
+local ts = tonumber(data[2]) or now
+tokens = math.min(capacity, tokens + math.max(now - ts, 0) * rate)
+local allowed, retry = 0, 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+elseif cost > capacity then
+    retry = window
+else
+    retry = math.ceil((cost - tokens) / rate)
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate) + 1000)
+return {allowed, math.floor(tokens), retry}
+"""
+
+ALGORITHMS = {
+    'fixed_window': FIXED_WINDOW_SCRIPT,
+    'sliding_log': SLIDING_LOG_SCRIPT,
+    'sliding_window': SLIDING_WINDOW_SCRIPT,
+    'token_bucket': TOKEN_BUCKET_SCRIPT,
+}
+
+for _algorithm, _source in ALGORITHMS.items():
+    scripts.register(f'ratelimit_{_algorithm}', _source)
+
+
+class RateLimitResult(NamedTuple):
+    allowed: bool
+    limit: int
+    remaining: int
+    # 被拒绝时需等待的秒数
+    retry_after: float
+    key: str
+
+    def headers(self) -> dict:
+        headers = {'X-RateLimit-Limit': str(self.limit), 'X-RateLimit-Remaining': str(max(self.remaining, 0))}
+        if not self.allowed:
+            headers['Retry-After'] = str(max(int(self.retry_after + 0.999), 1))
+        return headers
+
+
+def client_ip(request: Request) -> str:
+    """默认限流标识：X-Forwarded-For 第一个地址，否则为对端地址"""
+    forwarded = request.headers.get('x-forwarded-for')
+    if forwarded:
+        return forwarded.split(',')[0].strip()
+    return request.client.host if request.client else 'unknown'
+
+
+class RateLimiter(object):
+    """限流器，同步接口使用 RedisCache，异步接口使用 AsyncRedisCache"""
+
+    def __init__(self, limit: int, window: float, algorithm: str = 'sliding_window', prefix: str = 'ratelimit',
+                 burst: Optional[int] = None, cache: Optional[RedisCache] = None, async_cache=None,
+                 local_precheck: bool = True, fail_open: bool = True, max_local_entries: int = 100000):
+        """
+        :param limit: 窗口内允许的次数（令牌桶为每个窗口补充的令牌数）
+        :param window: 窗口长度（秒）
+        :param algorithm: fixed_window / sliding_log / sliding_window / token_bucket
+        :param prefix: 键前缀
+        :param burst: 令牌桶容量，默认等于 limit
+        :param cache: 同步缓存实例，默认 redis_client
+        :param async_cache: 异步缓存实例，默认 async_redis_client
+        :param local_precheck: 被拒绝的标识在可重试之前直接本地拒绝
+        :param fail_open: Redis 不可用时放行
+        :param max_local_entries: 本地拒绝记录的最大条目数
+        """
+        if algorithm not in ALGORITHMS:
+            raise ValueError(f"Unknown rate limit algorithm: {algorithm}, available: {sorted(ALGORITHMS)}")
+        self.limit = limit
+        self.window_ms = int(window * 1000)
+        self.algorithm = algorithm
+        self.prefix = prefix
+        self.burst = burst or limit
+        self.local_precheck = local_precheck
+        self.fail_open = fail_open
+        self.max_local_entries = max_local_entries
+
+        self._cache = cache
+        self._async_cache = async_cache
+        self.script_name = f'ratelimit_{algorithm}'
+        self._blocked = {}
+        self._lock = threading.Lock()
+        self.stats = {'checks': 0, 'allowed': 0, 'denied': 0, 'local_rejections': 0, 'errors': 0}
+
+    @property
+    def cache(self) -> RedisCache:
+        return self._cache or redis_client
+
+    @property
+    def async_cache(self):
+        if self._async_cache is None:
+            from .async_server import async_redis_client
+            self._async_cache = async_redis_client
+        return self._async_cache
+
+    def key(self, identity) -> str:
+        return f"{self.prefix}:{self.algorithm}:{identity}"
+
+    def _args(self, cost) -> list:
+        capacity = self.burst if self.algorithm == 'token_bucket' else self.limit
+        return [capacity, self.window_ms, cost, uuid.uuid4().hex, self.limit]
+
+    def _record(self, field, value=1):
+        with self._lock:
+            self.stats[field] += value
+
+    def _precheck(self, identity) -> Optional[RateLimitResult]:
+        if not self.local_precheck:
+            return None
+        until = self._blocked.get(identity)
+        if until is None:
+            return None
+        remaining = until - time.monotonic()
+        if remaining <= 0:
+            self._blocked.pop(identity, None)
+            return None
+        self._record('checks')
+        self._record('local_rejections')
+        self._record('denied')
+        return RateLimitResult(False, self.limit, 0, remaining, self.key(identity))
+
+    def _result(self, identity, response) -> RateLimitResult:
+        allowed, remaining, retry_ms = (int(v) for v in response)
+        result = RateLimitResult(bool(allowed), self.limit, remaining, retry_ms / 1000.0, self.key(identity))
+        self._record('checks')
+        self._record('allowed' if result.allowed else 'denied')
+        if not result.allowed and self.local_precheck and retry_ms > 0:
+            with self._lock:
+                if len(self._blocked) >= self.max_local_entries:
+                    now = time.monotonic()
+                    self._blocked = {k: v for k, v in self._blocked.items() if v > now}
+                    if len(self._blocked) >= self.max_local_entries:
+                        self._blocked.clear()
+                self._blocked[identity] = time.monotonic() + result.retry_after
+        return result
+
+    def _failure(self, identity, e) -> RateLimitResult:
+        self._record('errors')
+        logger.warning(f"Rate limit check {self.key(identity)} failed: {e}")
+        return RateLimitResult(self.fail_open, self.limit, 0, 0.0, self.key(identity))
+
+    def hit(self, identity, cost: int = 1) -> RateLimitResult:
+        """消耗 cost 次额度并返回检查结果"""
+        result = self._precheck(identity)
+        if result is not None:
+            return result
+        try:
+            response = scripts.execute(self.cache._redis_client, self.script_name,
+                                       keys=[self.key(identity)], args=self._args(cost))
+            return self._result(identity, response)
+        except RedisError as e:
+            return self._failure(identity, e)
+
+    def hit_many(self, identities: List, cost: int = 1) -> List[RateLimitResult]:
+        """批量检查，一个管道一次往返（集群模式下按节点并发），结果与 identities 顺序一致"""
+        results = [self._precheck(identity) for identity in identities]
+        pending = [index for index, result in enumerate(results) if result is None]
+        if not pending:
+            return results
+        calls = [([self.key(identities[index])], self._args(cost)) for index in pending]
+        try:
+            responses = scripts.execute_many(self.cache._redis_client, self.script_name, calls, raise_on_error=False)
+        except RedisError as e:
+            for index in pending:
+                results[index] = self._failure(identities[index], e)
+            return results
+        for index, response in zip(pending, responses):
+            identity = identities[index]
+            if isinstance(response, Exception):
+                results[index] = self._failure(identity, response)
+            else:
+                results[index] = self._result(identity, response)
+        return results
+
+    async def ahit(self, identity, cost: int = 1) -> RateLimitResult:
+        """hit 的异步版本"""
+        result = self._precheck(identity)
+        if result is not None:
+            return result
+        try:
+            response = await scripts.aexecute(self.async_cache._redis_client, self.script_name,
+                                              keys=[self.key(identity)], args=self._args(cost))
+            return self._result(identity, response)
+        except RedisError as e:
+            return self._failure(identity, e)
+
+    def reset(self, identity) -> None:
+        self._blocked.pop(identity, None)
+        self.cache.delete(self.key(identity))
+
+    def dependency(self, key_func: Optional[Callable[[Request], str]] = None, cost: int = 1):
+        """
+        FastAPI 依赖，超限时抛出 429，结果写入 request.state.rate_limit
+        :param key_func: 从请求提取限流标识，默认按客户端 IP
+        :param cost: 单次请求消耗的额度
+        """
+
+        async def check_rate_limit(request: Request):
+            identity = key_func(request) if key_func else client_ip(request)
+            result = await self.ahit(identity, cost)
+            request.state.rate_limit = result
+            if not result.allowed:
+                raise HTTPException(status_code=429, detail='Too Many Requests', headers=result.headers())
+            return result
+
+        return check_rate_limit
@@ -1,22 +1,36 @@
 #!/usr/bin/env python3
 # -*- coding: utf8 -*-
 
+import asyncio
+import bisect
 import logging
-import pickle
+import os
+import socket
+import threading
 import time
+import uuid
 from collections import defaultdict
-from functools import wraps
-from typing import Optional, Any, Dict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, wraps
+from typing import Optional, Any, Dict, List
 
 import redis
 from redis import Redis, StrictRedis
+from redis.crc import key_slot
 from redis.exceptions import ConnectionError
 
-from confs import c, redis_conf
-from modules.fastapi_redis import FastApiRedis
+from confs import c, redis_conf, async_manager
+from modules.fastapi_redis import FastApiRedis, NearCache, ClientTrackingInvalidator, get_codec
+from modules.fastapi_redis.replicas import REPLICA_FAILURES
+from modules.fastapi_redis.scripts import scripts
+from .write_behind import WriteBehindBuffer
+from utils.async_executor import AsyncExecutorManager
 
 logger = logging.getLogger(__name__)
 
+# 集群按节点并发下发批量命令使用的线程池
+node_executor = AsyncExecutorManager(max_workers=redis_conf.fanout_workers)
+
 # 安全反序列化白名单
 ALLOWED_UNPICKLE_CLASSES = {
     'builtins': [list, dict, str, int, float, bool, tuple],
@@ -24,13 +38,118 @@ ALLOWED_UNPICKLE_CLASSES = {
 }
 
 
+class _CacheMiss(object):
+    """mget(aligned=True) 未命中占位"""
+    __slots__ = ()
+
+    def __bool__(self):
+        return False
+
+    def __repr__(self):
+        return 'CACHE_MISS'
+
+
+CACHE_MISS = _CacheMiss()
+
+
+class DeletePatternReport(object):
+    """delete_pattern 进度与结果，线程安全"""
+
+    def __init__(self, pattern, nodes: List[str], progress=None):
+        self.pattern = pattern
+        self.scanned = 0
+        self.deleted = 0
+        self.batches = 0
+        self.errors: Dict[str, str] = {}
+        self.nodes = {name: {'scanned': 0, 'deleted': 0, 'done': False} for name in nodes}
+        self.started_at = time.time()
+        self.finished_at = None
+        self._progress = progress
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+
+    def add(self, node, scanned: int = 0, deleted: int = 0, batches: int = 0) -> None:
+        with self._lock:
+            self.scanned += scanned
+            self.deleted += deleted
+            self.batches += batches
+            self.nodes[node]['scanned'] += scanned
+            self.nodes[node]['deleted'] += deleted
+        if deleted and self._progress is not None:
+            try:
+                self._progress(self)
+            except Exception as e:
+                logger.warning(f"delete_pattern progress callback error: {e}")
+
+    def fail(self, node, error) -> None:
+        with self._lock:
+            self.errors[node] = str(error)
+
+    def finish_node(self, node) -> None:
+        with self._lock:
+            self.nodes[node]['done'] = True
+            if all(item['done'] for item in self.nodes.values()):
+                self.finished_at = time.time()
+
+    def cancel(self) -> None:
+        """请求停止，正在执行的批次完成后退出"""
+        self._cancel.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    @property
+    def done(self) -> bool:
+        return self.finished_at is not None
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            elapsed = (self.finished_at or time.time()) - self.started_at
+            return {
+                'pattern': self.pattern,
+                'scanned': self.scanned,
+                'deleted': self.deleted,
+                'batches': self.batches,
+                'nodes': {name: dict(item) for name, item in self.nodes.items()},
+                'errors': dict(self.errors),
+                'done': self.finished_at is not None,
+                'cancelled': self._cancel.is_set(),
+                'elapsed': round(elapsed, 3),
+            }
+
+
+class _KeyRateLimiter(object):
+    """跨节点线程共享的令牌桶，限制每秒删除的键数"""
+
+    def __init__(self, rate: float):
+        self.rate = float(rate)
+        self._tokens = self.rate
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount: int) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.rate, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                # 单批超过桶容量时允许透支，等待时间由欠额决定
+                if self._tokens >= min(amount, self.rate):
+                    self._tokens -= amount
+                    return
+                wait = (min(amount, self.rate) - self._tokens) / self.rate
+            time.sleep(wait)
+
+
 def redis_exception_handler(func):
+    @wraps(func)
     def wrapper(*args, **kwargs):
         try:
             return func(*args, **kwargs)
         except Exception as e:
             endpoint = '{} {}'.format(func.__module__, func.__name__)
-            logger.warning(f'{endpoint}', str(e))
+            logger.warning(f'{endpoint}: {e}')
             return None
 
     return wrapper
@@ -62,106 +181,528 @@ def retry_connection(retries: int = 3, delay: float = 0.5):
 class RedisCache(FastApiRedis):
     """Redis缓存扩展类，支持集群模式和自动重试"""
 
-    def __init__(self, app=None, strict=True, **kwargs):
+    # 标签集合、命名空间代数计数器的键前缀
+    TAG_PREFIX = 'tag:'
+    NAMESPACE_PREFIX = 'ns:'
+
+    def __init__(self, app=None, strict=True, near_cache=None, write_behind=None, **kwargs):
+        """
+        :param near_cache: 近端缓存配置（dict），为空时不启用，参见 enable_near_cache
+        :param write_behind: 异步回写配置（dict），为空时不启用，参见 enable_write_behind
+        """
+        self._near_cache = None
+        self._tracking = None
+        self._write_behind = None
         # 先初始化父类（不立即创建连接）
         super().__init__(app=app, strict=strict, **kwargs)
+        if near_cache:
+            self.enable_near_cache(**near_cache)
+        if write_behind:
+            self.enable_write_behind(**write_behind)
+
+    def enable_near_cache(self, max_entries: int = 10000, max_bytes: int = 64 * 1024 * 1024,
+                          ttl: float = 60, prefixes=None) -> NearCache:
+        """
+        启用进程内近端缓存，get/mget/exists 优先读取本地，依赖 Redis 6 CLIENT TRACKING 失效通知保持一致
+        :param max_entries: 最大条目数
+        :param max_bytes: 最大字节数
+        :param ttl: 本地条目存活时间（秒）
+        :param prefixes: 只跟踪指定前缀的键（BCAST PREFIX），为空跟踪全部
+        :return:
+        """
+        self.disable_near_cache()
+        self._near_cache = NearCache(max_entries=max_entries, max_bytes=max_bytes, ttl=ttl)
+        self._tracking = ClientTrackingInvalidator(self._redis_client, self._near_cache, prefixes=prefixes)
+        self._tracking.start()
+        return self._near_cache
+
+    def disable_near_cache(self) -> None:
+        if self._tracking is not None:
+            self._tracking.stop()
+        self._near_cache, self._tracking = None, None
+
+    def near_cache_stats(self) -> dict:
+        """近端缓存命中/未命中/淘汰计数"""
+        return self._near_cache.stats() if self._near_cache is not None else {}
+
+    def _near_invalidate(self, *keys) -> None:
+        if self._near_cache is not None:
+            self._near_cache.invalidate(keys)
+
+    def enable_write_behind(self, max_pending: int = 100000, batch_size: int = 1000, flush_interval: float = 0.1,
+                            overflow: str = 'block', block_timeout: Optional[float] = 1.0,
+                            mode: str = 'thread') -> WriteBehindBuffer:
+        """
+        启用异步回写，set(..., deferred=True) 合并写入后由后台批量刷写，参数见 WriteBehindBuffer
+        mode 为 asyncio 时需在事件循环内调用
+        """
+        self.disable_write_behind()
+        self._write_behind = WriteBehindBuffer(self, max_pending=max_pending, batch_size=batch_size,
+                                               flush_interval=flush_interval, overflow=overflow,
+                                               block_timeout=block_timeout, mode=mode).start()
+        return self._write_behind
+
+    def disable_write_behind(self):
+        """停止异步回写并写出剩余缓冲；asyncio 模式下在事件循环中调用时刷写在线程池执行，返回可 await 的 Future"""
+        buffer, self._write_behind = self._write_behind, None
+        if buffer is not None:
+            return buffer.close()
+
+    def flush_write_behind(self) -> int:
+        """立即刷写异步回写缓冲，返回写入的键数"""
+        return self._write_behind.flush() if self._write_behind is not None else 0
+
+    def write_behind_stats(self) -> dict:
+        """异步回写队列深度、合并/刷写/失败/背压计数与刷写耗时"""
+        return self._write_behind.metrics() if self._write_behind is not None else {}
+
+    def _discard_pending(self, *keys) -> None:
+        """直接写入或删除时丢弃异步回写缓冲中的旧值，避免之后刷写覆盖"""
+        if self._write_behind is not None:
+            self._write_behind.discard(*keys)
+
+    def _group_by_node(self, keys) -> Dict[str, tuple]:
+        """
+        按所属节点分组，返回 {节点名: (节点 Redis 客户端, [key, ...])}，组内保持 keys 原有顺序
+        非集群模式下只有一个分组
+        """
+        if not self.is_cluster:
+            return {'default': (self._redis_client, list(keys))}
+        groups = {}
+        for key in keys:
+            node = self._redis_client.get_node_from_key(key)
+            if node.name not in groups:
+                groups[node.name] = (self._redis_client.get_redis_connection(node), [])
+            groups[node.name][1].append(key)
+        return groups
+
+    @staticmethod
+    def _run_batches(func, batches: List[tuple]) -> list:
+        """并发执行 func(*batch)，仅一个批次时在当前线程执行，结果与 batches 顺序一致"""
+        if len(batches) <= 1:
+            return [func(*batch) for batch in batches]
+        futures = [node_executor.executor.submit(func, *batch) for batch in batches]
+        return [future.result() for future in futures]
+
+    @staticmethod
+    def _chunks(items: list, size: int):
+        size = max(int(size or len(items) or 1), 1)
+        for index in range(0, len(items), size):
+            yield items[index:index + size]
 
     @redis_exception_handler
-    def exists(self, key: str) -> bool:
+    def exists(self, key: str, stale_ok: Optional[bool] = None) -> bool:
         """检查键是否存在"""
-        return self._redis_client.exists(key) == 1
+        if self._write_behind is not None and self._write_behind.peek(key) is not None:
+            return True
+        if self._near_cache is not None and self._near_cache.get(key) is not NearCache.MISSING:
+            return True
+        return self._read(key, lambda client: client.exists(key), stale_ok) == 1
 
     @redis_exception_handler
-    def get(self, key: str, default: Any = None) -> Any:
-        """安全获取数据并自动反序列化"""
-        value = self._redis_client.get(key)
-        return self.safe_loads(value) if value else default
+    def get(self, key: str, default: Any = None, stale_ok: Optional[bool] = None) -> Any:
+        """
+        安全获取数据并自动反序列化
+        :param stale_ok: 是否允许从副本读取（可能读到稍旧数据），为空时取实例的 read_from_replicas
+        """
+        if self._write_behind is not None:
+            pending = self._write_behind.peek(key)
+            if pending is not None:
+                return self.safe_loads(pending)
+        near, token = self._near_cache, None
+        if near is not None:
+            value = near.get(key)
+            if value is not NearCache.MISSING:
+                return value
+            token = near.reserve(key)
+        value = self._read(key, lambda client: client.get(key), stale_ok)
+        if not value:
+            return default
+        data = self.safe_loads(value)
+        if near is not None:
+            near.put(key, data, len(value), token)
+        return data
+
+    @redis_exception_handler
+    def set(self, key: str, value: Any, ex: Optional[int] = None, tags: Optional[List[str]] = None,
+            deferred: bool = False) -> None:
+        """
+        序列化存储数据
+        :param key: 键
+        :param value: 值
+        :param ex: 过期时间（秒）
+        :param tags: 标签列表，键会登记到各标签集合中，之后可通过 invalidate_tags 精确删除
+        :param deferred: 放入异步回写缓冲后立即返回（需先 enable_write_behind，带 tags 时仍同步写入）
+        """
+        self._near_invalidate(key)
+        data = self.safe_dumps(value, key)
+        if deferred and not tags and self._write_behind is not None:
+            return self._write_behind.put(key, data, ex)
+        self._discard_pending(key)
+        result = self._redis_client.set(key, data, ex=ex)
+        if tags:
+            self._add_tags(key, tags, ex)
+        return result
+
+    def tag_key(self, tag: str) -> str:
+        return f"{self.TAG_PREFIX}{tag}"
+
+    def _add_tags(self, key, tags: List[str], ex: Optional[int] = None) -> None:
+        """
+        登记标签成员（Lua 原子判断，各标签一个管道往返），标签集合的过期时间不短于成员中最长的过期时间，
+        集合中有不过期的成员后不再设置过期时间
+        """
+        scripts.execute_many(self._redis_client, 'tag_add',
+                             [([self.tag_key(tag)], [key, int(ex or 0)]) for tag in tags])
 
     @redis_exception_handler
-    def set(self, key: str, value: Any, ex: Optional[int] = None) -> None:
-        """序列化存储数据"""
-        return self._redis_client.set(key, self.safe_dumps(value), ex=ex)
+    def tag(self, key: str, tags: List[str], ex: Optional[int] = None) -> None:
+        """为已存在的键追加标签"""
+        self._add_tags(key, tags, ex)
 
     @redis_exception_handler
-    def mget(self, keys):
-        """根据集群批量安全获取多个键并自动反序列化"""
-        result = []
-        if not self._redis_client or not keys:
-            return result
+    def tag_members(self, tag: str) -> list:
+        return list(self._redis_client.sscan_iter(self.tag_key(tag), count=500))
+
+    @redis_exception_handler
+    def invalidate_tags(self, tags: List[str], batch_size: int = 500) -> int:
+        """
+        删除标签下登记的所有键以及标签集合本身，复杂度只与受影响的键数相关
+        使用 SPOP 分批弹出成员，失效期间并发登记的键要么被本次弹出删除，要么留在集合中
+        :param tags: 标签列表
+        :param batch_size: 每批弹出并 UNLINK 的键数
+        :return: 删除的键数量
+        """
+        deleted = 0
+        for tag in tags:
+            tag_key = self.tag_key(tag)
+            while True:
+                keys = self._redis_client.spop(tag_key, batch_size)
+                if not keys:
+                    break
+                self._near_invalidate(*keys)
+                if self._write_behind is not None:
+                    self._write_behind.discard(*(key.decode('utf8') if isinstance(key, bytes) else key
+                                                 for key in keys))
+                batches = [(client, chunk) for client, node_keys in self._group_by_node(keys).values()
+                           for chunk in self._chunks(node_keys, batch_size)]
+                deleted += sum(self._run_batches(self._unlink_batch, batches))
+        return deleted
+
+    def namespace_version(self, namespace: str) -> int:
+        """命名空间当前代数，未初始化时为 0"""
+        return int(self._redis_client.get(f"{self.NAMESPACE_PREFIX}{namespace}:gen") or 0)
+
+    def namespace_key(self, namespace: str, key: str, version: Optional[int] = None) -> str:
+        """
+        拼接带代数的键 {namespace}:v{代数}:{key}，bump_namespace 后旧代数的键不再可达，随各自 TTL 过期
+        >>> redis_client.set(redis_client.namespace_key('station:12', 'devices'), data, ex=300)
+        """
+        if version is None:
+            version = self.namespace_version(namespace)
+        return f"{namespace}:v{version}:{key}"
+
+    def bump_namespace(self, namespace: str) -> int:
+        """命名空间代数加一，整体失效该命名空间下的键，无需扫描"""
+        return self._redis_client.incr(f"{self.NAMESPACE_PREFIX}{namespace}:gen")
+
+    def _mget_raw(self, keys, batch_size: int = 500, stale_ok: Optional[bool] = None) -> list:
+        """
+        批量获取原始值，结果与 keys 顺序一致
+        按节点分组、按 batch_size 分批并发执行；集群模式下批内按 slot 拆分为多个 MGET 放入同一管道
+        允许读副本时每个分片的批次发往该分片的副本，副本失败时回退主节点；单个批次失败时该批次按未命中处理
+        """
+        def read(client, chunk):
+            if not self.is_cluster:
+                return dict(zip(chunk, client.mget(chunk)))
+            slots = defaultdict(list)
+            for key in chunk:
+                slots[self._redis_client.keyslot(key)].append(key)
+            with client.pipeline(transaction=False) as pipe:
+                for slot_keys in slots.values():
+                    pipe.mget(slot_keys)
+                results = pipe.execute()
+            found = {}
+            for slot_keys, values in zip(slots.values(), results):
+                found.update(zip(slot_keys, values))
+            return found
+
+        found = {}
+        for part in self._run_batches(partial(self._read_batch, read, 'mget'),
+                                      self._read_batches(keys, batch_size, stale_ok)):
+            found.update(part)
+        return [found.get(key) for key in keys]
+
+    def _read_batches(self, keys, batch_size: int, stale_ok: Optional[bool] = None) -> List[tuple]:
+        """
+        按节点分组并按 batch_size 切分，返回 [(客户端, keys, 副本名, 主节点客户端)]
+        允许读副本时客户端为该分片的副本，副本名与主节点客户端用于失败回退
+        """
+        if stale_ok is None:
+            stale_ok = self.read_from_replicas
+        batches = []
+        for name, (client, node_keys) in self._group_by_node(keys).items():
+            target = self._replicas.for_primary(name) if stale_ok and self._replicas is not None else None
+            for chunk in self._chunks(node_keys, batch_size):
+                batches.append((target[1], chunk, target[0], client) if target else (client, chunk, None, None))
+        return batches
+
+    def _read_batch(self, read, label, client, chunk, replica=None, primary=None) -> dict:
+        """
+        执行 read(client, chunk) -> dict，副本连接失败、超时或只读错误时回退主节点，
+        其他错误与主节点失败一样该批次按未命中处理
+        """
+        st = time.perf_counter()
         try:
-            if not redis_conf.use_cluster:
-                # 非集群配置直接 MGET
-                values = [self.safe_loads(v) for v in self._redis_client.mget(keys) if v]
-                result.extend(values)
-            else:
-                # Redis 集群，按 hash slot 分组
-                grouped_keys = defaultdict(list)
-                for key in keys:
-                    grouped_keys[self._redis_client.keyslot(key)].append(key)
-                for group in grouped_keys.values():
-                    values = [self.safe_loads(v) for v in self._redis_client.mget(group) if v]
-                    result.extend(values)
-        except redis.exceptions.RedisError as e:  # 明确捕获 Redis 异常
-            logger.error(f"Redis mget failed: {e}")
-        # 当缓存里是空值的情况下，把键列表删除，避免缓存误用
-        if not result:
-            for key in keys:
-                if self.exists_redis(key):
-                    self.delete(key)
-        return result
+            found = read(client, chunk)
+        except redis.exceptions.RedisError as e:
+            if replica is not None and isinstance(e, REPLICA_FAILURES):
+                self._replicas.mark_failed(replica, e)
+                return self._read_batch(read, label, primary, chunk)
+            logger.error(f"Redis {label} batch failed ({len(chunk)} keys): {e}")
+            return {}
+        if replica is not None:
+            self._replicas.observe(replica, time.perf_counter() - st)
+        return found
 
     @redis_exception_handler
-    def mset(self, mapping: Dict[str, Any], ex: Optional[int] = None, is_pipeline=True):
+    def mget(self, keys, aligned: bool = False, default: Any = CACHE_MISS, batch_size: int = 500,
+             stale_ok: Optional[bool] = None):
+        """
+        根据集群批量安全获取多个键并自动反序列化
+        :param keys: 键列表
+        :param aligned: 为 True 时返回与 keys 一一对应的列表，未命中位置为 default；
+                        为 False 时（默认，兼容旧行为）只返回命中的值
+        :param default: aligned 模式下未命中的占位值，默认 CACHE_MISS
+        :param batch_size: 单批次最大键数
+        :param stale_ok: 是否允许从副本读取，为空时取实例的 read_from_replicas
+        :return:
+        """
+        keys = list(keys or [])
+        if not self._redis_client or not keys:
+            return [default] * len(keys) if aligned else []
+        values = [default] * len(keys)
+        near, tokens, missing = self._near_cache, {}, []
+        for index, key in enumerate(keys):
+            if self._write_behind is not None:
+                pending = self._write_behind.peek(key)
+                if pending is not None:
+                    values[index] = self.safe_loads(pending)
+                    continue
+            if near is not None:
+                value = near.get(key)
+                if value is not NearCache.MISSING:
+                    values[index] = value
+                    continue
+                tokens[index] = near.reserve(key)
+            missing.append(index)
+        if missing:
+            raws = self._mget_raw([keys[i] for i in missing], batch_size=batch_size, stale_ok=stale_ok)
+            for index, raw in zip(missing, raws):
+                if not raw:
+                    continue
+                values[index] = self.safe_loads(raw)
+                if near is not None:
+                    near.put(keys[index], values[index], len(raw), tokens[index])
+        if aligned:
+            return values
+        return [value for value in values if value is not default]
+
+    @redis_exception_handler
+    def mset(self, mapping: Dict[str, Any], ex: Optional[int] = None, is_pipeline=True,
+             chunk_size: int = 1000) -> Dict[str, bool]:
         """批量安全存储数据
+        每个节点（非集群为单连接）按 chunk_size 切分为若干非事务管道，管道内使用 SET key value EX ttl，
+        一次往返完成写入与过期设置，集群多个节点并发执行
         :param mapping: 数据字典
         :param ex: 过期时间
-        :param is_pipeline: 默认执行管道
+        :param is_pipeline: 默认执行管道，为 False 时直接 MSET（不设置过期时间）
+        :param chunk_size: 单个管道最大命令数
+        :return: {key: 是否写入成功}
         """
-        processed = {k: self.safe_dumps(v) for k, v in mapping.items()}
+        self._near_invalidate(*mapping)
+        self._discard_pending(*mapping)
+        processed = {k: self.safe_dumps(v, k) for k, v in mapping.items()}
         if not is_pipeline:
             return True if self._redis_client.mset(processed) else False
 
-        with self._redis_client.pipeline() as pipe:
-            for key, value in processed.items():
-                pipe.set(key, value)
-            pipe.execute()
+        def write(client, keys):
+            try:
+                with client.pipeline(transaction=False) as pipe:
+                    for key in keys:
+                        pipe.set(key, processed[key], ex=ex)
+                    results = pipe.execute(raise_on_error=False)
+                return {key: res is True for key, res in zip(keys, results)}
+            except redis.exceptions.RedisError as e:
+                logger.error(f"Redis mset batch failed ({len(keys)} keys): {e}")
+                return dict.fromkeys(keys, False)
 
-        if ex is not None:
-            with self._redis_client.pipeline() as pipe:
-                for key in mapping:
-                    pipe.expire(key, ex)
-                pipe.execute()
-        return True
+        batches = [(client, chunk) for client, keys in self._group_by_node(processed).values()
+                   for chunk in self._chunks(keys, chunk_size)]
+        result = {}
+        for part in self._run_batches(write, batches):
+            result.update(part)
+        return result
 
     @redis_exception_handler
     def delete(self, key: str) -> None:
         """删除键"""
+        self._near_invalidate(key)
+        self._discard_pending(key)
         self._redis_client.delete(key)
 
-    @redis_exception_handler
-    def delete_pattern(self, pattern):
-        count, cursor = 0, 0
-        while True:
-            cursor, keys = self._redis_client.scan(cursor=cursor, match=pattern, count=100)
-            if keys:
-                count += self._redis_client.delete(*keys)
-            if cursor == 0:
-                break
-        return count
+    def _primary_clients(self) -> List[tuple]:
+        """返回 [(节点名, 节点 Redis 客户端)]，集群模式下为全部主节点"""
+        if not self.is_cluster:
+            return [('default', self._redis_client)]
+        return [(node.name, self._redis_client.get_redis_connection(node))
+                for node in self._redis_client.get_primaries()]
+
+    def _unlink_batch(self, client, keys) -> int:
+        """UNLINK 一批键，集群节点上按槽分组后在同一管道中下发，避免 CROSSSLOT"""
+        if not self.is_cluster:
+            return client.unlink(*keys)
+        slots = defaultdict(list)
+        for key in keys:
+            slots[key_slot(key if isinstance(key, bytes) else str(key).encode('utf8'))].append(key)
+        with client.pipeline(transaction=False) as pipe:
+            for slot_keys in slots.values():
+                pipe.unlink(*slot_keys)
+            return sum(pipe.execute())
+
+    def _delete_pattern_node(self, name, client, pattern, report, count, batch_size, limiter) -> None:
+        cursor, batch = 0, []
+        try:
+            while not report.cancelled:
+                cursor, keys = client.scan(cursor=cursor, match=pattern, count=count)
+                report.add(name, scanned=len(keys))
+                batch.extend(keys)
+                while len(batch) >= batch_size or (batch and cursor == 0):
+                    chunk, batch = batch[:batch_size], batch[batch_size:]
+                    if limiter is not None:
+                        limiter.acquire(len(chunk))
+                    report.add(name, deleted=self._unlink_batch(client, chunk), batches=1)
+                if cursor == 0:
+                    break
+        except Exception as e:
+            report.fail(name, e)
+            logger.warning(f"Redis delete_pattern {pattern} on {name} failed: {e}")
+        finally:
+            report.finish_node(name)
+
+    def delete_pattern_job(self, pattern, count: int = 1000, batch_size: int = 500,
+                           max_keys_per_second: Optional[float] = None,
+                           progress=None, report: Optional['DeletePatternReport'] = None) -> 'DeletePatternReport':
+        """
+        批量失效：所有主节点并行 SCAN，按批 UNLINK（后台释放内存），可限速
+        :param pattern: 匹配模式
+        :param count: SCAN COUNT，越大单次往返越多但单次命令耗时越长
+        :param batch_size: 单次 UNLINK 的键数
+        :param max_keys_per_second: 全局删除速率上限，为空不限速
+        :param progress: 回调 progress(report)，每批删除后调用
+        :param report: 预先创建的进度报告（后台执行时调用方先持有），为空时新建
+        :return: 执行完成的 DeletePatternReport
+        """
+        if self._near_cache is not None:
+            self._near_cache.invalidate_pattern(pattern)
+        if self._write_behind is not None:
+            self._write_behind.discard_pattern(pattern)
+        nodes = self._primary_clients()
+        if report is None:
+            report = DeletePatternReport(pattern, [name for name, _ in nodes], progress)
+        limiter = _KeyRateLimiter(max_keys_per_second) if max_keys_per_second else None
+        self._run_batches(self._delete_pattern_node,
+                          [(name, client, pattern, report, count, batch_size, limiter) for name, client in nodes])
+        return report
+
+    def delete_pattern(self, pattern, count: int = 1000, batch_size: int = 500,
+                       max_keys_per_second: Optional[float] = None, background: bool = False, progress=None):
+        """
+        删除匹配 pattern 的所有键，参数见 delete_pattern_job
+        :param background: 为 True 时在后台执行，立即返回 Future（结果为 DeletePatternReport），
+                           future.report 可查看进度或调用 cancel()
+        :return: 删除的键数量，任一节点失败时返回 None；background=True 时返回 Future
+        """
+        if not background:
+            try:
+                report = self.delete_pattern_job(pattern, count, batch_size, max_keys_per_second, progress)
+            except Exception as e:
+                logger.warning(f"Redis delete_pattern {pattern} failed: {e}")
+                return None
+            if report.errors:
+                logger.warning(f"Redis delete_pattern {pattern} failed on {report.errors}, "
+                               f"{report.deleted} keys deleted")
+                return None
+            return report.deleted
+
+        report = DeletePatternReport(pattern, [name for name, _ in self._primary_clients()], progress)
+        # 后台任务使用公共线程池，节点并发仍使用 node_executor，避免互相占满
+        future = async_manager.executor.submit(self.delete_pattern_job, pattern, count, batch_size,
+                                               max_keys_per_second, report=report)
+        future.report = report
+        return future
 
     def redis_incr(self, key, ex_time):
         """
         查询key的调用次数以及key的过期时间
+        INCR 与首次 EXPIRE 在同一脚本中原子执行，一次往返，且不会遗留无过期时间的计数键
         :param key:
         :param ex_time:
         :return:
         """
-        # 如果没有查到key,则默认返回1，否则，自增
-        res = self._redis_client.incr(key)
-        # 如果是第一次查询，则设置过期时间
-        if res == 1:
-            self._redis_client.expire(key, ex_time)
-        return res
+        return scripts.execute(self._redis_client, 'incr_expire', keys=[key], args=[ex_time])
+
+    def get_or_set(self, key: str, value: Any, ex: Optional[float] = None, refresh: bool = False) -> Any:
+        """
+        键存在时返回当前值，否则写入 value 并返回 value，一次往返
+        :param ex: 写入时的过期时间（秒）
+        :param refresh: 键存在时是否刷新过期时间为 ex
+        """
+        self._near_invalidate(key)
+        created, raw = scripts.execute(self._redis_client, 'get_or_set', keys=[key],
+                                       args=[self.safe_dumps(value, key), int((ex or 0) * 1000), int(refresh)])
+        return value if created else self.safe_loads(raw)
+
+    def compare_and_set(self, key: str, expected: Any, value: Any, ex: Optional[float] = None) -> bool:
+        """
+        当前值等于 expected 时写入 value，expected 为 CACHE_MISS 时要求键不存在
+        比较的是序列化后的字节，expected 需与写入时使用相同的编解码器且序列化结果稳定（如 json、简单 pickle 对象）
+        :param ex: 过期时间（秒），为空时保留原过期时间
+        :return: 是否写入
+        """
+        self._near_invalidate(key)
+        missing = expected is CACHE_MISS
+        args = [b'' if missing else self.safe_dumps(expected, key), self.safe_dumps(value, key),
+                int((ex or 0) * 1000), int(missing)]
+        return bool(scripts.execute(self._redis_client, 'compare_and_set', keys=[key], args=args))
+
+    def delete_if_equals(self, mapping: Dict[str, Any]) -> int:
+        """
+        批量条件删除：值等于 mapping 中对应期望值的键才删除
+        集群模式下按 slot 拆分为多次脚本调用，放入一个管道并发执行
+        :return: 删除数量
+        """
+        if not mapping:
+            return 0
+        self._near_invalidate(*mapping)
+        groups = defaultdict(list)
+        for key in mapping:
+            groups[self._redis_client.keyslot(key) if self.is_cluster else 0].append(key)
+        calls = [(keys, [self.safe_dumps(mapping[key], key) for key in keys]) for keys in groups.values()]
+        if len(calls) == 1:
+            return scripts.execute(self._redis_client, 'delete_if_equals', keys=calls[0][0], args=calls[0][1])
+        return sum(scripts.execute_many(self._redis_client, 'delete_if_equals', calls))
+
+    def bounded_incr(self, key: str, amount: int = 1, minimum: Optional[int] = None,
+                     maximum: Optional[int] = None, ex: Optional[float] = None) -> Optional[int]:
+        """
+        有界计数，增加 amount 后超出 [minimum, maximum] 时不生效，适用于库存、配额、并发槽位
+        :param ex: 计数键首次创建时的过期时间（秒）
+        :return: 生效后的值，越界时返回 None
+        """
+        args = [amount, '' if minimum is None else minimum, '' if maximum is None else maximum, int((ex or 0) * 1000)]
+        ok, value = scripts.execute(self._redis_client, 'bounded_incr', keys=[key], args=args)
+        return value if ok else None
 
     def keys(self, pattern):
         """
@@ -187,67 +728,254 @@ class RedisCache(FastApiRedis):
         res = self._redis_client.hset(name, mapping=mapping)
         return res
 
-    def hget(self, name, key):
+    def hget(self, name, key, stale_ok: Optional[bool] = None):
         """
         查询 hash 结构
         :return:
         """
-        res = self._redis_client.hget(name, key)
+        res = self._read(name, lambda client: client.hget(name, key), stale_ok)
         return res
 
-    def hmget(self, name, keys, *args):
+    def hmget(self, name, keys, *args, stale_ok: Optional[bool] = None):
         """
         查询 hash 结构
         :return:
         """
-        res = self._redis_client.hmget(name, keys, *args)
+        res = self._read(name, lambda client: client.hmget(name, keys, *args), stale_ok)
         return res
 
-    def hgetall(self, name):
+    def hgetall(self, name, stale_ok: Optional[bool] = None):
         """
         查询 hash 结构
         :return:
         """
-        res = self._redis_client.hgetall(name)
+        res = self._read(name, lambda client: client.hgetall(name), stale_ok)
         return res
 
-    def hexists(self, name, key):
-        res = self._redis_client.hexists(name, key)
+    def hexists(self, name, key, stale_ok: Optional[bool] = None):
+        res = self._read(name, lambda client: client.hexists(name, key), stale_ok)
         return res
 
     def hdel(self, name, *keys):
         res = self._redis_client.hdel(name, *keys)
         return res
 
+    @staticmethod
+    def _field(field):
+        return field.decode('utf8', errors='replace') if isinstance(field, bytes) else field
+
+    def _hash_value(self, raw, decode: bool):
+        if raw is None or not decode:
+            return raw
+        return self.safe_loads(raw)
+
+    @redis_exception_handler
+    def hgetall_many(self, names, decode: bool = True, batch_size: int = 500,
+                     stale_ok: Optional[bool] = None) -> Dict[str, dict]:
+        """
+        批量 HGETALL，按节点分组的管道并发执行
+        :param names: hash 键列表
+        :param decode: 字段值按编解码器反序列化（hset_many 写入的数据），为 False 时返回原始字节
+        :param batch_size: 单个管道最大命令数
+        :param stale_ok: 是否允许从副本读取
+        :return: {name: {field(str): value}}，顺序与 names 一致，不存在的 hash 为 {}
+        """
+        names = list(names or [])
+
+        def read(client, chunk):
+            with client.pipeline(transaction=False) as pipe:
+                for name in chunk:
+                    pipe.hgetall(name)
+                return dict(zip(chunk, pipe.execute()))
+
+        found = {}
+        for part in self._run_batches(partial(self._read_batch, read, 'hgetall_many'),
+                                      self._read_batches(names, batch_size, stale_ok)):
+            found.update(part)
+        return {name: {self._field(field): self._hash_value(raw, decode)
+                       for field, raw in (found.get(name) or {}).items()}
+                for name in names}
 
-class RedisQueue(RedisCache):
-    def __init__(self, name, namespace='queue'):
-        super().__init__()
+    @redis_exception_handler
+    def hmget_many(self, requests: Dict[str, List], decode: bool = True, batch_size: int = 500,
+                   stale_ok: Optional[bool] = None) -> Dict[str, dict]:
+        """
+        批量 HMGET
+        :param requests: {name: [field, ...]}
+        :return: {name: {field: value}}，与输入的键和字段一一对应，不存在的字段为 None
+        """
+        requests = {name: list(fields) for name, fields in (requests or {}).items()}
+
+        def read(client, chunk):
+            with client.pipeline(transaction=False) as pipe:
+                for name in chunk:
+                    pipe.hmget(name, requests[name])
+                return dict(zip(chunk, pipe.execute()))
+
+        found = {}
+        names = [name for name, fields in requests.items() if fields]
+        for part in self._run_batches(partial(self._read_batch, read, 'hmget_many'),
+                                      self._read_batches(names, batch_size, stale_ok)):
+            found.update(part)
+        result = {}
+        for name, fields in requests.items():
+            values = found.get(name) or [None] * len(fields)
+            result[name] = {field: self._hash_value(raw, decode) for field, raw in zip(fields, values)}
+        return result
+
+    @redis_exception_handler
+    def hset_many(self, mappings: Dict[str, Dict], ex: Optional[int] = None, encode: bool = True,
+                  batch_size: int = 500) -> Dict[str, bool]:
+        """
+        批量 HSET，字段值按键前缀对应的编解码器序列化，ex 不为空时同一管道内设置过期时间
+        :param mappings: {name: {field: value}}
+        :param ex: 过期时间（秒）
+        :param encode: 为 False 时字段值原样写入
+        :return: {name: 是否写入成功}
+        """
+        mappings = {name: mapping for name, mapping in (mappings or {}).items() if mapping}
+        self._near_invalidate(*mappings)
+
+        def write(client, chunk):
+            try:
+                with client.pipeline(transaction=False) as pipe:
+                    for name in chunk:
+                        mapping = mappings[name]
+                        if encode:
+                            mapping = {field: self.safe_dumps(value, name) for field, value in mapping.items()}
+                        pipe.hset(name, mapping=mapping)
+                        if ex is not None:
+                            pipe.expire(name, ex)
+                    results = pipe.execute(raise_on_error=False)
+                step = 1 if ex is None else 2
+                return {name: not any(isinstance(res, Exception) for res in results[i * step:(i + 1) * step])
+                        for i, name in enumerate(chunk)}
+            except redis.exceptions.RedisError as e:
+                logger.error(f"Redis hset_many batch failed ({len(chunk)} keys): {e}")
+                return dict.fromkeys(chunk, False)
+
+        batches = [(client, chunk) for client, names in self._group_by_node(mappings).values()
+                   for chunk in self._chunks(names, batch_size)]
+        result = {}
+        for part in self._run_batches(write, batches):
+            result.update(part)
+        return {name: result.get(name, False) for name in mappings}
+
+    def close(self) -> None:
+        """关闭连接，关闭前写出异步回写缓冲"""
+        self.disable_write_behind()
+        self.disable_near_cache()
+        super().close()
+
+
+# 从队列头部取出至多 ARGV[1] 个元素，每个元素分配唯一回执 id（KEYS[4] 自增）存入处理哈希并记录可见性截止时间，
+# 返回 {id1, item1, id2, item2, ...}
+QUEUE_RESERVE_SCRIPT = """
+local items = redis.call('LPOP', KEYS[1], ARGV[1])
+if not items then
+    return {}
+end
+local result = {}
+for _, item in ipairs(items) do
+    local id = redis.call('INCR', KEYS[4])
+    redis.call('HSET', KEYS[2], id, item)
+    redis.call('ZADD', KEYS[3], ARGV[2], id)
+    result[#result + 1] = id
+    result[#result + 1] = item
+end
+return result
+"""
+
+# 将可见性超时的元素从处理哈希移回队列尾部
+QUEUE_REQUEUE_SCRIPT = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[3], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+for _, id in ipairs(expired) do
+    redis.call('ZREM', KEYS[3], id)
+    local item = redis.call('HGET', KEYS[2], id)
+    if item then
+        redis.call('HDEL', KEYS[2], id)
+        redis.call('RPUSH', KEYS[1], item)
+    end
+end
+return #expired
+"""
+
+scripts.register('queue_reserve', QUEUE_RESERVE_SCRIPT)
+scripts.register('queue_requeue', QUEUE_REQUEUE_SCRIPT)
+
+
+class RedisQueue(object):
+    """
+    基于 Redis List 的队列，元素通过编解码器序列化
+
+    - put_many / get_many：管道批量 RPUSH、LPOP count，阻塞批量消费使用 BLMPOP（Redis 7+）
+    - 可靠模式：reserve / reserve_many 原子地取出元素、分配唯一回执 id 并记录可见性截止时间，
+      处理完成后按回执 ack；消费者崩溃时由 requeue_expired 把超时元素放回队列（至少一次语义），
+      内容相同的元素各自有独立的回执
+    队列键与旧版本一致（{namespace}:{name}），处理哈希、可见性集合与回执计数器以队列键为 hash tag，
+    集群模式下与队列位于同一 slot
+
+    数据格式：所有元素（包括 str / bytes）都经编解码器编码后写入，读取时统一解码；旧版本原样写入的
+    str / bytes 元素以及 pickle 写入的 dict / list 仍按 safe_loads 的兼容规则读取，但新写入的元素
+    不再是原始字节，直接读取该列表的其他程序需要按编解码器解码。
+    队列持有共享的 RedisCache 实例而不是继承它，连接在每次访问时从共享实例读取（init_app 重建连接后
+    队列随之使用新连接）；未定义的属性与方法（get / set 等）委托给共享实例，兼容旧版本继承 RedisCache 的用法。
+    """
+
+    def __init__(self, name, namespace='queue', redis_cache=None, codec=None, visibility_timeout: float = 30):
+        """
+        :param name: 队列名称
+        :param namespace: 键前缀
+        :param redis_cache: RedisCache 实例，默认 redis_client；队列复用其连接与编解码配置，不新建连接池
+        :param codec: 编解码器名称，默认按 redis_cache 的键前缀配置选择
+        :param visibility_timeout: 可靠模式下元素的处理超时（秒）
+        """
+        self._cache = redis_cache or redis_client
         self.key = f"{namespace}:{name}"
+        self.processing_key = f"{{{self.key}}}:processing"
+        self.inflight_key = f"{{{self.key}}}:inflight"
+        self.receipt_key = f"{{{self.key}}}:receipt"
+        self.codec = get_codec(codec) if codec else self._cache.codec_for(self.key)
+        self.visibility_timeout = visibility_timeout
+
+    @property
+    def _redis_client(self):
+        return self._cache._redis_client
+
+    def __getattr__(self, name):
+        if name == '_cache':
+            raise AttributeError(name)
+        return getattr(self._cache, name)
+
+    def _dumps(self, item) -> bytes:
+        return self.codec.encode(item)
+
+    def _loads(self, data):
+        return self._cache.safe_loads(data) if data is not None else None
+
+    def close(self) -> None:
+        """连接属于共享的 RedisCache 实例，队列不关闭连接"""
 
     def qsize(self):
         """
         返回队列里面list内元素的数量
         :return:
         """
-        return self.__redis_client.llen(self.key)
+        return self._redis_client.llen(self.key)
 
     def right_put(self, item, protocol=None):
         """
         添加新元素到队列最右方
-        :param protocol: 协议号
-        :param item: 待加密存储内容
+        :param protocol: 已废弃，序列化由编解码器决定
+        :param item: 待存储内容
         :return:
         """
         if isinstance(item, dict):
-            if "id" in item:
+            if "_id" in item:
                 item.pop("_id")
             if "organization" in item:
                 item.pop("organization")
-            item = pickle.dumps(item, protocol)
-        elif isinstance(item, list):
-            item = pickle.dumps(item, protocol)
-        self.__redis_client.rpush(self.key, item)
+        return self._redis_client.rpush(self.key, self._dumps(item))
 
     def left_put(self, item):
         """
@@ -255,21 +983,43 @@ class RedisQueue(RedisCache):
         :param item:
         :return:
         """
-        if isinstance(item, dict) or isinstance(item, list):
-            item = pickle.dumps(item)
-        self.__redis_client.lpush(self.key, item)
+        return self._redis_client.lpush(self.key, self._dumps(item))
+
+    def put_many(self, items, chunk_size: int = 1000) -> int:
+        """
+        批量添加到队列尾部，每 chunk_size 个元素合并为一条 RPUSH，全部放在一个管道中发送
+        :return: 队列最新长度
+        """
+        payloads = [self._dumps(item) for item in items]
+        if not payloads:
+            return self.qsize()
+        with self._redis_client.pipeline(transaction=False) as pipe:
+            for index in range(0, len(payloads), chunk_size):
+                pipe.rpush(self.key, *payloads[index:index + chunk_size])
+            return pipe.execute()[-1]
 
     def get_wait(self, timeout=None):
         # 返回队列第一个元素，如果为空则等待至有元素被加入队列（超时时间阈值为timeout，如果为None则一直等待）
-        item = self.__redis_client.blpop(self.key, timeout=timeout)
-        # if item:
-        #     item = item[1]  # 返回值为一个tuple
-        return item
+        item = self._redis_client.blpop(self.key, timeout=timeout or 0)
+        return self._loads(item[1]) if item else None
 
     def get_nowait(self):
         # 直接返回队列第一个元素，如果队列为空返回的是None
-        item = self.__redis_client.lpop(self.key)
-        return item
+        return self._loads(self._redis_client.lpop(self.key))
+
+    def get_many(self, count: int, timeout: Optional[float] = None) -> list:
+        """
+        批量取出至多 count 个元素
+        :param count: 最大数量
+        :param timeout: 为空时不等待（LPOP count）；否则队列为空时最多阻塞 timeout 秒（BLMPOP，0 表示一直等待）
+        :return:
+        """
+        if timeout is None:
+            items = self._redis_client.lpop(self.key, count) or []
+        else:
+            result = self._redis_client.blmpop(timeout, 1, self.key, direction='LEFT', count=count)
+            items = result[1] if result else []
+        return [self._loads(item) for item in items]
 
     def get_range_list(self, list_range):
         """
@@ -277,47 +1027,462 @@ class RedisQueue(RedisCache):
         :param list_range: 限制长度
         :return:
         """
-        return self.__redis_client.lrange(self.key, 0, list_range)
+        return [self._loads(item) for item in self._redis_client.lrange(self.key, 0, list_range)]
 
     def get_last(self):
         """
         返回队列最后一个元素，如果队列为空返回的是None
         :return:
         """
-        return self.__redis_client.rpop(self.key)
+        return self._loads(self._redis_client.rpop(self.key))
 
     def delete_large_data(self, start, end):
         """
         删除一定尺寸的数据
         :return:
         """
-        return self.__redis_client.ltrim(self.key, start, end)
+        return self._redis_client.ltrim(self.key, start, end)
+
+    # ------------ 可靠模式 ------------
+
+    def reserve(self, timeout: Optional[float] = None):
+        """
+        取出一个元素进入处理状态
+        :param timeout: 为空时不等待，否则队列为空时最多阻塞 timeout 秒
+        :return: (receipt, item)，ack 时传入 receipt；无元素返回 None
+        """
+        if timeout is None:
+            reserved = self.reserve_many(1)
+            return reserved[0] if reserved else None
+        deadline = time.monotonic() + timeout
+        while True:
+            reserved = self.reserve_many(1)
+            if reserved:
+                return reserved[0]
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            # BLMOVE key key RIGHT RIGHT 只用于等待队列非空，不取出元素；取出与登记始终在脚本中原子完成，
+            # 消费者在任何时刻崩溃都不会留下没有可见性记录的元素
+            if self._redis_client.blmove(self.key, self.key, max(remaining, 0.01), 'RIGHT', 'RIGHT') is None:
+                return None
+
+    def reserve_many(self, count: int) -> list:
+        """
+        原子地取出至多 count 个元素进入处理状态
+        :return: [(receipt, item), ...]
+        """
+        result = scripts.execute(self._redis_client, 'queue_reserve',
+                                 keys=[self.key, self.processing_key, self.inflight_key, self.receipt_key],
+                                 args=[count, time.time() + self.visibility_timeout]) or []
+        return [(int(result[index]), self._loads(result[index + 1])) for index in range(0, len(result), 2)]
+
+    def ack(self, *receipts) -> int:
+        """确认处理完成，移除处理记录，返回确认的数量"""
+        if not receipts:
+            return 0
+        with self._redis_client.pipeline(transaction=False) as pipe:
+            pipe.hdel(self.processing_key, *receipts)
+            pipe.zrem(self.inflight_key, *receipts)
+            return pipe.execute()[0]
+
+    def nack(self, *receipts) -> int:
+        """处理失败，立即放回队列尾部"""
+        if not receipts:
+            return 0
+        # XX：已确认或已被回收的回执不再登记
+        self._redis_client.zadd(self.inflight_key, dict.fromkeys(receipts, 0), xx=True)
+        return self.requeue_expired(limit=len(receipts))
+
+    def requeue_expired(self, limit: int = 1000) -> int:
+        """将超过可见性超时仍未确认的元素放回队列，返回处理数量"""
+        return scripts.execute(self._redis_client, 'queue_requeue',
+                               keys=[self.key, self.processing_key, self.inflight_key], args=[time.time(), limit])
+
+    def processing_size(self) -> int:
+        return self._redis_client.hlen(self.processing_key)
+
+
+class RedisStreamQueue(object):
+    """
+    基于 Redis Streams 的工作队列，支持消费组、重放、积压回收
+
+    - add / add_many：XADD（MAXLEN ~ 裁剪），批量写入走管道
+    - read：XREADGROUP 批量读取
+    - ack：XACK 确认，未确认的消息保留在 PEL 中
+    - claim_stale：XAUTOCLAIM 回收崩溃消费者长时间未确认的消息
+    - consume / consume_async：批量读取后在线程池 / asyncio 中并发处理，成功的消息批量确认；
+      处理完当前批次才读取下一批，天然形成背压
+
+    >>> queue = RedisStreamQueue('device_event', group='event_worker')
+    >>> queue.add_many([{'device_id': 1}, {'device_id': 2}])
+    >>> queue.consume(lambda item: print(item), batch_size=100, concurrency=8)
+    """
+
+    FIELD = b'd'
+
+    def __init__(self, name, group, consumer=None, namespace='stream', redis_cache=None, codec=None,
+                 maxlen: Optional[int] = 100000, claim_idle_ms: int = 60000):
+        """
+        :param name: 流名称
+        :param group: 消费组名称
+        :param consumer: 消费者名称，默认 主机名-进程号
+        :param namespace: 键前缀
+        :param redis_cache: RedisCache 实例，默认 redis_client
+        :param codec: 编解码器名称，默认按 redis_cache 的键前缀配置选择
+        :param maxlen: 近似最大长度，为空不裁剪
+        :param claim_idle_ms: 消息空闲超过该毫秒数后可被其他消费者回收
+        """
+        self._cache = redis_cache or redis_client
+        self._redis_client = self._cache._redis_client
+        self.key = f"{namespace}:{name}"
+        self.group = group
+        self.consumer = consumer or f"{socket.gethostname()}-{os.getpid()}"
+        self.codec = get_codec(codec) if codec else self._cache.codec_for(self.key)
+        self.maxlen = maxlen
+        self.claim_idle_ms = claim_idle_ms
+        self._claim_cursor = '0-0'
+        self._group_ready = False
+
+    def ensure_group(self, start_id: str = '0') -> None:
+        """创建消费组（流不存在时一并创建），已存在时忽略"""
+        if self._group_ready:
+            return
+        try:
+            self._redis_client.xgroup_create(self.key, self.group, id=start_id, mkstream=True)
+        except redis.exceptions.ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+        self._group_ready = True
+
+    def _entries(self, entries) -> list:
+        result = []
+        for entry_id, fields in entries or []:
+            # 已被 XDEL/裁剪的消息 fields 为空
+            payload = fields.get(self.FIELD) if fields else None
+            result.append((entry_id, self._cache.safe_loads(payload) if payload is not None else None))
+        return result
+
+    def add(self, item) -> bytes:
+        return self._redis_client.xadd(self.key, {self.FIELD: self.codec.encode(item)},
+                                       maxlen=self.maxlen, approximate=True)
+
+    def add_many(self, items, chunk_size: int = 1000) -> list:
+        """批量写入，返回消息ID列表"""
+        ids = []
+        items = list(items)
+        for index in range(0, len(items), chunk_size):
+            with self._redis_client.pipeline(transaction=False) as pipe:
+                for item in items[index:index + chunk_size]:
+                    pipe.xadd(self.key, {self.FIELD: self.codec.encode(item)}, maxlen=self.maxlen, approximate=True)
+                ids.extend(pipe.execute())
+        return ids
+
+    def read(self, count: int = 100, block_ms: Optional[int] = None) -> list:
+        """
+        读取本消费者尚未投递的新消息
+        :param count: 最大条数
+        :param block_ms: 无消息时阻塞毫秒数，为空不阻塞
+        :return: [(message_id, item), ...]
+        """
+        self.ensure_group()
+        response = self._redis_client.xreadgroup(self.group, self.consumer, {self.key: '>'},
+                                                 count=count, block=block_ms)
+        return self._entries(response[0][1]) if response else []
+
+    def ack(self, *ids) -> int:
+        return self._redis_client.xack(self.key, self.group, *ids) if ids else 0
+
+    def claim_stale(self, count: int = 100, min_idle_ms: Optional[int] = None) -> list:
+        """
+        回收空闲超时的待确认消息（XAUTOCLAIM），游标在多次调用间推进，一轮结束后从头开始
+        :return: [(message_id, item), ...]
+        """
+        self.ensure_group()
+        response = self._redis_client.xautoclaim(self.key, self.group, self.consumer,
+                                                 min_idle_ms or self.claim_idle_ms,
+                                                 start_id=self._claim_cursor, count=count)
+        self._claim_cursor = response[0] or '0-0'
+        deleted = response[2] if len(response) > 2 else []
+        if deleted:
+            # 已删除的消息无法处理，直接确认避免滞留在 PEL
+            self.ack(*deleted)
+        return [(entry_id, item) for entry_id, item in self._entries(response[1]) if item is not None]
+
+    def pending(self) -> dict:
+        """消费组待确认消息概要"""
+        return self._redis_client.xpending(self.key, self.group)
+
+    def size(self) -> int:
+        return self._redis_client.xlen(self.key)
+
+    def trim(self, maxlen: int, approximate: bool = True) -> int:
+        return self._redis_client.xtrim(self.key, maxlen=maxlen, approximate=approximate)
+
+    def _next_batch(self, batch_size, block_ms, claim_interval, state):
+        """优先回收积压消息，其次读取新消息"""
+        if time.monotonic() - state['last_claim'] >= claim_interval:
+            state['last_claim'] = time.monotonic()
+            claimed = self.claim_stale(count=batch_size)
+            if claimed:
+                return claimed
+        return self.read(count=batch_size, block_ms=block_ms)
+
+    def consume(self, handler, batch_size: int = 100, concurrency: int = 4, block_ms: int = 2000,
+                claim_interval: float = 30, stop_event: Optional[threading.Event] = None) -> None:
+        """
+        阻塞消费循环，handler(item) 在线程池中并发执行，正常返回的消息被确认，抛异常的保留待回收
+        :param handler: 处理函数
+        :param batch_size: 每批读取条数
+        :param concurrency: 并发处理线程数
+        :param block_ms: 无消息时阻塞毫秒数
+        :param claim_interval: 回收积压消息的间隔（秒）
+        :param stop_event: 设置后退出循环
+        """
+        stop_event = stop_event or threading.Event()
+        state = {'last_claim': 0.0}
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            while not stop_event.is_set():
+                try:
+                    batch = self._next_batch(batch_size, block_ms, claim_interval, state)
+                except redis.exceptions.RedisError as e:
+                    logger.error(f"Redis stream {self.key} read failed: {e}")
+                    stop_event.wait(1)
+                    continue
+                if not batch:
+                    continue
+                futures = {executor.submit(handler, item): entry_id for entry_id, item in batch}
+                done = []
+                for future, entry_id in futures.items():
+                    try:
+                        future.result()
+                        done.append(entry_id)
+                    except Exception as e:
+                        logger.warning(f"Redis stream {self.key} message {entry_id} failed: {e}")
+                self.ack(*done)
+
+    async def consume_async(self, handler, batch_size: int = 100, concurrency: int = 4, block_ms: int = 2000,
+                            claim_interval: float = 30, stop_event: Optional[asyncio.Event] = None) -> None:
+        """
+        asyncio 消费循环，handler 为协程函数，同一批次内最多 concurrency 个并发；
+        Redis 读写在默认线程池中执行，不阻塞事件循环
+        """
+        stop_event = stop_event or asyncio.Event()
+        state = {'last_claim': 0.0}
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def run(entry_id, item):
+            async with semaphore:
+                try:
+                    await handler(item)
+                    return entry_id
+                except Exception as e:
+                    logger.warning(f"Redis stream {self.key} message {entry_id} failed: {e}")
+                    return None
+
+        while not stop_event.is_set():
+            try:
+                batch = await asyncio.to_thread(self._next_batch, batch_size, block_ms, claim_interval, state)
+            except redis.exceptions.RedisError as e:
+                logger.error(f"Redis stream {self.key} read failed: {e}")
+                await asyncio.sleep(1)
+                continue
+            if not batch:
+                continue
+            done = await asyncio.gather(*(run(entry_id, item) for entry_id, item in batch))
+            await asyncio.to_thread(self.ack, *[entry_id for entry_id in done if entry_id is not None])
 
 
-class RedisLock(RedisCache):
+# 加锁成功返回 {1, 栅栏令牌}，失败返回 {0, 锁剩余毫秒}
+LOCK_ACQUIRE_SCRIPT = """
+if redis.call('SET', KEYS[1], ARGV[1], 'NX', 'PX', ARGV[2]) then
+    return {1, redis.call('INCR', KEYS[2])}
+end
+return {0, redis.call('PTTL', KEYS[1])}
+"""
+
+# 仅持有者可释放，释放后向通知列表推送一个元素唤醒一个等待者
+LOCK_RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    redis.call('DEL', KEYS[1], KEYS[2])
+    redis.call('RPUSH', KEYS[2], 1)
+    redis.call('PEXPIRE', KEYS[2], ARGV[2])
+    return 1
+end
+return 0
+"""
+
+LOCK_RENEW_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+scripts.register('lock_acquire', LOCK_ACQUIRE_SCRIPT)
+scripts.register('lock_release', LOCK_RELEASE_SCRIPT)
+scripts.register('lock_renew', LOCK_RENEW_SCRIPT)
+
+
+class LockMetrics(object):
+    """分布式锁获取耗时统计，同步/异步锁共用"""
+
+    BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.acquired = 0
+        self.timeouts = 0
+        self.renewals = 0
+        self.lost = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.buckets = [0] * (len(self.BUCKETS) + 1)
+
+    def observe(self, elapsed: float, acquired: bool) -> None:
+        with self._lock:
+            if not acquired:
+                self.timeouts += 1
+                return
+            self.acquired += 1
+            self.wait_seconds += elapsed
+            self.max_wait_seconds = max(self.max_wait_seconds, elapsed)
+            self.buckets[bisect.bisect_left(self.BUCKETS, elapsed)] += 1
+
+    def incr(self, field: str) -> None:
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            labels = [f"le_{b}" for b in self.BUCKETS] + ['le_inf']
+            return {
+                'acquired': self.acquired,
+                'timeouts': self.timeouts,
+                'renewals': self.renewals,
+                'lost': self.lost,
+                'avg_wait_ms': round(self.wait_seconds * 1000 / self.acquired, 3) if self.acquired else 0.0,
+                'max_wait_ms': round(self.max_wait_seconds * 1000, 3),
+                'wait_histogram': dict(zip(labels, self.buckets)),
+            }
+
+
+lock_metrics = LockMetrics()
+
+
+class RedisLock(object):
     """
-    Redis锁的应用
+    Redis分布式锁
+
+    - 加锁 SET NX PX，同时 INCR 生成单调递增的栅栏令牌（fencing_token），下游写入时可据此拒绝过期持有者
+    - 释放通过 Lua 比较令牌后删除，不会误删他人的锁
+    - 等待者 BLPOP 通知列表，持有者释放时立即唤醒，锁过期（持有者崩溃）时按剩余 TTL 兜底重试
+    - renew=True 时后台线程按 timeout/3 续期，适合耗时不确定的临界区
+    键使用 hash tag（lock:{key}），集群模式下锁、令牌计数、通知列表位于同一 slot
+
+    >>> with RedisLock(redis_client, "my_resource", timeout=10) as lock:
+    ...     write(data, fencing_token=lock.fencing_token)
     """
 
-    def __init__(self, redis_cache: Redis = None, key: str = None, timeout: int = 10):
-        super().__init__()
-        if redis_cache:
-            self._redis_client = redis_cache
-        self.key = f"lock:{key}"
+    max_block = 1.0
+
+    def __init__(self, redis_cache=None, key: str = None, timeout: int = 10,
+                 blocking_timeout: Optional[float] = None, renew: bool = False):
+        """
+        :param redis_cache: RedisCache 或 Redis 客户端，默认 redis_client
+        :param key: 锁名称
+        :param timeout: 锁租约时长（秒）
+        :param blocking_timeout: 最长等待时间（秒），默认等于 timeout，0 表示不等待
+        :param renew: 是否启用后台续期
+        """
+        redis_cache = redis_cache or redis_client
+        self._redis_client = getattr(redis_cache, '_redis_client', redis_cache)
+        self.name = key
+        self.key = f"lock:{{{key}}}"
+        self.fence_key = f"{self.key}:fence"
+        self.notify_key = f"{self.key}:notify"
         self.timeout = timeout
+        self.blocking_timeout = timeout if blocking_timeout is None else blocking_timeout
+        self.renew_enabled = renew
         self.token = None
+        self.fencing_token = None
+        self._stop_renew = threading.Event()
+        self._renew_thread = None
 
-    def __enter__(self) -> bool:
-        self.token = str(time.time())
-        for _ in range(self.timeout * 2):
-            if self.redis.set(self.key, self.token, nx=True, ex=self.timeout):
+    @property
+    def _lease_ms(self) -> int:
+        return int(self.timeout * 1000)
+
+    def acquire(self, blocking: bool = True) -> bool:
+        token = uuid.uuid4().hex
+        st = time.monotonic()
+        deadline = st + (self.blocking_timeout if blocking else 0)
+        while True:
+            ok, value = scripts.execute(self._redis_client, 'lock_acquire',
+                                        keys=[self.key, self.fence_key], args=[token, self._lease_ms])
+            if ok:
+                self.token, self.fencing_token = token, int(value)
+                lock_metrics.observe(time.monotonic() - st, True)
+                if self.renew_enabled:
+                    self._start_renew()
                 return True
-            time.sleep(0.5)
-        raise TimeoutError(f"Acquire lock timeout for {self.key}")
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                lock_metrics.observe(time.monotonic() - st, False)
+                return False
+            # 等待释放通知；锁剩余 TTL 更短时按 TTL 醒来重试
+            wait = min(remaining, self.max_block, value / 1000 if value and value > 0 else self.max_block)
+            self._redis_client.blpop([self.notify_key], timeout=max(wait, 0.01))
+
+    def release(self) -> bool:
+        self._stop_renewal()
+        if not self.token:
+            return False
+        released = scripts.execute(self._redis_client, 'lock_release',
+                                   keys=[self.key, self.notify_key], args=[self.token, self._lease_ms])
+        self.token = None
+        return bool(released)
+
+    def renew(self) -> bool:
+        """手动续期，锁已不属于自己时返回 False"""
+        if not self.token:
+            return False
+        renewed = bool(scripts.execute(self._redis_client, 'lock_renew',
+                                       keys=[self.key], args=[self.token, self._lease_ms]))
+        lock_metrics.incr('renewals' if renewed else 'lost')
+        return renewed
+
+    def locked(self) -> bool:
+        return bool(self._redis_client.exists(self.key))
+
+    def _start_renew(self):
+        self._stop_renew.clear()
+        self._renew_thread = threading.Thread(target=self._renew_loop, name=f'redis-lock-renew-{self.name}',
+                                              daemon=True)
+        self._renew_thread.start()
+
+    def _renew_loop(self):
+        while not self._stop_renew.wait(max(self.timeout / 3, 0.1)):
+            try:
+                if not self.renew():
+                    logger.warning(f"Redis lock {self.key} lost before release")
+                    return
+            except redis.exceptions.RedisError as e:
+                logger.warning(f"Redis lock {self.key} renew failed: {e}")
+
+    def _stop_renewal(self):
+        self._stop_renew.set()
+        if self._renew_thread is not None and self._renew_thread is not threading.current_thread():
+            self._renew_thread.join()
+        self._renew_thread = None
+
+    def __enter__(self) -> "RedisLock":
+        if not self.acquire():
+            raise TimeoutError(f"Acquire lock timeout for {self.key}")
+        return self
 
     def __exit__(self, exc_type, exc_val, exc_tb) -> None:
-        if self.token and self.redis.get(self.key) == self.token.encode():
-            self.redis.delete(self.key)
+        self.release()
 
 
 def redis_lock(key: str, timeout: int = 10):
@@ -334,7 +1499,7 @@ def redis_lock(key: str, timeout: int = 10):
     return decorator
 
 
-redis_client = RedisCache()
+redis_client = RedisCache(near_cache=redis_conf.near_cache, write_behind=redis_conf.write_behind)
 
 if __name__ == '__main__':
     # 使用示例
@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+# -*- coding: utf8 -*-
+"""
+RedisCache.set 的异步回写（write-behind）缓冲
+
+高频写入（如遥测数据逐点写入）不再每次同步等待一次 RTT：set(..., deferred=True) 只把序列化后的值放入内存，
+同一个键多次写入只保留最后一次（last-write-wins），后台线程或 asyncio 任务按数量或时间间隔批量刷写，
+每个节点一个非事务管道（SET key value EX ttl）。
+
+    - 内存有界：待写入键数达到 max_pending 时按 overflow 策略背压（阻塞等待 / 同步直写 / 丢弃）
+    - 读己之写：RedisCache.get / mget / exists 优先使用尚未刷写的值
+    - 直接写入或删除（set / mset / delete / delete_pattern / invalidate_tags）时丢弃该键的缓冲值；
+      键正在刷写时等待本次刷写结束，之后的直接写入或删除总是覆盖刷写结果，失败重试也不会把它放回缓冲
+    - 关闭时刷写：close / aclose 以及进程退出（atexit）时写出全部缓冲
+    - 刷写失败的键在没有更新值的情况下放回缓冲，随下一批重试
+
+>>> redis_client.enable_write_behind(batch_size=500, flush_interval=0.05)
+>>> redis_client.set('telemetry:device:1', point, ex=300, deferred=True)
+"""
+import asyncio
+import atexit
+import fnmatch
+import logging
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import redis
+
+from modules.fastapi_redis.pool import Histogram
+
+logger = logging.getLogger(__name__)
+
+OVERFLOW_POLICIES = ('block', 'sync', 'drop')
+
+
+class WriteBehindBuffer(object):
+    """合并写入并批量刷写的缓冲区，cache 为 RedisCache 实例"""
+
+    def __init__(self, cache, max_pending: int = 100000, batch_size: int = 1000, flush_interval: float = 0.1,
+                 overflow: str = 'block', block_timeout: Optional[float] = 1.0, mode: str = 'thread'):
+        """
+        :param cache: RedisCache 实例，刷写时复用其按节点分组与并发下发
+        :param max_pending: 缓冲中最多的待写入键数
+        :param batch_size: 待写入键数达到该值时立即触发刷写，也是单个管道的最大命令数
+        :param flush_interval: 最长刷写间隔（秒）
+        :param overflow: 缓冲已满时的策略：block 阻塞等待刷写腾出空间（超过 block_timeout 后同步直写），
+                         sync 直接同步写入，drop 丢弃本次写入并计数
+        :param block_timeout: block 策略的最长等待秒数，为空时一直等待
+        :param mode: thread 后台线程刷写；asyncio 在当前事件循环中运行刷写任务（管道写入放到线程池执行），
+                     需在事件循环内调用 start；在事件循环线程中不阻塞等待：block 策略直接同步写入，
+                     close 把刷写提交到线程池
+        """
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow}, available: {OVERFLOW_POLICIES}")
+        if mode not in ('thread', 'asyncio'):
+            raise ValueError(f"Unknown write-behind mode: {mode}, available: ('thread', 'asyncio')")
+        self.cache = cache
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self.mode = mode
+        # {key: (序列化数据, 过期秒数)}，dict 保持插入顺序，先写入的键先刷写
+        self._pending: Dict[str, Tuple[bytes, Optional[int]]] = {}
+        self._inflight: Dict[str, Tuple[bytes, Optional[int]]] = {}
+        # 刷写期间被丢弃的键，刷写跳过这些键且失败时不放回缓冲
+        self._discarded = set()
+        self._lock = threading.Lock()
+        self._not_full = threading.Condition(self._lock)
+        self._wakeup = threading.Event()
+        self._flush_lock = threading.Lock()
+        self._closed = False
+        self._thread = None
+        self._task = None
+        self._loop = None
+        self._async_wakeup = None
+        self.latency = Histogram()
+        self.stats = {
+            'enqueued': 0,
+            'coalesced': 0,
+            'flushed': 0,
+            'batches': 0,
+            'errors': 0,
+            'requeued': 0,
+            'blocked': 0,
+            'blocked_seconds': 0.0,
+            'sync_writes': 0,
+            'dropped': 0,
+            'discarded': 0,
+            'max_depth': 0,
+        }
+
+    # ---- 写入 ----
+
+    def put(self, key: str, data: bytes, ex: Optional[int] = None) -> bool:
+        """
+        放入缓冲，已有同名键时覆盖（不占用新的容量）
+        :return: True 已缓冲或已同步写入，False 被丢弃
+        """
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('write-behind buffer is closed')
+            if key in self._pending:
+                self._pending[key] = (data, ex)
+                self.stats['coalesced'] += 1
+                return True
+            if len(self._pending) >= self.max_pending and not self._wait_for_space():
+                if self.overflow == 'drop':
+                    self.stats['dropped'] += 1
+                    return False
+                self.stats['sync_writes'] += 1
+                sync = True
+            else:
+                self._pending[key] = (data, ex)
+                self.stats['enqueued'] += 1
+                depth = len(self._pending)
+                if depth > self.stats['max_depth']:
+                    self.stats['max_depth'] = depth
+                sync = False
+        if sync:
+            # 该键的旧值可能正在刷写
+            self.discard(key)
+            self.cache._redis_client.set(key, data, ex=ex)
+            return True
+        if depth >= self.batch_size:
+            self._notify()
+        return True
+
+    def _wait_for_space(self) -> bool:
+        """持有锁时调用，block 策略下等待刷写腾出空间，返回是否有空间"""
+        if self.overflow != 'block' or self._on_loop():
+            return False
+        self.stats['blocked'] += 1
+        self._notify()
+        st = time.monotonic()
+        ok = self._not_full.wait_for(lambda: len(self._pending) < self.max_pending or self._closed,
+                                     timeout=self.block_timeout)
+        self.stats['blocked_seconds'] += time.monotonic() - st
+        return ok and not self._closed
+
+    def peek(self, key: str) -> Optional[bytes]:
+        """尚未写入 Redis 的数据（缓冲中或正在刷写），没有时返回 None"""
+        # 持锁读取：flush 在同一把锁内把缓冲整体移入 _inflight，不会出现两处都查不到的间隙
+        with self._lock:
+            item = self._pending.get(key) or self._inflight.get(key)
+        return item[0] if item is not None else None
+
+    def discard(self, *keys) -> None:
+        """
+        丢弃键的待写入数据（直接写入或删除前调用，避免之后刷写把旧值或已删除的键写回）
+        键正在刷写时阻塞到本次刷写结束，返回后调用方的写入或删除一定晚于刷写
+        """
+        with self._lock:
+            inflight = False
+            for key in keys:
+                if self._pending.pop(key, None) is not None:
+                    self.stats['discarded'] += 1
+                if self._inflight.pop(key, None) is not None:
+                    self._discarded.add(key)
+                    inflight = True
+            self._not_full.notify_all()
+        if inflight:
+            with self._flush_lock:
+                pass
+
+    def discard_pattern(self, pattern: str) -> None:
+        """丢弃匹配 Redis glob 模式的全部待写入键"""
+        with self._lock:
+            keys = [key for key in (*self._pending, *self._inflight) if fnmatch.fnmatchcase(key, pattern)]
+        if keys:
+            self.discard(*keys)
+
+    def _on_loop(self) -> bool:
+        """是否在 asyncio 模式的事件循环线程中调用"""
+        if self._loop is None:
+            return False
+        try:
+            return asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            return False
+
+    def _notify(self) -> None:
+        if self._loop is not None:
+            if not self._loop.is_closed():
+                self._loop.call_soon_threadsafe(self._async_wakeup.set)
+        else:
+            self._wakeup.set()
+
+    # ---- 刷写 ----
+
+    def _write(self, client, keys: List[str], items: dict) -> List[str]:
+        """管道写入一批键（跳过已丢弃的键），返回失败的键"""
+        with self._lock:
+            keys = [key for key in keys if key not in self._discarded]
+        if not keys:
+            return []
+        try:
+            with client.pipeline(transaction=False) as pipe:
+                for key in keys:
+                    data, ex = items[key]
+                    pipe.set(key, data, ex=ex)
+                results = pipe.execute(raise_on_error=False)
+            return [key for key, res in zip(keys, results) if res is not True]
+        except redis.exceptions.RedisError as e:
+            logger.error(f"Redis write-behind batch failed ({len(keys)} keys): {e}")
+            return list(keys)
+
+    def flush(self) -> int:
+        """取出当前全部缓冲并写入 Redis，返回成功写入的键数"""
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return 0
+                items, self._pending = self._pending, {}
+                self._inflight = dict(items)
+                self._not_full.notify_all()
+            st = time.perf_counter()
+            failed = []
+            try:
+                batches = [(client, chunk) for client, keys in self.cache._group_by_node(list(items)).values()
+                           for chunk in self.cache._chunks(keys, self.batch_size)]
+                for part in self.cache._run_batches(lambda client, keys: self._write(client, keys, items), batches):
+                    failed.extend(part)
+            except Exception as e:
+                logger.error(f"Redis write-behind flush failed ({len(items)} keys): {e}")
+                failed = list(items)
+            elapsed = time.perf_counter() - st
+            with self._lock:
+                discarded, self._discarded = self._discarded, set()
+                self._inflight = {}
+                skipped = discarded.union(failed)
+                written = sum(1 for key in items if key not in skipped)
+                self.latency.observe(elapsed)
+                self.stats['batches'] += 1
+                self.stats['flushed'] += written
+                self.stats['discarded'] += len(discarded)
+                if failed:
+                    self.stats['errors'] += 1
+                    # 失败的键在没有被丢弃、没有更新值且仍有空间时放回缓冲
+                    for key in failed:
+                        if key not in discarded and key not in self._pending \
+                                and len(self._pending) < self.max_pending:
+                            self._pending[key] = items[key]
+                            self.stats['requeued'] += 1
+            return written
+
+    def _run(self) -> None:
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Redis write-behind flush error: {e}")
+
+    async def _run_async(self) -> None:
+        loop = asyncio.get_running_loop()
+        while not self._closed:
+            try:
+                await asyncio.wait_for(self._async_wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._async_wakeup.clear()
+            try:
+                await loop.run_in_executor(None, self.flush)
+            except Exception as e:
+                logger.error(f"Redis write-behind flush error: {e}")
+
+    def start(self) -> 'WriteBehindBuffer':
+        """启动后台刷写，并在进程退出时刷写剩余数据"""
+        if self.mode == 'asyncio':
+            self._loop = asyncio.get_running_loop()
+            self._async_wakeup = asyncio.Event()
+            self._task = self._loop.create_task(self._run_async())
+        else:
+            self._thread = threading.Thread(target=self._run, name='redis-write-behind', daemon=True)
+            self._thread.start()
+        atexit.register(self.close)
+        return self
+
+    def close(self, timeout: float = 5) -> Optional[asyncio.Future]:
+        """
+        停止后台刷写并写出全部缓冲，重复调用忽略
+        asyncio 模式下在事件循环线程中调用时不阻塞，刷写提交到线程池，返回可 await 的 Future
+        """
+        if self._on_loop():
+            return self._loop.run_in_executor(None, self.close, timeout)
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._not_full.notify_all()
+        atexit.unregister(self.close)
+        if self._thread is not None:
+            self._wakeup.set()
+            self._thread.join(timeout)
+        elif self._task is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._task.cancel)
+        # 失败的键会放回缓冲，最多再重试一次，避免 Redis 不可用时关闭流程卡住
+        for _ in range(2):
+            if not self._pending:
+                break
+            self.flush()
+        if self._pending:
+            logger.error(f"Redis write-behind closed with {len(self._pending)} unwritten keys")
+
+    async def aclose(self, timeout: float = 5) -> None:
+        """asyncio 模式下的关闭，刷写在线程池中执行"""
+        await asyncio.get_running_loop().run_in_executor(None, self.close, timeout)
+
+    def metrics(self) -> dict:
+        """队列深度、合并/刷写/失败计数、背压次数与刷写耗时直方图"""
+        with self._lock:
+            return {
+                'depth': len(self._pending),
+                'inflight': len(self._inflight),
+                'max_pending': self.max_pending,
+                **self.stats,
+                'blocked_seconds': round(self.stats['blocked_seconds'], 3),
+                'flush_latency': self.latency.as_dict(),
+            }
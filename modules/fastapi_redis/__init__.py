@@ -1,5 +1,13 @@
 #!/usr/bin/env python3
 # -*- coding: utf8 -*-
 from .client import FastApiRedis
+from .async_client import AsyncFastApiRedis
+from .codecs import CODECS, Codec, CodecMixin, CompressionStats, get_codec, register_codec
+from .near_cache import NearCache, ClientTrackingInvalidator
+from .instrumentation import CommandMetrics, PrometheusSink, StatsdSink, command_metrics
+from .pool import MetricsBlockingConnectionPool, pool_metrics
+from .scripts import ScriptRegistry, hash_tag, scripts
 
-__all__ = ['FastApiRedis']
\ No newline at end of file
+__all__ = ['FastApiRedis', 'AsyncFastApiRedis', 'CODECS', 'Codec', 'CodecMixin', 'CompressionStats', 'get_codec', 'register_codec',
+           'NearCache', 'ClientTrackingInvalidator', 'MetricsBlockingConnectionPool', 'pool_metrics',
+           'ScriptRegistry', 'hash_tag', 'scripts', 'CommandMetrics', 'PrometheusSink', 'StatsdSink', 'command_metrics']
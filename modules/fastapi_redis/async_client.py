@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf8 -*-
+import logging
+from typing import Any, Optional
+
+from redis.asyncio import BlockingConnectionPool, Redis, StrictRedis
+from redis.asyncio.cluster import RedisCluster, ClusterNode
+
+from confs import redis_conf
+from .codecs import CodecMixin
+from .instrumentation import CommandInstrumentation, CommandMetrics, configure_metrics, mount_metrics_route
+from .pool import pool_options
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncFastApiRedis(CodecMixin):
+    """基于 redis.asyncio 的 Redis 客户端基类，支持单节点和集群模式，与 FastApiRedis 共用编解码配置"""
+
+    def __init__(self, app=None, strict=True, codec=None, prefix_codecs=None, **kwargs):
+        self._redis_client = None
+        self._instrumentation = None
+        self.init_codec(codec or redis_conf.codec, prefix_codecs or redis_conf.prefix_codecs,
+                        redis_conf.compress_threshold, redis_conf.compressor)
+        self.provider_class = StrictRedis if strict else Redis
+        self.provider_kwargs = kwargs
+        # 初始化
+        self.init_app(app) if app is not None else self.__init_conn()
+
+    def init_app(self, app, **kwargs):
+        """初始化应用配置，并在应用关闭时释放连接"""
+        self.provider_kwargs.update(kwargs)
+
+        self.__init_conn(app)
+        # 注册到app.extensions
+        if not hasattr(app, 'extensions'):
+            app.extensions = {}
+        app.extensions['async_redis'] = self
+        if self._instrumentation is not None:
+            mount_metrics_route(app, redis_conf.instrumentation.get('prometheus_path', '/metrics/redis'))
+        if hasattr(app, 'add_event_handler'):
+            app.add_event_handler('shutdown', self.close)
+
+    def __init_conn(self, app=None):
+        # 自动检测集群配置
+        use_cluster = getattr(app.config, "use_cluster", redis_conf.use_cluster) if app else redis_conf.use_cluster
+        if use_cluster:
+            self._init_cluster()
+        else:
+            self._init_single_node()
+        if redis_conf.instrumentation.get('enabled'):
+            self.enable_instrumentation()
+
+    def _init_cluster(self, app=None):
+        """初始化Redis集群连接（连接在首次执行命令时建立）"""
+        startup_nodes = app.config.get("startup_nodes", redis_conf.startup_nodes) if app else redis_conf.startup_nodes
+        pwd = redis_conf.password
+        nodes = [ClusterNode(node["host"], node["port"]) for node in startup_nodes]
+        if not self._redis_client:
+            options = pool_options(redis_conf.pool)
+            # 异步集群客户端按节点限制连接数，不支持阻塞等待
+            options.pop('timeout')
+            self._redis_client = RedisCluster(
+                startup_nodes=nodes,
+                password=pwd,
+                require_full_coverage=False,
+                **{**options, **self.provider_kwargs}
+            )
+            logger.info(f"Async Redis cluster configured: {nodes}")
+
+    def _init_single_node(self, app=None):
+        """初始化单节点连接"""
+        redis_url = getattr(app.config, "REDIS_URI", redis_conf.REDIS_URI) if app else redis_conf.REDIS_URI
+        if not self._redis_client:
+            pool = BlockingConnectionPool.from_url(redis_url, **{**pool_options(redis_conf.pool), **self.provider_kwargs})
+            self._redis_client = self.provider_class(connection_pool=pool)
+            logger.info(f"Async single node Redis configured: {redis_url}")
+
+    def enable_instrumentation(self, conf: Optional[dict] = None) -> CommandMetrics:
+        """安装命令埋点，与同步客户端共用全局统计，见 FastApiRedis.enable_instrumentation"""
+        metrics = configure_metrics(redis_conf.instrumentation if conf is None else conf)
+        if self._instrumentation is None:
+            self._instrumentation = CommandInstrumentation(metrics)
+            self._instrumentation.install(self._redis_client)
+        return metrics
+
+    def disable_instrumentation(self) -> None:
+        """卸载命令埋点"""
+        if self._instrumentation is not None:
+            self._instrumentation.uninstall()
+            self._instrumentation = None
+
+    @property
+    def is_cluster(self) -> bool:
+        """当前连接是否为集群客户端"""
+        return isinstance(self._redis_client, RedisCluster)
+
+    def _pipeline(self):
+        """非事务管道，集群模式下由 ClusterPipeline 按节点并发下发"""
+        if self.is_cluster:
+            return self._redis_client.pipeline()
+        return self._redis_client.pipeline(transaction=False)
+
+    async def _test_connection(self) -> bool:
+        """测试连接可用性"""
+        return await self._redis_client.ping()
+
+    def __getattr__(self, name: str) -> Any:
+        """代理到Redis客户端"""
+        return getattr(self._redis_client, name)
+
+    async def close(self) -> None:
+        """关闭连接"""
+        if self._redis_client:
+            await self._redis_client.aclose()
@@ -1,14 +1,19 @@
 #!/usr/bin/env python3
 # -*- coding: utf8 -*-
 import logging
-import pickle
-from typing import Any
+import time
+from typing import Any, Optional
 
 from redis import Redis, StrictRedis
 from redis.cluster import RedisCluster, ClusterNode
+from redis.sentinel import Sentinel
 from redis.exceptions import ConnectionError, RedisError
 
 from confs import redis_conf
+from .codecs import CodecMixin
+from .instrumentation import CommandInstrumentation, CommandMetrics, configure_metrics, mount_metrics_route
+from .pool import MetricsBlockingConnectionPool, pool_metrics, pool_options
+from .replicas import REPLICA_FAILURES, ClusterReplicaRouter, SentinelReplicaRouter
 
 try:
     import redis
@@ -18,11 +23,21 @@ except ImportError as e:
 logger = logging.getLogger(__name__)
 
 
-class FastApiRedis(object):
-    """Redis客户端基类，支持单节点和集群模式"""
+class FastApiRedis(CodecMixin):
+    """Redis客户端基类，支持单节点、Sentinel 和集群模式"""
 
-    def __init__(self, app=None, strict=True, **kwargs):
+    def __init__(self, app=None, strict=True, codec=None, prefix_codecs=None, read_from_replicas=None, **kwargs):
+        """
+        :param read_from_replicas: 读请求默认是否走副本（可读到稍旧数据），为空时取 redis_conf.read_from_replicas；
+                                   单次调用可通过 stale_ok 参数覆盖
+        """
         self._redis_client = None
+        self._sentinel = None
+        self._replicas = None
+        self._instrumentation = None
+        self.read_from_replicas = redis_conf.read_from_replicas if read_from_replicas is None else read_from_replicas
+        self.init_codec(codec or redis_conf.codec, prefix_codecs or redis_conf.prefix_codecs,
+                        redis_conf.compress_threshold, redis_conf.compressor)
         self.provider_class = StrictRedis if strict else Redis
         self.provider_kwargs = kwargs
         # 初始化
@@ -37,14 +52,21 @@ class FastApiRedis(object):
         if not hasattr(app, 'extensions'):
             app.extensions = {}
         app.extensions['redis'] = self
+        if self._instrumentation is not None:
+            mount_metrics_route(app, redis_conf.instrumentation.get('prometheus_path', '/metrics/redis'))
 
     def __init_conn(self, app=None):
         # 自动检测集群配置
         use_cluster = getattr(app.config, "use_cluster", redis_conf.use_cluster) if app else redis_conf.use_cluster
         if use_cluster:
             self._init_cluster()
+        elif redis_conf.sentinel:
+            self._init_sentinel()
         else:
             self._init_single_node()
+        self._init_replicas()
+        if redis_conf.instrumentation.get('enabled'):
+            self.enable_instrumentation()
 
     def _init_cluster(self, app=None):
         """初始化Redis集群连接"""
@@ -52,11 +74,20 @@ class FastApiRedis(object):
         pwd = redis_conf.password
         nodes = [ClusterNode(node["host"], node["port"]) for node in startup_nodes]
         if not self._redis_client:
+            options = pool_options(redis_conf.pool)
+            # NodesManager 只在 url 模式下使用 connection_pool_class，且只透传白名单内的连接参数，
+            # 因此以首个节点地址作为 url，timeout / health_check_interval 预置到连接池子类中
+            pool_class = MetricsBlockingConnectionPool.configure(
+                timeout=options.pop('timeout'),
+                health_check_interval=options.pop('health_check_interval'),
+            )
             self._redis_client = RedisCluster(
+                url=f"redis://{nodes[0].host}:{nodes[0].port}",
                 startup_nodes=nodes,
                 password=pwd,
                 require_full_coverage=False,
-                **self.provider_kwargs
+                connection_pool_class=pool_class,
+                **{**options, **self.provider_kwargs}
             )
             logger.info(f"Connected to Redis cluster: {nodes}")
 
@@ -64,33 +95,128 @@ class FastApiRedis(object):
         """初始化单节点连接"""
         redis_url = getattr(app.config, "REDIS_URI", redis_conf.REDIS_URI) if app else redis_conf.REDIS_URI
         if not self._redis_client:
-            self._redis_client = self.provider_class.from_url(redis_url, **self.provider_kwargs)
+            pool = MetricsBlockingConnectionPool.from_url(
+                redis_url, **{**pool_options(redis_conf.pool), **self.provider_kwargs})
+            self._redis_client = self.provider_class(connection_pool=pool)
             logger.info(f"Single node Redis connected: {redis_url}")
 
+    def _init_sentinel(self):
+        """初始化 Sentinel 管理的主从连接，主节点切换由 SentinelConnectionPool 自动发现"""
+        conf = redis_conf.sentinel
+        if not self._redis_client:
+            options = pool_options(redis_conf.pool)
+            # SentinelConnectionPool 为非阻塞连接池
+            options.pop('timeout')
+            sentinel_kwargs = {'socket_timeout': options.get('socket_timeout')}
+            if conf.get('password'):
+                sentinel_kwargs['password'] = conf['password']
+            self._sentinel = Sentinel(
+                [(node['host'], node['port']) for node in conf['sentinels']],
+                sentinel_kwargs=sentinel_kwargs,
+                password=redis_conf.password,
+                db=redis_conf.database,
+                **{**options, **self.provider_kwargs}
+            )
+            self._redis_client = self._sentinel.master_for(conf['service_name'], redis_class=self.provider_class)
+            logger.info(f"Redis sentinel configured: {conf['service_name']} {conf['sentinels']}")
+
+    def _init_replicas(self):
+        """集群或 Sentinel 模式下创建副本读路由（副本连接在首次使用时建立），供 read_from_replicas / stale_ok 使用"""
+        if self._replicas is not None:
+            return
+        options = {'strategy': redis_conf.replica_strategy}
+        if self.is_cluster:
+            self._replicas = ClusterReplicaRouter(self._redis_client, password=redis_conf.password,
+                                                  pool_config=redis_conf.pool, **options)
+        elif self._sentinel is not None:
+            self._replicas = SentinelReplicaRouter(self._sentinel, redis_conf.sentinel['service_name'],
+                                                   redis_class=self.provider_class, **options)
+        elif self.read_from_replicas:
+            logger.warning("read_from_replicas requires cluster or sentinel mode, reads stay on primary")
+
+    def _read(self, key, func, stale_ok: Optional[bool] = None):
+        """
+        执行只读操作 func(client)，stale_ok 为 True（为空时取 read_from_replicas）且有可用副本时发往副本，
+        副本连接失败、超时或只读错误时回退主节点，命令错误直接抛出
+        """
+        if stale_ok is None:
+            stale_ok = self.read_from_replicas
+        target = self._replicas.for_key(key) if stale_ok and self._replicas is not None else None
+        if target is None:
+            return func(self._redis_client)
+        name, client = target
+        st = time.perf_counter()
+        try:
+            result = func(client)
+        except REPLICA_FAILURES as e:
+            self._replicas.mark_failed(name, e)
+            return func(self._redis_client)
+        self._replicas.observe(name, time.perf_counter() - st)
+        return result
+
+    def enable_instrumentation(self, conf: Optional[dict] = None) -> CommandMetrics:
+        """
+        安装命令埋点：按命令与键前缀统计耗时直方图、字节数、错误数，超过阈值的命令记入慢日志
+        :param conf: 同 redis_conf.instrumentation，为空时取配置文件
+        """
+        metrics = configure_metrics(redis_conf.instrumentation if conf is None else conf)
+        if self._instrumentation is None:
+            self._instrumentation = CommandInstrumentation(metrics)
+            self._instrumentation.install(self._redis_client)
+            if self._replicas is not None:
+                self._replicas.instrument = self._instrumentation.install
+        return metrics
+
+    def disable_instrumentation(self) -> None:
+        """卸载命令埋点，恢复客户端原始方法"""
+        if self._instrumentation is None:
+            return
+        if self._replicas is not None:
+            self._replicas.instrument = None
+        self._instrumentation.uninstall()
+        self._instrumentation = None
+
+    def replica_stats(self) -> dict:
+        """各副本读次数、失败次数、延迟 EWMA 与健康状态"""
+        return self._replicas.stats() if self._replicas is not None else {}
+
     @classmethod
     def from_url(cls, url, **kwargs):
         instance = cls()
         instance._redis_client = instance.provider_class.from_url(url, **kwargs)
         return instance
 
-    @staticmethod
-    def safe_dumps(value: Any) -> bytes:
-        """安全序列化"""
-        return pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
-
-    @staticmethod
-    def safe_loads(data: bytes) -> Any:
-        """安全反序列化"""
-        try:
-            return pickle.loads(data)
-        except pickle.UnpicklingError as e:
-            logger.warning(f"Unpickling error: {e}")
-            return data.decode(errors='replace') if isinstance(data, bytes) else data
+    @property
+    def is_cluster(self) -> bool:
+        """当前连接是否为集群客户端"""
+        return isinstance(self._redis_client, RedisCluster)
 
     def _test_connection(self) -> bool:
         """测试连接可用性"""
         return self.ping()
 
+    def health_check(self) -> dict:
+        """逐个主节点 PING，返回 {节点: {'ok': bool, 'latency_ms': float, 'error': str}}"""
+        if self.is_cluster:
+            clients = [(node.name, self._redis_client.get_redis_connection(node))
+                       for node in self._redis_client.get_primaries()]
+        else:
+            clients = [('default', self._redis_client)]
+        result = {}
+        for name, client in clients:
+            st = time.perf_counter()
+            try:
+                client.ping()
+                result[name] = {'ok': True, 'latency_ms': round((time.perf_counter() - st) * 1000, 3)}
+            except RedisError as e:
+                result[name] = {'ok': False, 'latency_ms': None, 'error': str(e)}
+        return result
+
+    @staticmethod
+    def pool_stats() -> dict:
+        """按节点的连接池使用情况、取连接等待与命令耗时直方图"""
+        return pool_metrics.snapshot()
+
     def __getattr__(self, name: str) -> Any:
         """代理到Redis客户端"""
         return getattr(self._redis_client, name)
@@ -106,5 +232,8 @@ class FastApiRedis(object):
 
     def close(self) -> None:
         """关闭连接"""
+        if self._replicas is not None:
+            self._replicas.close()
+            self._replicas = None
         if self._redis_client:
             self._redis_client.close()
@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+# -*- coding: utf8 -*-
+"""
+Redis 值编解码器注册表
+
+每个值首字节为编码头：
+    0x80                      原生 pickle（pickle 协议头 PROTO，兼容历史数据与旧版本服务）
+    0x80 | 压缩<<4 | 序列化    其余编码，取值范围 0x81 ~ 0xBF
+
+0x81 ~ 0xBF 均为 UTF-8 续字节，不会与其他服务写入的文本/JSON 冲突。
+无法识别编码头的数据按旧逻辑处理：尝试 pickle，失败则按文本返回。
+"""
+import json
+import logging
+import pickle
+import threading
+import time
+import zlib
+from typing import Any, Callable, Dict, Optional
+
+try:
+    import orjson
+except ImportError as e:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError as e:
+    msgpack = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError as e:
+    lz4_frame = None
+
+try:
+    import zstandard
+except ImportError as e:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+HEADER_FLAG = 0x80
+DEFAULT_CODEC = 'pickle'
+
+
+class Serializer(object):
+    def __init__(self, sid: int, name: str, dumps: Callable[[Any], bytes], loads: Callable[[bytes], Any]):
+        self.sid = sid
+        self.name = name
+        self.dumps = dumps
+        self.loads = loads
+
+
+class Compressor(object):
+    def __init__(self, cid: int, name: str, compress: Callable[[bytes], bytes],
+                 decompress: Callable[[bytes], bytes]):
+        self.cid = cid
+        self.name = name
+        self.compress = compress
+        self.decompress = decompress
+
+
+class Codec(object):
+    """序列化器 + 可选压缩器"""
+
+    def __init__(self, name: str, serializer: Serializer, compressor: Optional[Compressor] = None):
+        self.name = name
+        self.serializer = serializer
+        self.compressor = compressor
+        self.header = HEADER_FLAG | ((compressor.cid if compressor else 0) << 4) | serializer.sid
+
+    def encode(self, value: Any) -> bytes:
+        return self.pack(self.serializer.dumps(value), self.compressor)
+
+    def pack(self, payload: bytes, compressor: Optional[Compressor] = None) -> bytes:
+        """为序列化结果加编码头，compressor 不为空时先压缩"""
+        if compressor is None:
+            if self.serializer is PICKLE:
+                # 未压缩的 pickle 直接以协议头 0x80 开头，旧版本服务也能读取
+                return payload
+            return bytes((HEADER_FLAG | self.serializer.sid,)) + payload
+        header = HEADER_FLAG | (compressor.cid << 4) | self.serializer.sid
+        return bytes((header,)) + compressor.compress(payload)
+
+    def __repr__(self):
+        return f'<Codec {self.name} header=0x{self.header:02x}>'
+
+
+def _pickle_dumps(value):
+    return pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _json_dumps(value):
+    if orjson is not None:
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'), default=str).encode('utf8')
+
+
+def _json_loads(data):
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+_zstd_local = threading.local()
+
+
+def _zstd_compress(data):
+    # ZstdCompressor 实例非线程安全，按线程缓存
+    if not hasattr(_zstd_local, 'compressor'):
+        _zstd_local.compressor = zstandard.ZstdCompressor(level=3)
+    return _zstd_local.compressor.compress(data)
+
+
+def _zstd_decompress(data):
+    if not hasattr(_zstd_local, 'decompressor'):
+        _zstd_local.decompressor = zstandard.ZstdDecompressor()
+    return _zstd_local.decompressor.decompress(data)
+
+
+PICKLE = Serializer(1, 'pickle', _pickle_dumps, pickle.loads)
+JSON = Serializer(2, 'json', _json_dumps, _json_loads)
+MSGPACK = Serializer(3, 'msgpack', lambda v: msgpack.packb(v, use_bin_type=True),
+                     lambda d: msgpack.unpackb(d, raw=False)) if msgpack is not None else None
+
+ZLIB = Compressor(1, 'zlib', lambda d: zlib.compress(d, 6), zlib.decompress)
+LZ4 = Compressor(2, 'lz4', lz4_frame.compress, lz4_frame.decompress) if lz4_frame is not None else None
+ZSTD = Compressor(3, 'zstd', _zstd_compress, _zstd_decompress) if zstandard is not None else None
+
+SERIALIZERS = {s.sid: s for s in (PICKLE, JSON, MSGPACK) if s is not None}
+COMPRESSORS = {c.cid: c for c in (ZLIB, LZ4, ZSTD) if c is not None}
+
+# 名称 -> Codec，如 pickle / json / msgpack / pickle+zstd / json+lz4
+CODECS: Dict[str, Codec] = {}
+
+
+def register_codec(serializer: Serializer, compressor: Optional[Compressor] = None) -> Codec:
+    """注册编解码器，名称为 序列化器[+压缩器]"""
+    name = serializer.name if compressor is None else f'{serializer.name}+{compressor.name}'
+    codec = Codec(name, serializer, compressor)
+    SERIALIZERS[serializer.sid] = serializer
+    if compressor is not None:
+        COMPRESSORS[compressor.cid] = compressor
+    CODECS[name] = codec
+    return codec
+
+
+for _serializer in list(SERIALIZERS.values()):
+    register_codec(_serializer)
+    for _compressor in list(COMPRESSORS.values()):
+        register_codec(_serializer, _compressor)
+
+
+def get_compressor(name) -> Compressor:
+    for compressor in COMPRESSORS.values():
+        if compressor.name == name:
+            return compressor
+    raise ValueError(f"Unknown or unavailable redis compressor: {name}, "
+                     f"available: {sorted(c.name for c in COMPRESSORS.values())}")
+
+
+def get_codec(codec) -> Codec:
+    if isinstance(codec, Codec):
+        return codec
+    try:
+        return CODECS[codec]
+    except KeyError:
+        raise ValueError(f"Unknown or unavailable redis codec: {codec}, available: {sorted(CODECS)}")
+
+
+def _legacy_loads(data: bytes) -> Any:
+    try:
+        return pickle.loads(data)
+    except Exception as e:
+        logger.warning(f"Unpickling error: {e}")
+        return data.decode(errors='replace') if isinstance(data, bytes) else data
+
+
+def is_compressed(data: bytes) -> bool:
+    return bool(data) and data[0] & 0xC0 == HEADER_FLAG and bool((data[0] >> 4) & 0x03)
+
+
+def decode(data: bytes) -> Any:
+    """按编码头解码，无编码头的数据按旧逻辑处理"""
+    if not isinstance(data, (bytes, bytearray, memoryview)) or not data:
+        return data
+    header = data[0]
+    if header == HEADER_FLAG:
+        return _legacy_loads(data)
+    serializer = SERIALIZERS.get(header & 0x0F) if header & 0xC0 == HEADER_FLAG else None
+    compressor_id = (header >> 4) & 0x03
+    if serializer is None or (compressor_id and compressor_id not in COMPRESSORS):
+        return _legacy_loads(data)
+    payload = memoryview(data)[1:]
+    if compressor_id:
+        payload = COMPRESSORS[compressor_id].decompress(payload)
+    return serializer.loads(bytes(payload) if isinstance(payload, memoryview) else payload)
+
+
+class CompressionStats(object):
+    """阈值压缩统计，用于调整压缩阈值"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.calls = 0
+        self.compressed = 0
+        self.below_threshold = 0
+        self.incompressible = 0
+        self.raw_bytes = 0
+        self.stored_bytes = 0
+        self.compress_seconds = 0.0
+        self.decompressed = 0
+        self.decompress_seconds = 0.0
+
+    def record_compress(self, raw_size, stored_size, elapsed, used):
+        with self._lock:
+            self.calls += 1
+            self.compress_seconds += elapsed
+            if used:
+                self.compressed += 1
+                self.raw_bytes += raw_size
+                self.stored_bytes += stored_size
+            else:
+                self.incompressible += 1
+
+    def record_skip(self):
+        with self._lock:
+            self.calls += 1
+            self.below_threshold += 1
+
+    def record_decompress(self, elapsed):
+        with self._lock:
+            self.decompressed += 1
+            self.decompress_seconds += elapsed
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'compressed': self.compressed,
+                'below_threshold': self.below_threshold,
+                'incompressible': self.incompressible,
+                'raw_bytes': self.raw_bytes,
+                'stored_bytes': self.stored_bytes,
+                'ratio': round(self.stored_bytes / self.raw_bytes, 4) if self.raw_bytes else 1.0,
+                'avg_compress_ms': round(self.compress_seconds * 1000 / self.compressed, 4)
+                if self.compressed else 0.0,
+                'decompressed': self.decompressed,
+                'avg_decompress_ms': round(self.decompress_seconds * 1000 / self.decompressed, 4)
+                if self.decompressed else 0.0,
+            }
+
+
+class CodecMixin(object):
+    """为 Redis 客户端提供按实例/按键前缀选择的编解码能力，以及按大小阈值的透明压缩"""
+
+    def init_codec(self, codec=None, prefix_codecs: Optional[Dict[str, str]] = None,
+                   compress_threshold: Optional[int] = None, compressor: str = 'zlib') -> None:
+        """
+        :param codec: 默认编解码器名称
+        :param prefix_codecs: {键前缀: 编解码器名称}，按最长前缀匹配
+        :param compress_threshold: 序列化结果超过该字节数时压缩，为空不压缩
+        :param compressor: 阈值压缩使用的算法 zlib/lz4/zstd
+        """
+        self._codec = get_codec(codec or DEFAULT_CODEC)
+        self._prefix_codecs = []
+        for prefix, name in (prefix_codecs or {}).items():
+            self.register_prefix_codec(prefix, name)
+        self.compression_stats = CompressionStats()
+        self.set_compression(compress_threshold, compressor)
+
+    def set_compression(self, threshold: Optional[int], compressor: str = 'zlib') -> None:
+        """设置压缩阈值（字节），threshold 为空时关闭阈值压缩"""
+        self._compress_threshold = threshold
+        self._threshold_compressor = get_compressor(compressor or 'zlib') if threshold is not None else None
+
+    def set_codec(self, codec) -> None:
+        self._codec = get_codec(codec)
+
+    def register_prefix_codec(self, prefix: str, codec) -> None:
+        self._prefix_codecs = [(p, c) for p, c in self._prefix_codecs if p != prefix]
+        self._prefix_codecs.append((prefix, get_codec(codec)))
+        self._prefix_codecs.sort(key=lambda item: len(item[0]), reverse=True)
+
+    def codec_for(self, key=None) -> Codec:
+        if key is not None and self._prefix_codecs:
+            if isinstance(key, bytes):
+                key = key.decode('utf-8', errors='replace')
+            for prefix, codec in self._prefix_codecs:
+                if key.startswith(prefix):
+                    return codec
+        return self._codec
+
+    def safe_dumps(self, value: Any, key=None) -> bytes:
+        """安全序列化"""
+        codec = self.codec_for(key)
+        if self._compress_threshold is None or codec.compressor is not None:
+            return codec.encode(value)
+        payload = codec.serializer.dumps(value)
+        if len(payload) < self._compress_threshold:
+            self.compression_stats.record_skip()
+            return codec.pack(payload)
+        st = time.perf_counter()
+        data = codec.pack(payload, self._threshold_compressor)
+        elapsed = time.perf_counter() - st
+        used = len(data) < len(payload)
+        self.compression_stats.record_compress(len(payload), len(data), elapsed, used)
+        logger.debug(f"Redis value compress key={key} {len(payload)} -> {len(data)} bytes, "
+                     f"{self._threshold_compressor.name} {round(elapsed * 1000, 3)}ms")
+        return data if used else codec.pack(payload)
+
+    def safe_loads(self, data: bytes) -> Any:
+        """安全反序列化"""
+        try:
+            if not isinstance(data, bytes) or not is_compressed(data):
+                return decode(data)
+            st = time.perf_counter()
+            value = decode(data)
+            self.compression_stats.record_decompress(time.perf_counter() - st)
+            return value
+        except Exception as e:
+            logger.warning(f"Redis value decode error: {e}")
+            return data.decode(errors='replace') if isinstance(data, bytes) else data
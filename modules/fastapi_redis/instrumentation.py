@@ -0,0 +1,448 @@
+#!/usr/bin/env python3
+# -*- coding: utf8 -*-
+"""
+Redis 命令埋点：按命令与键前缀统计耗时直方图、请求/响应字节数、错误数，并记录慢命令
+
+启用时替换客户端实例上的 execute_command / pipeline（集群模式下包括各节点客户端），
+关闭时恢复原方法；未启用时不做任何包装，对命令路径没有额外开销。
+管道整体记为 PIPELINE，管道内每条命令另记为 "PIPELINE <命令>"（计数、字节数、错误数，耗时为整批耗时均摊）。
+
+统计可通过可插拔的 sink 导出：
+    - PrometheusSink：拉取模式，render() 输出 Prometheus 文本格式，可挂载为 HTTP 接口
+    - StatsdSink：推送模式，UDP 批量发送 StatsD 计时/计数
+"""
+import inspect
+import itertools
+import logging
+import socket
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+from .pool import Histogram, pool_metrics
+
+logger = logging.getLogger(__name__)
+
+OTHER_PREFIX = '_other'
+NO_KEY_COMMANDS = {'PING', 'INFO', 'SCAN', 'KEYS', 'SCRIPT', 'SCRIPT LOAD', 'FLUSHDB', 'FLUSHALL', 'DBSIZE',
+                   'CLIENT', 'CLUSTER', 'READONLY', 'TIME', 'CONFIG', 'MULTI', 'EXEC'}
+SCRIPT_COMMANDS = {'EVAL', 'EVALSHA', 'EVAL_RO', 'EVALSHA_RO'}
+
+
+def _size(value) -> int:
+    if isinstance(value, (bytes, bytearray, memoryview, str)):
+        return len(value)
+    if isinstance(value, (list, tuple)):
+        return sum(len(item) for item in value if isinstance(item, (bytes, bytearray, str)))
+    if isinstance(value, dict):
+        return sum(len(item) for pair in value.items() for item in pair if isinstance(item, (bytes, bytearray, str)))
+    return 0
+
+
+class _CommandStats(object):
+    __slots__ = ('latency', 'errors', 'bytes_out', 'bytes_in')
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.errors = 0
+        self.bytes_out = 0
+        self.bytes_in = 0
+
+
+class MetricsSink(object):
+    """sink 基类，observe 在命令线程中同步调用，实现应尽量轻量"""
+
+    def observe(self, command: str, prefix: str, elapsed: float, bytes_out: int, bytes_in: int,
+                error: bool) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class CommandMetrics(object):
+    """按 (命令, 键前缀) 聚合的统计与慢命令记录"""
+
+    def __init__(self, slow_ms: float = 50, prefix_separator: str = ':', max_prefixes: int = 200,
+                 slow_log_size: int = 128):
+        """
+        :param slow_ms: 慢命令阈值（毫秒）
+        :param prefix_separator: 键前缀分隔符，取第一个分隔符之前的部分
+        :param max_prefixes: 键前缀数量上限，超出后归入 _other，避免标签基数失控
+        :param slow_log_size: 保留的最近慢命令条数
+        """
+        self.slow_seconds = slow_ms / 1000.0
+        self.prefix_separator = prefix_separator
+        self.max_prefixes = max_prefixes
+        self.sinks: List[MetricsSink] = []
+        self.slow_log = deque(maxlen=slow_log_size)
+        self._lock = threading.Lock()
+        self._stats: Dict[Tuple[str, str], _CommandStats] = {}
+        self._prefixes = set()
+
+    def key_prefix(self, command: str, args) -> str:
+        # 管道内命令记为 "PIPELINE <命令>"
+        if command.startswith('PIPELINE '):
+            command = command[len('PIPELINE '):]
+        if command in NO_KEY_COMMANDS or len(args) < 2:
+            return ''
+        key = args[3] if command in SCRIPT_COMMANDS and len(args) > 3 else args[1]
+        if isinstance(key, (bytes, bytearray)):
+            key = bytes(key[:64]).decode('utf8', errors='replace')
+        elif not isinstance(key, str):
+            return ''
+        prefix = key.split(self.prefix_separator, 1)[0].strip('{}')
+        if prefix in self._prefixes:
+            return prefix
+        with self._lock:
+            if len(self._prefixes) >= self.max_prefixes:
+                return OTHER_PREFIX
+            self._prefixes.add(prefix)
+        return prefix
+
+    def observe(self, command: str, args, elapsed: float, response=None, error: Optional[Exception] = None,
+                node: str = '') -> None:
+        prefix = self.key_prefix(command, args)
+        bytes_out = _size(args[1:]) if len(args) > 1 else 0
+        bytes_in = _size(response) if error is None else 0
+        with self._lock:
+            stats = self._stats.get((command, prefix))
+            if stats is None:
+                stats = self._stats[(command, prefix)] = _CommandStats()
+            stats.latency.observe(elapsed)
+            stats.bytes_out += bytes_out
+            stats.bytes_in += bytes_in
+            if error is not None:
+                stats.errors += 1
+        if elapsed >= self.slow_seconds:
+            key = args[1] if len(args) > 1 else ''
+            entry = {'time': time.time(), 'command': command, 'key': key, 'elapsed_ms': round(elapsed * 1000, 3),
+                     'bytes_out': bytes_out, 'bytes_in': bytes_in, 'node': node, 'error': str(error or '')}
+            self.slow_log.append(entry)
+            logger.warning(f"Redis slow command {command} {key!r} {entry['elapsed_ms']}ms "
+                           f"out={bytes_out}B in={bytes_in}B {node}")
+        for sink in self.sinks:
+            try:
+                sink.observe(command, prefix, elapsed, bytes_out, bytes_in, error is not None)
+            except Exception as e:
+                logger.debug(f"Redis metrics sink {sink} error: {e}")
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {f"{command} {prefix}".strip(): {
+                'command': command,
+                'prefix': prefix,
+                'errors': stats.errors,
+                'bytes_out': stats.bytes_out,
+                'bytes_in': stats.bytes_in,
+                **stats.latency.as_dict(),
+            } for (command, prefix), stats in self._stats.items()}
+
+    def items(self) -> List[tuple]:
+        """[(command, prefix, 统计副本)]，供 sink 导出"""
+        with self._lock:
+            result = []
+            for (command, prefix), stats in self._stats.items():
+                copy = _CommandStats()
+                copy.latency.counts = list(stats.latency.counts)
+                copy.latency.count, copy.latency.total = stats.latency.count, stats.latency.total
+                copy.latency.max = stats.latency.max
+                copy.errors, copy.bytes_out, copy.bytes_in = stats.errors, stats.bytes_out, stats.bytes_in
+                result.append((command, prefix, copy))
+            return result
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stats.clear()
+            self.slow_log.clear()
+
+
+class PrometheusSink(MetricsSink):
+    """Prometheus 文本格式导出（拉取模式），同时导出连接池统计"""
+
+    def __init__(self, metrics: CommandMetrics, namespace: str = 'redis'):
+        self.metrics = metrics
+        self.namespace = namespace
+
+    @staticmethod
+    def _labels(**labels) -> str:
+        return ','.join(f'{name}="{str(value).replace(chr(34), "")}"' for name, value in labels.items())
+
+    def render(self) -> str:
+        ns = self.namespace
+        lines = [
+            f'# HELP {ns}_command_duration_seconds Redis command latency',
+            f'# TYPE {ns}_command_duration_seconds histogram',
+        ]
+        items = self.metrics.items()
+        for command, prefix, stats in items:
+            labels = self._labels(command=command, prefix=prefix)
+            cumulative = 0
+            for bound, count in zip(stats.latency.bounds, stats.latency.counts):
+                cumulative += count
+                lines.append(f'{ns}_command_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'{ns}_command_duration_seconds_bucket{{{labels},le="+Inf"}} {stats.latency.count}')
+            lines.append(f'{ns}_command_duration_seconds_sum{{{labels}}} {stats.latency.total}')
+            lines.append(f'{ns}_command_duration_seconds_count{{{labels}}} {stats.latency.count}')
+        lines.append(f'# TYPE {ns}_command_errors_total counter')
+        for command, prefix, stats in items:
+            lines.append(f'{ns}_command_errors_total{{{self._labels(command=command, prefix=prefix)}}} {stats.errors}')
+        lines.append(f'# TYPE {ns}_command_bytes_total counter')
+        for command, prefix, stats in items:
+            for direction, value in (('out', stats.bytes_out), ('in', stats.bytes_in)):
+                labels = self._labels(command=command, prefix=prefix, direction=direction)
+                lines.append(f'{ns}_command_bytes_total{{{labels}}} {value}')
+        pools = pool_metrics.snapshot()
+        for name in ('in_use', 'idle', 'max_connections'):
+            lines.append(f'# TYPE {ns}_pool_{name} gauge')
+            for node, item in pools.items():
+                lines.append(f'{ns}_pool_{name}{{{self._labels(node=node)}}} {item[name]}')
+        for name in ('acquired', 'timeouts', 'created'):
+            lines.append(f'# TYPE {ns}_pool_{name}_total counter')
+            for node, item in pools.items():
+                lines.append(f'{ns}_pool_{name}_total{{{self._labels(node=node)}}} {item[name]}')
+        return '\n'.join(lines) + '\n'
+
+    def route(self):
+        """FastAPI 路由函数：app.add_api_route('/metrics/redis', sink.route())"""
+        from fastapi.responses import PlainTextResponse
+
+        def redis_metrics():
+            return PlainTextResponse(self.render(), media_type='text/plain; version=0.0.4')
+
+        return redis_metrics
+
+
+class StatsdSink(MetricsSink):
+    """StatsD UDP 推送，命令耗时按 sample_rate 采样后缓冲，按间隔或缓冲大小批量发送"""
+
+    MAX_DATAGRAM = 1432
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 8125, prefix: str = 'redis', sample_rate: float = 1.0,
+                 flush_interval: float = 1.0, max_buffer: int = 1000):
+        self.address = (host, int(port))
+        self.prefix = prefix
+        self.sample_rate = sample_rate
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.setblocking(False)
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        # itertools.count 的 next 在多线程下不会丢失计数
+        self._counter = itertools.count(1)
+        self._thread = threading.Thread(target=self._run, name='redis-statsd', daemon=True)
+        self._thread.start()
+
+    def observe(self, command, prefix, elapsed, bytes_out, bytes_in, error) -> None:
+        name = f"{self.prefix}.{command.lower().replace(' ', '_')}.{prefix or 'none'}"
+        lines = []
+        if self.sample_rate >= 1:
+            lines.append(f"{name}.duration:{elapsed * 1000:.3f}|ms")
+        else:
+            if next(self._counter) % max(int(1 / self.sample_rate), 1) == 0:
+                lines.append(f"{name}.duration:{elapsed * 1000:.3f}|ms|@{self.sample_rate}")
+        if error:
+            lines.append(f"{name}.errors:1|c")
+        if bytes_in:
+            lines.append(f"{name}.bytes_in:{bytes_in}|c")
+        if not lines:
+            return
+        with self._lock:
+            self._buffer.extend(lines)
+            full = len(self._buffer) >= self.max_buffer
+        if full:
+            self.flush()
+
+    def flush(self) -> None:
+        with self._lock:
+            lines, self._buffer = self._buffer, []
+        packet = ''
+        for line in lines:
+            if packet and len(packet) + len(line) + 1 > self.MAX_DATAGRAM:
+                self._send(packet)
+                packet = ''
+            packet = f"{packet}\n{line}" if packet else line
+        if packet:
+            self._send(packet)
+
+    def _send(self, packet: str) -> None:
+        try:
+            self._socket.sendto(packet.encode('utf8'), self.address)
+        except OSError as e:
+            logger.debug(f"StatsD send failed: {e}")
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def close(self) -> None:
+        self._stop.set()
+        self.flush()
+        self._socket.close()
+
+
+def _command_name(args) -> str:
+    if not args:
+        return ''
+    command = args[0]
+    if isinstance(command, bytes):
+        command = command.decode('utf8', errors='replace')
+    return str(command).upper()
+
+
+def _pipeline_commands(stack) -> list:
+    """管道命令栈中各命令的参数，兼容 Pipeline（(args, options)）与集群管道（PipelineCommand）"""
+    return [item.args if hasattr(item, 'args') else item[0] for item in stack]
+
+
+def _observe_pipeline(metrics, commands, elapsed, response=None, error=None, node='') -> None:
+    metrics.observe('PIPELINE', ('PIPELINE',), elapsed, error=error, node=f"{node} n={len(commands)}".strip())
+    if not commands:
+        return
+    share = elapsed / len(commands)
+    results = response if isinstance(response, list) and len(response) == len(commands) else [None] * len(commands)
+    for args, result in zip(commands, results):
+        failed = error if error is not None else result if isinstance(result, Exception) else None
+        metrics.observe(f"PIPELINE {_command_name(args)}", args, share, None if failed else result,
+                        error=failed, node=node)
+
+
+class CommandInstrumentation(object):
+    """在客户端实例上安装 / 卸载命令埋点"""
+
+    def __init__(self, metrics: CommandMetrics):
+        self.metrics = metrics
+        self._patched = []
+
+    def _wrap_execute(self, client, node=''):
+        original = client.execute_command
+        metrics = self.metrics
+
+        if inspect.iscoroutinefunction(original):
+            async def execute_command(*args, **options):
+                st = time.perf_counter()
+                try:
+                    response = await original(*args, **options)
+                except Exception as e:
+                    metrics.observe(_command_name(args), args, time.perf_counter() - st, error=e, node=node)
+                    raise
+                metrics.observe(_command_name(args), args, time.perf_counter() - st, response, node=node)
+                return response
+        else:
+            def execute_command(*args, **options):
+                st = time.perf_counter()
+                try:
+                    response = original(*args, **options)
+                except Exception as e:
+                    metrics.observe(_command_name(args), args, time.perf_counter() - st, error=e, node=node)
+                    raise
+                metrics.observe(_command_name(args), args, time.perf_counter() - st, response, node=node)
+                return response
+
+        return execute_command
+
+    def _wrap_pipeline(self, client, node=''):
+        original = client.pipeline
+        metrics = self.metrics
+
+        def pipeline(*args, **kwargs):
+            pipe = original(*args, **kwargs)
+            execute = pipe.execute
+
+            # execute 会清空命令栈，需在执行前取出
+            if inspect.iscoroutinefunction(execute):
+                async def execute_pipeline(*e_args, **e_kwargs):
+                    commands = _pipeline_commands(pipe.command_stack)
+                    st = time.perf_counter()
+                    try:
+                        response = await execute(*e_args, **e_kwargs)
+                    except Exception as e:
+                        _observe_pipeline(metrics, commands, time.perf_counter() - st, error=e, node=node)
+                        raise
+                    _observe_pipeline(metrics, commands, time.perf_counter() - st, response, node=node)
+                    return response
+            else:
+                def execute_pipeline(*e_args, **e_kwargs):
+                    commands = _pipeline_commands(pipe.command_stack)
+                    st = time.perf_counter()
+                    try:
+                        response = execute(*e_args, **e_kwargs)
+                    except Exception as e:
+                        _observe_pipeline(metrics, commands, time.perf_counter() - st, error=e, node=node)
+                        raise
+                    _observe_pipeline(metrics, commands, time.perf_counter() - st, response, node=node)
+                    return response
+
+            pipe.execute = execute_pipeline
+            return pipe
+
+        return pipeline
+
+    def install(self, client, node: str = '') -> None:
+        """为客户端实例安装埋点，已安装时忽略"""
+        if getattr(client, '_instrumented', False):
+            return
+        client.execute_command = self._wrap_execute(client, node)
+        client.pipeline = self._wrap_pipeline(client, node)
+        client._instrumented = True
+        self._patched.append(client)
+        # 集群：各节点客户端（批量操作直接在节点客户端上执行管道）在首次获取时安装
+        if hasattr(client, 'get_redis_connection') and not inspect.iscoroutinefunction(client.execute_command):
+            get_redis_connection = client.get_redis_connection
+
+            def get_node_connection(cluster_node):
+                node_client = get_redis_connection(cluster_node)
+                if node_client is not None:
+                    self.install(node_client, cluster_node.name)
+                return node_client
+
+            client.get_redis_connection = get_node_connection
+
+    def uninstall(self) -> None:
+        for client in self._patched:
+            for name in ('execute_command', 'pipeline', 'get_redis_connection', '_instrumented'):
+                client.__dict__.pop(name, None)
+        self._patched = []
+
+
+command_metrics = CommandMetrics()
+_sinks: Dict[str, MetricsSink] = {}
+_sinks_lock = threading.Lock()
+
+
+def configure_metrics(conf: Optional[dict] = None) -> CommandMetrics:
+    """
+    按 redis_conf.instrumentation 设置全局命令统计的慢命令阈值与 sink，同步/异步客户端共用，重复调用不重复创建 sink
+    :param conf: {slow_ms, sinks: ['prometheus', 'statsd'], statsd: {host, port, prefix, sample_rate}}
+    """
+    conf = conf or {}
+    command_metrics.slow_seconds = conf.get('slow_ms', 50) / 1000.0
+    with _sinks_lock:
+        for name in conf.get('sinks') or []:
+            if name in _sinks:
+                continue
+            if name == 'prometheus':
+                _sinks[name] = PrometheusSink(command_metrics)
+            elif name == 'statsd':
+                _sinks[name] = StatsdSink(**(conf.get('statsd') or {}))
+                command_metrics.sinks.append(_sinks[name])
+            else:
+                raise ValueError(f"Unknown redis metrics sink: {name}, available: ['prometheus', 'statsd']")
+    return command_metrics
+
+
+def get_sink(name: str) -> Optional[MetricsSink]:
+    return _sinks.get(name)
+
+
+def mount_metrics_route(app, path: str = '/metrics/redis') -> None:
+    """配置了 prometheus sink 时在应用上挂载文本格式指标接口，重复调用忽略"""
+    sink = _sinks.get('prometheus')
+    if sink is None or not hasattr(app, 'add_api_route'):
+        return
+    if any(getattr(route, 'path', None) == path for route in app.router.routes):
+        return
+    app.add_api_route(path, sink.route(), methods=['GET'], include_in_schema=False)
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+# -*- coding: utf8 -*-
+"""进程内近端缓存（near cache），基于 Redis 6 CLIENT TRACKING 失效通知保持一致性"""
+import itertools
+import logging
+import threading
+import time
+from collections import OrderedDict
+from fnmatch import fnmatchcase
+from typing import Any, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+INVALIDATE_CHANNEL = '__redis__:invalidate'
+
+
+def _normalize_key(key) -> str:
+    if isinstance(key, bytes):
+        return key.decode('utf-8', errors='surrogateescape')
+    return str(key)
+
+
+class NearCache(object):
+    """
+    线程安全的 LRU + TTL 本地缓存，同时限制条目数与字节数
+
+    缓存的是反序列化后的对象，调用方不应修改 get 返回的可变对象。
+    未与失效通知通道建立连接时（available=False）所有读写均直接旁路。
+    """
+
+    MISSING = object()
+
+    def __init__(self, max_entries: int = 10000, max_bytes: int = 64 * 1024 * 1024, ttl: float = 60):
+        """
+        :param max_entries: 最大条目数
+        :param max_bytes: 最大占用字节数（按 Redis 原始值长度估算）
+        :param ttl: 本地条目存活时间（秒），作为失效通知丢失时的兜底
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+
+        self._lock = threading.RLock()
+        # key -> (value, size, expire_at)
+        self._data = OrderedDict()
+        self._pending = {}
+        self._tokens = itertools.count(1)
+        self._bytes = 0
+        self._available = False
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @property
+    def available(self) -> bool:
+        return self._available
+
+    def set_available(self, available: bool) -> None:
+        """失效通道状态变化时调用，不可用时清空本地数据避免读到脏值"""
+        with self._lock:
+            self._available = available
+            if not available:
+                self._clear()
+
+    def get(self, key) -> Any:
+        """命中返回缓存对象，否则返回 NearCache.MISSING"""
+        if not self._available:
+            return self.MISSING
+        key = _normalize_key(key)
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return self.MISSING
+            value, size, expire_at = entry
+            if expire_at < time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return self.MISSING
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def reserve(self, key) -> Optional[int]:
+        """
+        未命中回源前登记占位，回源期间若收到该键的失效通知则占位被撤销，
+        put 时不再写入，避免把旧值放回本地缓存
+        """
+        if not self._available:
+            return None
+        key = _normalize_key(key)
+        with self._lock:
+            if len(self._pending) > self.max_entries * 2:
+                self._pending.clear()
+            token = next(self._tokens)
+            self._pending[key] = token
+            return token
+
+    def put(self, key, value: Any, size: int, token: Optional[int]) -> bool:
+        if token is None or not self._available:
+            return False
+        key = _normalize_key(key)
+        with self._lock:
+            if self._pending.get(key) != token:
+                return False
+            self._pending.pop(key, None)
+            if size > self.max_bytes:
+                return False
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (value, size, time.monotonic() + self.ttl)
+            self._bytes += size
+            self._evict()
+            return True
+
+    def invalidate(self, keys: Iterable) -> None:
+        with self._lock:
+            for key in keys:
+                key = _normalize_key(key)
+                self._pending.pop(key, None)
+                if key in self._data:
+                    self._remove(key)
+                    self.invalidations += 1
+
+    def invalidate_pattern(self, pattern) -> None:
+        pattern = _normalize_key(pattern)
+        with self._lock:
+            matched = [k for k in list(self._data) + list(self._pending) if fnmatchcase(k, pattern)]
+            self.invalidate(matched)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'available': self._available,
+                'entries': len(self._data),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+            }
+
+    def __len__(self):
+        return len(self._data)
+
+    def _clear(self):
+        self._data.clear()
+        self._pending.clear()
+        self._bytes = 0
+
+    def _remove(self, key):
+        _, size, _ = self._data.pop(key)
+        self._bytes -= size
+
+    def _evict(self):
+        while self._data and (len(self._data) > self.max_entries or self._bytes > self.max_bytes):
+            key, (_, size, _) = self._data.popitem(last=False)
+            self._bytes -= size
+            self.evictions += 1
+
+
+class ClientTrackingInvalidator(object):
+    """
+    为近端缓存维护 Redis 失效通知通道（RESP2 + REDIRECT + BCAST）
+
+    每个主节点使用两条独立连接：
+        - 订阅连接：SUBSCRIBE __redis__:invalidate 接收失效键
+        - 控制连接：CLIENT TRACKING ON REDIRECT <订阅连接ID> BCAST [PREFIX ...]
+    BCAST 模式下失效通知与连接池中哪条连接读取过该键无关，因此无需改造连接池。
+    任一通道断开时清空近端缓存并置为不可用，重连成功后恢复。
+    """
+
+    def __init__(self, redis_client, near_cache: NearCache, prefixes: Optional[List[str]] = None,
+                 health_check_interval: float = 15, reconnect_delay: float = 1):
+        self.redis_client = redis_client
+        self.near_cache = near_cache
+        self.prefixes = prefixes or []
+        self.health_check_interval = health_check_interval
+        self.reconnect_delay = reconnect_delay
+
+        self._stop = threading.Event()
+        self._threads = []
+        self._healthy = {}
+        self._lock = threading.Lock()
+
+    def _node_clients(self):
+        """单节点返回客户端本身，集群返回所有主节点的 Redis 实例"""
+        if hasattr(self.redis_client, 'get_primaries'):
+            return [(node.name, self.redis_client.get_redis_connection(node))
+                    for node in self.redis_client.get_primaries()]
+        return [('default', self.redis_client)]
+
+    def start(self) -> None:
+        self._stop.clear()
+        for name, client in self._node_clients():
+            self._healthy[name] = False
+            thread = threading.Thread(target=self._run, args=(name, client),
+                                      name=f'redis-tracking-{name}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self) -> None:
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout=self.health_check_interval)
+        self._threads = []
+        self.near_cache.set_available(False)
+
+    def _set_healthy(self, name, healthy):
+        with self._lock:
+            self._healthy[name] = healthy
+            self.near_cache.set_available(all(self._healthy.values()))
+
+    def _connect(self, client):
+        pool = client.connection_pool
+        subscriber = pool.connection_class(**pool.connection_kwargs)
+        controller = pool.connection_class(**pool.connection_kwargs)
+        subscriber.send_command('CLIENT', 'ID')
+        client_id = subscriber.read_response()
+        subscriber.send_command('SUBSCRIBE', INVALIDATE_CHANNEL)
+        subscriber.read_response()
+
+        args = ['CLIENT', 'TRACKING', 'ON', 'REDIRECT', client_id, 'BCAST']
+        for prefix in self.prefixes:
+            args.extend(['PREFIX', prefix])
+        controller.send_command(*args)
+        controller.read_response()
+        return subscriber, controller
+
+    def _handle_message(self, message):
+        if not isinstance(message, list) or len(message) < 3:
+            return
+        kind = _normalize_key(message[0])
+        if kind != 'message':
+            return
+        keys = message[2]
+        if keys is None:
+            # FLUSHDB / FLUSHALL 时负载为空，整体失效
+            self.near_cache.clear()
+        else:
+            self.near_cache.invalidate(keys if isinstance(keys, list) else [keys])
+
+    def _run(self, name, client):
+        while not self._stop.is_set():
+            subscriber = controller = None
+            try:
+                subscriber, controller = self._connect(client)
+                self._set_healthy(name, True)
+                logger.info(f"Redis client tracking enabled on {name}")
+                last_check = time.monotonic()
+                while not self._stop.is_set():
+                    if subscriber.can_read(timeout=1):
+                        self._handle_message(subscriber.read_response())
+                    if time.monotonic() - last_check >= self.health_check_interval:
+                        controller.send_command('PING')
+                        controller.read_response()
+                        last_check = time.monotonic()
+            except Exception as e:
+                logger.warning(f"Redis client tracking on {name} lost: {e}")
+            finally:
+                self._set_healthy(name, False)
+                for conn in (subscriber, controller):
+                    if conn is not None:
+                        conn.disconnect()
+            self._stop.wait(self.reconnect_delay)
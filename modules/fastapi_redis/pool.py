@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# -*- coding: utf8 -*-
+"""
+带统计的 Redis 连接池
+
+    - MetricsBlockingConnectionPool：BlockingConnectionPool 子类，记录取连接等待时间、取连接超时、
+      新建连接数，以及连接占用时长（get_connection -> release，对普通命令即命令往返耗时）
+    - pool_metrics.snapshot()：按节点汇总 in_use / idle / 等待与占用直方图
+"""
+import bisect
+import threading
+import time
+import weakref
+from typing import Dict, Optional
+
+from redis import BlockingConnectionPool
+from redis.exceptions import ConnectionError
+
+# 默认连接池配置，可在 yaml redis.pool 中覆盖
+DEFAULT_POOL_CONFIG = {
+    # 每个节点的最大连接数（每个进程）
+    'max_connections': 64,
+    # 连接耗尽时等待的秒数，超时抛出 ConnectionError
+    'timeout': 5,
+    'socket_timeout': 5,
+    'socket_connect_timeout': 3,
+    'socket_keepalive': True,
+    # 空闲超过该秒数的连接在使用前先 PING
+    'health_check_interval': 30,
+    'retry_on_timeout': True,
+}
+
+
+class Histogram(object):
+    """固定桶直方图（单位：秒）"""
+
+    BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)
+
+    def __init__(self, buckets=None):
+        self.bounds = tuple(buckets or self.BUCKETS)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> float:
+        """按桶上界估算分位数"""
+        if not self.count:
+            return 0.0
+        target, seen = q * self.count, 0
+        for bound, count in zip(self.bounds + (self.max,), self.counts):
+            seen += count
+            if seen >= target:
+                return min(bound, self.max)
+        return self.max
+
+    def as_dict(self) -> dict:
+        labels = [f"le_{b}" for b in self.bounds] + ['le_inf']
+        return {
+            'count': self.count,
+            'avg_ms': round(self.total * 1000 / self.count, 3) if self.count else 0.0,
+            'p50_ms': round(self.quantile(0.5) * 1000, 3),
+            'p99_ms': round(self.quantile(0.99) * 1000, 3),
+            'max_ms': round(self.max * 1000, 3),
+            'histogram': dict(zip(labels, self.counts)),
+        }
+
+
+class _NodePoolStats(object):
+    def __init__(self):
+        self.acquired = 0
+        self.timeouts = 0
+        self.created = 0
+        self.wait = Histogram()
+        self.hold = Histogram()
+
+
+class PoolMetrics(object):
+    """所有 MetricsBlockingConnectionPool 的统计汇总，按节点 host:port 区分"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._nodes: Dict[str, _NodePoolStats] = {}
+        self._pools = weakref.WeakSet()
+
+    def register(self, pool) -> None:
+        with self._lock:
+            self._pools.add(pool)
+            self._nodes.setdefault(pool.node_name, _NodePoolStats())
+
+    def _stats(self, node) -> _NodePoolStats:
+        stats = self._nodes.get(node)
+        if stats is None:
+            stats = self._nodes.setdefault(node, _NodePoolStats())
+        return stats
+
+    def observe_wait(self, node, elapsed: float, acquired: bool) -> None:
+        with self._lock:
+            stats = self._stats(node)
+            if acquired:
+                stats.acquired += 1
+                stats.wait.observe(elapsed)
+            else:
+                stats.timeouts += 1
+
+    def observe_hold(self, node, elapsed: float) -> None:
+        with self._lock:
+            self._stats(node).hold.observe(elapsed)
+
+    def incr_created(self, node) -> None:
+        with self._lock:
+            self._stats(node).created += 1
+
+    def snapshot(self) -> dict:
+        """{节点: {in_use, idle, max_connections, acquired, timeouts, created, wait, hold}}"""
+        with self._lock:
+            pools = list(self._pools)
+            result = {node: {
+                'in_use': 0,
+                'idle': 0,
+                'max_connections': 0,
+                'acquired': stats.acquired,
+                'timeouts': stats.timeouts,
+                'created': stats.created,
+                'wait': stats.wait.as_dict(),
+                'hold': stats.hold.as_dict(),
+            } for node, stats in self._nodes.items()}
+        for pool in pools:
+            item = result.get(pool.node_name)
+            if item is None:
+                continue
+            in_use, idle = pool.usage()
+            item['in_use'] += in_use
+            item['idle'] += idle
+            item['max_connections'] += pool.max_connections
+        return result
+
+    def reset(self) -> None:
+        with self._lock:
+            self._nodes = {node: _NodePoolStats() for node in self._nodes}
+
+
+pool_metrics = PoolMetrics()
+
+
+class MetricsBlockingConnectionPool(BlockingConnectionPool):
+    """
+    带统计的阻塞连接池
+    集群模式下 NodesManager 只透传部分连接参数，因此 timeout / health_check_interval 等通过
+    configure() 生成的子类以类属性注入
+    """
+
+    default_kwargs: Dict = {}
+
+    @classmethod
+    def configure(cls, **kwargs) -> type:
+        """返回预置连接池参数的子类，用作 RedisCluster 的 connection_pool_class"""
+        return type(cls.__name__, (cls,), {'default_kwargs': {**cls.default_kwargs, **kwargs}})
+
+    def __init__(self, *args, **kwargs):
+        kwargs = {**self.default_kwargs, **kwargs}
+        super().__init__(*args, **kwargs)
+        self.node_name = f"{self.connection_kwargs.get('host', 'localhost')}:{self.connection_kwargs.get('port', 6379)}"
+        pool_metrics.register(self)
+
+    def make_connection(self):
+        connection = super().make_connection()
+        pool_metrics.incr_created(self.node_name)
+        return connection
+
+    def get_connection(self, command_name, *keys, **options):
+        st = time.perf_counter()
+        try:
+            connection = super().get_connection(command_name, *keys, **options)
+        except ConnectionError as e:
+            if 'No connection available' in str(e):
+                pool_metrics.observe_wait(self.node_name, time.perf_counter() - st, False)
+            raise
+        now = time.perf_counter()
+        pool_metrics.observe_wait(self.node_name, now - st, True)
+        connection._checkout_at = now
+        return connection
+
+    def release(self, connection):
+        checkout_at = getattr(connection, '_checkout_at', None)
+        if checkout_at is not None:
+            pool_metrics.observe_hold(self.node_name, time.perf_counter() - checkout_at)
+            connection._checkout_at = None
+        super().release(connection)
+
+    def usage(self) -> tuple:
+        """(使用中连接数, 空闲连接数)"""
+        idle = sum(1 for connection in list(self.pool.queue) if connection is not None)
+        return max(len(self._connections) - idle, 0), idle
+
+
+def pool_options(config: Optional[dict] = None) -> dict:
+    """合并默认连接池配置"""
+    options = dict(DEFAULT_POOL_CONFIG)
+    options.update(config or {})
+    return options
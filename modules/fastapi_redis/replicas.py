@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+# -*- coding: utf8 -*-
+"""
+只读副本路由：允许读到稍旧数据的读请求发往副本，副本异常时回退主节点
+
+    - ClusterReplicaRouter：按 slot 所在分片选择副本（READONLY 连接），拓扑取自 RedisCluster 的 slots_cache
+    - SentinelReplicaRouter：Sentinel 管理的单主部署，副本由 SentinelConnectionPool 轮询
+
+选择策略：round_robin 轮询；least_latency 选择读耗时 EWMA 最低的副本（少量请求随机探测其他副本）。
+只有连接错误、超时与 READONLY 错误视为副本故障并回退主节点，命令错误（如 WRONGTYPE）直接抛出。
+"""
+import itertools
+import logging
+import random
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Tuple
+
+from redis import Redis
+from redis.exceptions import ConnectionError, ReadOnlyError, TimeoutError
+from redis.utils import str_if_bytes
+
+from .pool import MetricsBlockingConnectionPool, pool_options
+
+logger = logging.getLogger(__name__)
+
+STRATEGIES = ('round_robin', 'least_latency')
+
+# 视为副本故障（冷却并回退主节点）的异常
+REPLICA_FAILURES = (ConnectionError, TimeoutError, ReadOnlyError)
+
+
+def _readonly_connect(connection) -> None:
+    """副本连接建立后发送 READONLY，允许在集群副本上执行读命令"""
+    connection.on_connect()
+    connection.send_command('READONLY')
+    if str_if_bytes(connection.read_response()) != 'OK':
+        raise ConnectionError('READONLY command failed')
+
+
+class _ReplicaStats(object):
+    __slots__ = ('reads', 'failures', 'ewma', 'down_until')
+
+    def __init__(self):
+        self.reads = 0
+        self.failures = 0
+        self.ewma = None
+        self.down_until = 0.0
+
+
+class ReplicaRouter(ABC):
+    """副本选择、延迟统计与故障冷却，子类实现 for_key / for_primary 提供拓扑"""
+
+    def __init__(self, strategy: str = 'round_robin', cooldown: float = 5, explore_ratio: float = 0.05,
+                 alpha: float = 0.2):
+        """
+        :param strategy: round_robin / least_latency
+        :param cooldown: 副本读失败后暂停使用的秒数
+        :param explore_ratio: least_latency 下随机选择其他副本的比例，用于刷新延迟统计
+        :param alpha: EWMA 平滑系数
+        """
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown replica strategy: {strategy}, available: {STRATEGIES}")
+        self.strategy = strategy
+        self.cooldown = cooldown
+        self.explore_ratio = explore_ratio
+        self.alpha = alpha
+        self._lock = threading.Lock()
+        self._stats: Dict[str, _ReplicaStats] = {}
+        self._counters: Dict[str, itertools.count] = {}
+        # 命令埋点安装函数 instrument(client, name)，由 FastApiRedis.enable_instrumentation 设置
+        self.instrument = None
+
+    def _stat(self, name) -> _ReplicaStats:
+        stat = self._stats.get(name)
+        if stat is None:
+            stat = self._stats.setdefault(name, _ReplicaStats())
+        return stat
+
+    def choose(self, group: str, candidates: List[str]) -> Optional[str]:
+        """从候选副本中选择一个，全部处于冷却期时返回 None（走主节点）"""
+        now = time.monotonic()
+        with self._lock:
+            healthy = [name for name in candidates if self._stat(name).down_until <= now]
+            if not healthy:
+                return None
+            if len(healthy) == 1:
+                return healthy[0]
+            if self.strategy == 'least_latency':
+                unknown = [name for name in healthy if self._stats[name].ewma is None]
+                if unknown:
+                    return unknown[0]
+                if random.random() < self.explore_ratio:
+                    return random.choice(healthy)
+                return min(healthy, key=lambda name: self._stats[name].ewma)
+            counter = self._counters.get(group)
+            if counter is None:
+                counter = self._counters[group] = itertools.count()
+            return healthy[next(counter) % len(healthy)]
+
+    def observe(self, name: str, elapsed: float) -> None:
+        with self._lock:
+            stat = self._stat(name)
+            stat.reads += 1
+            stat.ewma = elapsed if stat.ewma is None else stat.ewma + self.alpha * (elapsed - stat.ewma)
+
+    def mark_failed(self, name: str, error) -> None:
+        with self._lock:
+            stat = self._stat(name)
+            stat.failures += 1
+            stat.down_until = time.monotonic() + self.cooldown
+        logger.warning(f"Redis replica {name} read failed, fallback to primary for {self.cooldown}s: {error}")
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            return {name: {
+                'reads': stat.reads,
+                'failures': stat.failures,
+                'ewma_ms': round(stat.ewma * 1000, 3) if stat.ewma is not None else None,
+                'healthy': stat.down_until <= now,
+            } for name, stat in self._stats.items()}
+
+    @abstractmethod
+    def for_key(self, key) -> Optional[Tuple[str, Redis]]:
+        """返回 (副本名, 客户端)，无可用副本时返回 None"""
+
+    @abstractmethod
+    def for_primary(self, primary_name: str) -> Optional[Tuple[str, Redis]]:
+        """返回主节点 primary_name 所在分片的 (副本名, 客户端)，无可用副本时返回 None"""
+
+    def close(self) -> None:
+        pass
+
+
+class ClusterReplicaRouter(ReplicaRouter):
+    """集群副本路由，每个副本节点一个 READONLY 连接池"""
+
+    def __init__(self, cluster, password=None, pool_config: Optional[dict] = None, refresh_interval: float = 30,
+                 **kwargs):
+        """
+        :param cluster: RedisCluster 实例
+        :param password: 节点密码
+        :param pool_config: 副本连接池配置，同 redis_conf.pool
+        :param refresh_interval: 分片拓扑缓存刷新间隔（秒）
+        """
+        super().__init__(**kwargs)
+        self.cluster = cluster
+        self.password = password
+        self.pool_config = pool_config
+        self.refresh_interval = refresh_interval
+        self._clients: Dict[str, Redis] = {}
+        self._shards: Dict[str, List[str]] = {}
+        self._refreshed_at = 0.0
+
+    def _shard_map(self) -> Dict[str, List[str]]:
+        """{主节点名: [副本节点名, ...]}"""
+        if time.monotonic() - self._refreshed_at >= self.refresh_interval:
+            shards = {}
+            for nodes in list(self.cluster.nodes_manager.slots_cache.values()):
+                if nodes and nodes[0].name not in shards:
+                    shards[nodes[0].name] = [node.name for node in nodes[1:]]
+            self._shards, self._refreshed_at = shards, time.monotonic()
+        return self._shards
+
+    def _client(self, name) -> Redis:
+        client = self._clients.get(name)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(name)
+                if client is None:
+                    host, port = name.rsplit(':', 1)
+                    pool = MetricsBlockingConnectionPool(host=host, port=int(port), password=self.password,
+                                                         redis_connect_func=_readonly_connect,
+                                                         **pool_options(self.pool_config))
+                    client = self._clients[name] = Redis(connection_pool=pool)
+        if self.instrument is not None:
+            self.instrument(client, name)
+        return client
+
+    def for_primary(self, primary_name: str) -> Optional[Tuple[str, Redis]]:
+        name = self.choose(primary_name, self._shard_map().get(primary_name) or [])
+        return (name, self._client(name)) if name else None
+
+    def for_key(self, key) -> Optional[Tuple[str, Redis]]:
+        nodes = self.cluster.nodes_manager.slots_cache.get(self.cluster.keyslot(key))
+        if not nodes or len(nodes) < 2:
+            return None
+        name = self.choose(nodes[0].name, [node.name for node in nodes[1:]])
+        return (name, self._client(name)) if name else None
+
+    def close(self) -> None:
+        with self._lock:
+            clients, self._clients = list(self._clients.values()), {}
+        for client in clients:
+            client.close()
+
+
+class SentinelReplicaRouter(ReplicaRouter):
+    """Sentinel 部署的副本路由，副本之间的轮询与无副本时回退主节点由 SentinelConnectionPool 完成"""
+
+    NAME = 'sentinel-replicas'
+
+    def __init__(self, sentinel, service_name: str, redis_class=Redis, **kwargs):
+        super().__init__(**kwargs)
+        self.client = sentinel.slave_for(service_name, redis_class=redis_class)
+
+    def for_key(self, key) -> Optional[Tuple[str, Redis]]:
+        if self.instrument is not None:
+            self.instrument(self.client, self.NAME)
+        return (self.NAME, self.client) if self.choose(self.NAME, [self.NAME]) else None
+
+    def for_primary(self, primary_name: str) -> Optional[Tuple[str, Redis]]:
+        return self.for_key(None)
+
+    def close(self) -> None:
+        self.client.close()
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+# -*- coding: utf8 -*-
+"""
+Lua 脚本注册表
+
+脚本在注册时计算 SHA1，调用时直接 EVALSHA；节点上没有缓存该脚本（NOSCRIPT，如首次调用、节点重启、
+故障切换后）时改用 EVAL 执行一次，EVAL 同时会把脚本缓存到该节点，之后的调用恢复为 EVALSHA。
+集群模式下脚本的所有 KEYS 必须位于同一个 slot，使用 hash_tag 构造同槽键。
+
+>>> scripts.execute(client, 'incr_expire', keys=['counter'], args=[60])
+"""
+import hashlib
+import logging
+import threading
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+from redis.crc import key_slot
+from redis.exceptions import NoScriptError
+
+logger = logging.getLogger(__name__)
+
+
+def hash_tag(tag, *parts) -> str:
+    """构造集群同槽键 {tag}:part1:part2"""
+    return ':'.join([f"{{{tag}}}", *[str(part) for part in parts]])
+
+
+def _encode_key(key) -> bytes:
+    return key if isinstance(key, bytes) else str(key).encode('utf8')
+
+
+class LuaScript(object):
+    __slots__ = ('name', 'source', 'sha')
+
+    def __init__(self, name: str, source: str):
+        self.name = name
+        self.source = source
+        self.sha = hashlib.sha1(source.encode('utf8')).hexdigest()
+
+    def __repr__(self):
+        return f'<LuaScript {self.name} {self.sha[:8]}>'
+
+
+class ScriptRegistry(object):
+    """按名称注册 Lua 脚本，同步/异步客户端、单节点/集群通用"""
+
+    def __init__(self):
+        self._scripts: Dict[str, LuaScript] = {}
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    def register(self, name: str, source: str) -> LuaScript:
+        """注册脚本，同名脚本内容不同时覆盖"""
+        script = LuaScript(name, source)
+        with self._lock:
+            self._scripts[name] = script
+            self._stats.setdefault(name, {'calls': 0, 'noscript': 0, 'errors': 0})
+        return script
+
+    def get(self, name: str) -> LuaScript:
+        try:
+            return self._scripts[name]
+        except KeyError:
+            raise KeyError(f"Unknown redis script: {name}, registered: {sorted(self._scripts)}")
+
+    def __contains__(self, name) -> bool:
+        return name in self._scripts
+
+    def names(self) -> List[str]:
+        return sorted(self._scripts)
+
+    def _incr(self, name, field, value=1) -> None:
+        with self._lock:
+            self._stats[name][field] += value
+
+    @staticmethod
+    def check_slot(client, keys: Sequence) -> None:
+        """集群模式下校验脚本的 KEYS 位于同一 slot"""
+        if len(keys) > 1 and hasattr(client, 'get_primaries'):
+            if len({key_slot(_encode_key(key)) for key in keys}) > 1:
+                raise ValueError(f"Redis script keys must hash to the same slot, use hash_tag(): {list(keys)}")
+
+    def execute(self, client, name: str, keys: Sequence = (), args: Sequence = ()):
+        """EVALSHA 执行脚本，NOSCRIPT 时回退 EVAL"""
+        script = self.get(name)
+        self.check_slot(client, keys)
+        self._incr(name, 'calls')
+        try:
+            return client.evalsha(script.sha, len(keys), *keys, *args)
+        except NoScriptError:
+            self._incr(name, 'noscript')
+            return client.eval(script.source, len(keys), *keys, *args)
+        except Exception:
+            self._incr(name, 'errors')
+            raise
+
+    async def aexecute(self, client, name: str, keys: Sequence = (), args: Sequence = ()):
+        """execute 的异步版本，client 为 redis.asyncio 客户端"""
+        script = self.get(name)
+        self.check_slot(client, keys)
+        self._incr(name, 'calls')
+        try:
+            return await client.evalsha(script.sha, len(keys), *keys, *args)
+        except NoScriptError:
+            self._incr(name, 'noscript')
+            return await client.eval(script.source, len(keys), *keys, *args)
+        except Exception:
+            self._incr(name, 'errors')
+            raise
+
+    def execute_many(self, client, name: str, calls: Iterable[Tuple[Sequence, Sequence]],
+                     raise_on_error: bool = True) -> list:
+        """
+        在一个非事务管道中批量执行同一脚本，集群模式下按节点并发下发
+        :param calls: [(keys, args), ...]
+        :param raise_on_error: 为 False 时失败的调用以异常对象作为结果返回
+        :return: 与 calls 顺序一致的结果
+        """
+        script = self.get(name)
+        calls = list(calls)
+        if not calls:
+            return []
+        for keys, _ in calls:
+            self.check_slot(client, keys)
+        self._incr(name, 'calls', len(calls))
+        with client.pipeline(transaction=False) as pipe:
+            for keys, args in calls:
+                pipe.evalsha(script.sha, len(keys), *keys, *args)
+            results = pipe.execute(raise_on_error=False)
+        for index, result in enumerate(results):
+            if isinstance(result, NoScriptError):
+                # 脚本未缓存到该节点，单独 EVAL 一次
+                self._incr(name, 'noscript')
+                keys, args = calls[index]
+                try:
+                    results[index] = client.eval(script.source, len(keys), *keys, *args)
+                except Exception as e:
+                    results[index] = e
+            if isinstance(results[index], Exception):
+                self._incr(name, 'errors')
+                if raise_on_error:
+                    raise results[index]
+        return results
+
+    def load(self, client) -> None:
+        """预加载全部脚本（集群模式下 SCRIPT LOAD 下发到所有主节点）"""
+        for script in list(self._scripts.values()):
+            client.script_load(script.source)
+
+    def stats(self) -> dict:
+        """各脚本调用次数、NOSCRIPT 回退次数、失败次数"""
+        with self._lock:
+            return {name: dict(item) for name, item in self._stats.items()}
+
+
+scripts = ScriptRegistry()
+
+# ---- 原子操作库 ----
+
+# 自增并在首次（或计数键没有过期时间时）设置过期时间（秒）
+scripts.register('incr_expire', """
+local count = redis.call('INCR', KEYS[1])
+if count == 1 or redis.call('TTL', KEYS[1]) == -1 then
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+end
+return count
+""")
+
+# 键存在时返回 {0, 当前值}（ARGV[3] == '1' 时顺带刷新过期时间），否则写入 ARGV[1] 并返回 {1, ARGV[1]}
+scripts.register('get_or_set', """
+local value = redis.call('GET', KEYS[1])
+if value then
+    if ARGV[3] == '1' and tonumber(ARGV[2]) > 0 then
+        redis.call('PEXPIRE', KEYS[1], ARGV[2])
+    end
+    return {0, value}
+end
+if tonumber(ARGV[2]) > 0 then
+    redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+else
+    redis.call('SET', KEYS[1], ARGV[1])
+end
+return {1, ARGV[1]}
+""")
+
+# 当前值等于 ARGV[1]（ARGV[4] == '1' 时要求键不存在）才写入 ARGV[2]，ARGV[3] 为过期毫秒数，0 表示保留原过期时间
+scripts.register('compare_and_set', """
+local current = redis.call('GET', KEYS[1])
+if ARGV[4] == '1' then
+    if current then
+        return 0
+    end
+elseif current ~= ARGV[1] then
+    return 0
+end
+if tonumber(ARGV[3]) > 0 then
+    redis.call('SET', KEYS[1], ARGV[2], 'PX', ARGV[3])
+elseif current then
+    redis.call('SET', KEYS[1], ARGV[2], 'KEEPTTL')
+else
+    redis.call('SET', KEYS[1], ARGV[2])
+end
+return 1
+""")
+
+# 逐个比较 KEYS[i] 的值与 ARGV[i]，相等时删除，返回删除数量
+scripts.register('delete_if_equals', """
+local deleted = 0
+for i, key in ipairs(KEYS) do
+    if redis.call('GET', key) == ARGV[i] then
+        deleted = deleted + redis.call('UNLINK', key)
+    end
+end
+return deleted
+""")
+
+# 有界计数：增加 ARGV[1] 后落在 [ARGV[2], ARGV[3]] 内才生效，返回 {是否生效, 当前值}；ARGV[4] 为首次创建时的过期毫秒数
+scripts.register('bounded_incr', """
+local current = tonumber(redis.call('GET', KEYS[1]) or '0')
+local value = current + tonumber(ARGV[1])
+if (ARGV[2] ~= '' and value < tonumber(ARGV[2])) or (ARGV[3] ~= '' and value > tonumber(ARGV[3])) then
+    return {0, current}
+end
+value = redis.call('INCRBY', KEYS[1], ARGV[1])
+if tonumber(ARGV[4]) > 0 and redis.call('PTTL', KEYS[1]) == -1 then
+    redis.call('PEXPIRE', KEYS[1], ARGV[4])
+end
+return {1, value}
+""")
+
+# 登记标签成员：ARGV[1] 为成员，ARGV[2] 为成员过期秒数（0 表示不过期）
+# 标签集合的过期时间不短于成员中最长的过期时间；一旦有不过期的成员，集合不再设置过期时间
+scripts.register('tag_add', """
+local ex = tonumber(ARGV[2])
+if ex <= 0 then
+    redis.call('SADD', KEYS[1], ARGV[1])
+    redis.call('PERSIST', KEYS[1])
+    return 1
+end
+local ttl = redis.call('TTL', KEYS[1])
+redis.call('SADD', KEYS[1], ARGV[1])
+if ttl == -2 or (ttl >= 0 and ttl < ex) then
+    redis.call('EXPIRE', KEYS[1], ex)
+end
+return 1
+""")
@@ -43,3 +43,19 @@ def get_db_session():
     #     print(dir(session))
     #     if hasattr(session, 'close'):
     #         session.close()
+
+
+async def get_async_db_session():
+    """get_db_session 的异步版本，数据库等待不阻塞事件循环"""
+    async with postgres_conn.async_session_factory() as session:
+        try:
+            yield session
+        except IllegalStateChangeError as e:
+            await session.rollback()
+            logger.warning('IllegalStateChangeError -> ', exc_info=True)
+        except InvalidRequestError as e:
+            logger.warning('InvalidRequestError -> ', exc_info=True)
+        except Exception as e:
+            await session.rollback()
+            logger.warning('ExceptionError -> ', exc_info=True)
+            raise
@@ -1,6 +1,9 @@
 #!/usr/bin/env python3
 # -*- coding: utf8 -*-
+import csv
 import gzip
+import io
+import json
 import math
 import requests
 import mimetypes
@@ -79,27 +82,116 @@ def handle_bytes(value):
     return value
 
 
+JSON_ENCODERS = {
+    datetime: return_date_time_no_ms,
+    ObjectId: return_objectid2string,
+    float: handle_special_floats,
+    bytes: handle_bytes
+}
+
+
 def service_json_response(code, data, columns=None, total=None, http_code=200, message='',
-                          convert_json_response=True, *args, **kwargs):
+                          convert_json_response=True, next_cursor=None, prev_cursor=None, *args, **kwargs):
+    """
+    :param next_cursor: 键集分页的下一页游标（PostgresConn.paginate 返回的 KeysetPage.next_cursor）
+    :param prev_cursor: 键集分页的上一页游标
+    """
     if isinstance(data, (JSONResponse, StreamingResponse, Response)):
         return data
     _message = message if code == -1 else CODEMAPPING[str(code)]
     result = {'code': code, 'data': data, 'message': _message}
     if total is not None:
         result['total'] = total
+    if next_cursor is not None:
+        result['next_cursor'] = next_cursor
+    if prev_cursor is not None:
+        result['prev_cursor'] = prev_cursor
     if columns is not None:
         result['columns'] = columns
     if not convert_json_response:
         return result
-    json_content = jsonable_encoder(result, custom_encoder={
-        datetime: return_date_time_no_ms,
-        ObjectId: return_objectid2string,
-        float: handle_special_floats,
-        bytes: handle_bytes
-    })
+    json_content = jsonable_encoder(result, custom_encoder=JSON_ENCODERS)
     return JSONResponse(json_content, status_code=http_code)
 
 
+def row_to_dict(row):
+    """查询结果行（Row / ORM 实体 / dict）转为 dict"""
+    if isinstance(row, dict):
+        return row
+    if hasattr(row, '_mapping'):
+        return dict(row._mapping)
+    if hasattr(row, '__table__'):
+        return {column.key: getattr(row, column.key) for column in row.__mapper__.column_attrs}
+    return {'value': row}
+
+
+def _iter_rows(rows):
+    """展开 select(stream_=n) 返回的分批结果"""
+    for item in rows:
+        if isinstance(item, list):
+            yield from item
+        else:
+            yield item
+
+
+def _attachment(response, filename):
+    if filename:
+        response.headers['Access-Control-Expose-Headers'] = 'Content-Disposition'
+        response.headers['Content-Disposition'] = 'attachment; filename={}'.format(
+            quote_plus(filename, safe="/:@&+$,-_.!~*'()"))
+    return response
+
+
+def stream_csv_response(rows, columns=None, filename='export.csv', chunk_rows=1000):
+    """
+    流式导出 CSV，配合 PostgresConn.select(..., stream_=True) 使用，内存占用与总行数无关
+    :param rows: 行（或行列表）的迭代器
+    :param columns: 列名，为空时取第一行的键
+    :param filename: 下载文件名，为空时不设置 Content-Disposition
+    :param chunk_rows: 每个响应分块包含的行数
+    :return:
+    """
+    def generate():
+        buffer = io.StringIO()
+        writer, fields, count = None, columns, 0
+        for row in _iter_rows(rows):
+            row = jsonable_encoder(row_to_dict(row), custom_encoder=JSON_ENCODERS)
+            if writer is None:
+                fields = fields or list(row)
+                writer = csv.DictWriter(buffer, fieldnames=fields, extrasaction='ignore')
+                writer.writeheader()
+            writer.writerow(row)
+            count += 1
+            if count % chunk_rows == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        if writer is None and columns:
+            csv.writer(buffer).writerow(columns)
+        if buffer.tell():
+            yield buffer.getvalue()
+
+    return _attachment(StreamingResponse(generate(), media_type='text/csv; charset=utf-8'), filename)
+
+
+def stream_jsonl_response(rows, filename=None, chunk_rows=1000):
+    """
+    流式导出 JSON Lines（每行一个 JSON 对象），参数同 stream_csv_response
+    """
+    def generate():
+        lines = []
+        for row in _iter_rows(rows):
+            row = jsonable_encoder(row_to_dict(row), custom_encoder=JSON_ENCODERS)
+            lines.append(json.dumps(row, ensure_ascii=False))
+            if len(lines) >= chunk_rows:
+                yield '\n'.join(lines) + '\n'
+                lines = []
+        if lines:
+            yield '\n'.join(lines) + '\n'
+
+    return _attachment(StreamingResponse(generate(), media_type='application/x-ndjson'), filename)
+
+
 def compress(content, compresslevel=6):
     gzip_buffer = BytesIO()
     if isinstance(content, BytesIO):